@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 '''
  Script that if needed:
- 1. Edits sdwan_release file
-    in a VM where local-stack runs
- 2. Stops local-stack
- 3. Starts local-stack with options: -l onprem -p sdwan_release
+ 1. Downloads and publishes the missing sdwan builds
+    concurrently in a VM where local-stack runs
+ 2. Edits sdwan_release file
+ 3. Stops local-stack
+ 4. Starts local-stack with options: -l onprem -p sdwan_release
+ Steps 3 and 4 run once for all builds, and only when a build
+ was added or published. With -C a build found in the node-side
+ cache (see release_cache.py) is streamed to the VM instead of
+ being downloaded by publish-sdwan.sh, and a downloaded build is
+ archived back into the cache.
 
   +-------+           +-------------+
   |       |    ssh    |             |
@@ -16,105 +22,169 @@
   -i I        VM ip where local-stack is running
   -u U        VM username
   -p P        VM password
-  -b R        SDWAN build
+  -b R        SDWAN builds i.e. -b 11.2.2_14 11.3.0_5
+  -t T        Deadline in seconds for each status_file transition
+  -C C        Node-side sdwan build cache directory
+  --cache_size S
+              Size cap of the build cache in GiB (default: 50)
 
 '''
-import time
 import sys
 import re
-import pathlib
 import argparse
-import paramiko
+import timing
+import remote_exec
+import status_watcher
+import image_cache
+import release_cache
+from concurrent.futures import ThreadPoolExecutor
 
 LS_BASEPATH = '/local-stack'
 
+def release_state(client, builds):
+    # One round-trip: "<build> <in sdwan_release> <published>" per build
+    cmd = "; ".join(f"echo {build} $(grep -q '{build}' {LS_BASEPATH}/sdwan_release && echo 1 || echo 0) "
+                    f"$([ -d {LS_BASEPATH}/sdwan_releases/{build} ] && echo 1 || echo 0)" for build in builds)
+    stdin, stdout, stderr = client.exec_command(cmd)
+    state = {}
+    for line in stdout.readlines():
+        fields = line.split()
+        if len(fields) == 3:
+            state[fields[0]] = (fields[1] == '1', fields[2] == '1')
+    if stdout.channel.recv_exit_status() or len(state) != len(builds):
+        sys.exit('Could not check for ' + ', '.join(builds))
+    return state
+
+def push_build(client, cache, build, cached):
+    # The archive is extracted next to sdwan_releases and only moved in place once it is complete and verified
+    archive_path, checksum = cached
+    part_path = f"{LS_BASEPATH}/sdwan_releases/.{build}.part"
+    cmd = f"rm -rf {part_path} && mkdir -p {part_path} && tar -xf - -C {part_path}"
+    stdin, stdout, stderr = client.exec_command(cmd)
+    channel = stdout.channel
+    try:
+        for chunk in cache.read(build, archive_path, checksum):
+            channel.sendall(chunk)
+    except release_cache.ChecksumMismatch as e:
+        print(f"Dropped cached sdwan build {e}")
+        verified = False
+    else:
+        verified = True
+    channel.shutdown_write()
+    err = stderr.read().decode().strip()
+    if channel.recv_exit_status() == 0 and verified:
+        cmd = f"mv {part_path}/{build} {LS_BASEPATH}/sdwan_releases/{build} && rm -rf {part_path}"
+    else:
+        if err and verified:
+            print(f"Could not extract cached sdwan build {build}: {err}")
+        cmd = f"rm -rf {part_path}; exit 1"
+    stdin, stdout, stderr = client.exec_command(cmd)
+    return stdout.channel.recv_exit_status() == 0
+
+def archive_build(client, cache, build):
+    import paramiko
+    stdin, stdout, stderr = client.exec_command(f"tar -C {LS_BASEPATH}/sdwan_releases -cf - {build}")
+    channel = stdout.channel
+
+    def chunks():
+        for chunk in iter(lambda: channel.recv(image_cache.CHUNK_SIZE), b''):
+            yield chunk
+        if channel.recv_exit_status():
+            raise IOError(stderr.read().decode().strip() or f"tar of {build} failed")
+
+    try:
+        cache.put(build, chunks())
+    except (IOError, paramiko.SSHException) as e:
+        print(f"Could not cache sdwan build {build}: {e}")
+
+def publish_build(client, build, cache=None):
+    if cache:
+        cached = cache.get(build)
+        if cached:
+            print(f"Copying sdwan build {build} from cache")
+            if push_build(client, cache, build, cached):
+                return True
+    major = build.split('_')[0]
+    minor = build.split('_')[1]
+    version_path = f"{LS_BASEPATH}/sdwan_releases/{build}"
+    print(f"Downloading and publishing sdwan build {build}")
+    cmd = f"mkdir -p {version_path} && {LS_BASEPATH}/buildManager/publish-sdwan.sh {major} {minor} -d {version_path} -o linux"
+    # Several builds publish at once, tell their lines apart
+    on_line = lambda stream, line: remote_exec.print_line(stream, f"{build}: {line}")
+    if remote_exec.run(client, cmd, on_line=on_line, collect=False).exit_status == 0:
+        if cache:
+            archive_build(client, cache, build)
+        return True
+    print(f"Could not publish sdwan build, deleting directory {version_path} ...")
+    cmd = f"rm -rf {version_path}"
+    stdin, stdout, stderr = client.exec_command(cmd)
+    if stdout.channel.recv_exit_status():
+        print(f"Could not delete the directory {version_path}")
+    return False
+
 def main(script_namespace):
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
     vm_ip = script_namespace.i
     vm_user = script_namespace.u
     vm_pass = script_namespace.p
-    build = script_namespace.b
+    builds = list(dict.fromkeys(script_namespace.b))
+    deadline = script_namespace.t
+    cache = release_cache.ReleaseCache(script_namespace.C, int(script_namespace.cache_size * image_cache.GIB)) \
+        if script_namespace.C else None
 
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
-
-        print('Checking and adding entry')
-        cmd = f"if grep -q '{build}' {LS_BASEPATH}/sdwan_release;then >&2 echo '{build} already exists';else echo {build} >> {LS_BASEPATH}/sdwan_release;fi"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        for line in stderr.readlines():
-            print(line)
-            if 'already exists' in line:
-                release_exists = True
-                print('....')
-        if stdout.channel.recv_exit_status():
-            sys.exit('Could not check for ' + release)
-
-        
-        print("Checking existence of sdwan build")
-        major = build.split('_')[0]
-        minor = build.split('_')[1]
-        version_path = f"{LS_BASEPATH}/sdwan_releases/{build}"
-        cmd = f"[ -d {version_path} ]"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        if stdout.channel.recv_exit_status():
-            print(f"Downloading and publishing sdwan build")
-            cmd = f"mkdir -p {version_path} && {LS_BASEPATH}/buildManager/publish-sdwan.sh {major} {minor} -d {version_path} -o linux"
+        client = ssh_pool.get_client(vm_ip, vm_user, vm_pass)
+
+        print("Checking existence of sdwan builds")
+        state = release_state(client, builds)
+        for build, (listed, published) in state.items():
+            if published:
+                print(f"sdwan build {build} already exists")
+        missing = [build for build in builds if not state[build][1]]
+        with ThreadPoolExecutor(max_workers=max(len(missing), 1)) as executor:
+            published = dict(zip(missing, executor.map(lambda build: publish_build(client, build, cache), missing)))
+        if cache and missing:
+            print("Build cache:", image_cache.format_stats(cache.stats))
+            cache.save_stats()
+        failed = [build for build, ok in published.items() if not ok]
+
+        print('Checking and adding entries')
+        new_entries = [build for build in builds if not state[build][0] and build not in failed]
+        for build in builds:
+            if state[build][0]:
+                print(f"{build} already exists")
+        if new_entries:
+            cmd = f"printf '%s\\n' {' '.join(new_entries)} >> {LS_BASEPATH}/sdwan_release"
             stdin, stdout, stderr = client.exec_command(cmd)
-            for line in stdout.readlines():
-                print(line)
             if stdout.channel.recv_exit_status():
-                print(f"Could not publish sdwan build, deleting directory {version_path} ...")
-                cmd = f"rm -rf {version_path}"
-                stdin, stdout, stderr = client.exec_command(cmd)
-                if stdout.channel.recv_exit_status():
-                    sys.exit('Could not delete the directory')
-                else:
-                    sys.exit()
-        else:
-            print(f"sdwan build {build} already exists")
-            sys.exit()
-
+                sys.exit('Could not add ' + ', '.join(new_entries))
 
+        # A single restart picks up every new build, none is needed when nothing changed
+        if new_entries or any(published.values()):
+            print('Bringing down local-stack')
+            cmd = f"cd {LS_BASEPATH} && ./local-stack.sh down"
+            remote_exec.run(client, cmd)
 
-        print('Bringing down local-stack')
-        cmd = f"cd {LS_BASEPATH} && ./local-stack.sh down"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        while True:
-            print(stdout.readline())
-            if stdout.channel.exit_status_ready():
-                break
-
-        cmd = f"cat {LS_BASEPATH}/status_file"
-        status_down = False
-        while status_down is False:
-            stdin, stdout, stderr = client.exec_command(cmd)
-            for line in stdout.readlines():
-                print(line)
-                if 'Down' in line:
-                    status_down = True
-            time.sleep(5)
+            status_watcher.wait_for_status(client, lambda status: 'Down' in status, deadline)
 
 
-        print('Bringing up local-stack')
-        cmd = f"cd {LS_BASEPATH} && ./local-stack.sh up -i {vm_ip} -l onprem -p sdwan_release > local-stack-logs.out 2>&1 &"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        while not stdout.channel.exit_status_ready():
-            pass
+            print('Bringing up local-stack')
+            cmd = f"cd {LS_BASEPATH} && ./local-stack.sh up -i {vm_ip} -l onprem -p sdwan_release > local-stack-logs.out 2>&1 &"
+            remote_exec.run(client, cmd)
 
 
-        cmd = f"cat {LS_BASEPATH}/status_file"
-        status_up = False
-        while status_up is False:
-            stdin, stdout, stderr = client.exec_command(cmd)
-            for line in stdout.readlines():
-                print(line)
-                if line == "UP\n":
-                    status_up = True
-            time.sleep(20)
+            status_watcher.wait_for_status(client, lambda status: status == 'UP', deadline)
+        else:
+            print("Nothing changed, local-stack is not restarted")
 
 
         client.close()
+        if failed:
+            sys.exit('Could not publish sdwan build ' + ', '.join(failed))
+    except status_watcher.StatusTimeout as e:
+        sys.exit(f"Local-stack did not reach the expected state: {e}")
     except paramiko.AuthenticationException:
         sys.exit('Authentication failed')
     except paramiko.ssh_exception.BadHostKeyException:
@@ -122,13 +192,16 @@ def main(script_namespace):
     except paramiko.SSHException:
         sys.exit('Unable to establish SSH connection')
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Add sdwan build in local-stack')
     parser.add_argument('-i', help='VM ip where local-stack is running', required=True)
     parser.add_argument('-u', help='VM username', required=True)
     parser.add_argument('-p', help='VM password', required=True)
-    parser.add_argument('-b', help='SDWAN build', required=True)
-    script_namespace = parser.parse_args()
+    parser.add_argument('-b', nargs='+', help='SDWAN builds', required=True)
+    parser.add_argument('-t', type=int, default=3600, help='Deadline in seconds for each status_file transition (default: 3600)')
+    parser.add_argument('-C', '--cache_dir', dest='C', default=None, help='Node-side sdwan build cache directory, builds are downloaded only on a cache miss')
+    parser.add_argument('--cache_size', type=float, default=image_cache.DEFAULT_MAX_GIB, help='Size cap of the build cache in GiB (default: 50)')
+    script_namespace = parser.parse_args(argv)
 
     # Check IP validity
     pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
@@ -137,8 +210,12 @@ if __name__ == "__main__":
 
     # Check build validity
     pattern = re.compile("^\d{1,2}\.\d{1,2}\.\d{1,2}_\d{1,5}$")
-    if not pattern.match(script_namespace.b):
-        sys.exit('Invalid build format i.e. 11.2.2_14')
+    for build in script_namespace.b:
+        if not pattern.match(build):
+            sys.exit(f'Invalid build format {build} i.e. 11.2.2_14')
 
+    timing.start()
     main(script_namespace)
 
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+'''
+ Asyncio backend for remote execution. Commands run as channels
+ of the ssh_pool transports, but instead of a thread blocked in
+ readlines() per command, the event loop watches each channel's
+ fileno(), which paramiko makes readable when output or EOF
+ arrive, so one loop streams hundreds of commands at once.
+ The exit status that follows EOF is polled for. A pool thread only carries
+ the handshake and the channel-open round-trip. A transport runs
+ at most max_sessions channels at a time, OpenSSH's MaxSessions.
+
+  +-------+   1 event loop, N chans   +-------------+
+  |       |==========================>|             |
+  | node  |   output pushed to the    | local-stack |
+  |       |<==========================|             |
+  +-------+          loop             +-------------+
+
+ The interface follows remote_exec, ssh_pool and sftp_upload:
+   client = await async_exec.connect(vm_ip, vm_user, vm_pass)
+   result = await client.run(cmd, timeout=60)    # remote_exec.Result, lines streamed to on_line
+   status, out, err = await client.read(cmd)     # like ssh_pool.run
+   await client.upload(local_path, remote_path)  # sftp_upload.upload
+
+ Scripts choose the backend with run_commands(jobs, backend=...),
+ 'thread' runs every command on a worker thread with remote_exec,
+ 'async' runs all of them on one event loop.
+
+'''
+import asyncio
+import remote_exec
+import sftp_upload
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_SESSIONS = 10
+BACKENDS = ('thread', 'async')
+READ_SIZE = 32768
+# Guards against a channel state change that arrives without making fileno() readable
+STATUS_POLL = 0.5
+# fileno() stays readable from EOF on, the exit status after it is polled this often
+EXIT_POLL = 0.01
+
+
+class AsyncClient:
+    def __init__(self, pooled, max_sessions=MAX_SESSIONS):
+        self.pooled = pooled
+        self.sessions = asyncio.Semaphore(max_sessions)
+
+    async def open(self, command, get_pty=False):
+        # exec_command waits for the server's reply, a pool thread takes that round-trip
+        loop = asyncio.get_running_loop()
+        stdin, stdout, stderr = await loop.run_in_executor(
+            None, lambda: self.pooled.exec_command(command, get_pty=get_pty))
+        stdin.close()
+        return stdout.channel
+
+    async def run(self, command, timeout=None, on_line=remote_exec.print_line, collect=True, get_pty=False):
+        '''
+        Returns a remote_exec.Result once the command exits, streaming
+        its lines to on_line(stream, line); None stays quiet. Raises
+        remote_exec.RemoteTimeout after timeout seconds.
+        '''
+        async with self.sessions:
+            channel = await self.open(command, get_pty)
+            try:
+                return await asyncio.wait_for(_stream(channel, on_line, collect), timeout)
+            except asyncio.TimeoutError:
+                raise remote_exec.RemoteTimeout(f"Remote command did not finish within {timeout}s")
+            finally:
+                channel.close()
+
+    async def read(self, command, timeout=None):
+        result = await self.run(command, timeout, on_line=None)
+        return result.exit_status, '\n'.join(result.stdout), '\n'.join(result.stderr)
+
+    async def upload(self, local_path, remote_path, digest=None):
+        # SFTP requests are synchronous in paramiko, the transfer keeps a pool thread
+        async with self.sessions:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, sftp_upload.upload, self.pooled, local_path, remote_path, digest)
+
+
+async def _stream(channel, on_line, collect):
+    loop = asyncio.get_running_loop()
+    readable = asyncio.Event()
+    fd = channel.fileno()
+    loop.add_reader(fd, readable.set)
+    watching = True
+    out = remote_exec._LineBuffer('stdout', on_line, collect)
+    err = remote_exec._LineBuffer('stderr', on_line, collect)
+    try:
+        while True:
+            # Cleared before draining, a pipe that is still readable sets it again
+            readable.clear()
+            while channel.recv_ready():
+                out.feed(channel.recv(READ_SIZE))
+            while channel.recv_stderr_ready():
+                err.feed(channel.recv_stderr(READ_SIZE))
+            if (channel.eof_received or channel.closed) and channel.exit_status_ready():
+                break
+            if channel.eof_received and watching:
+                loop.remove_reader(fd)
+                watching = False
+            if not watching:
+                await asyncio.sleep(EXIT_POLL)
+                continue
+            try:
+                await asyncio.wait_for(readable.wait(), STATUS_POLL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if watching:
+            loop.remove_reader(fd)
+    out.flush()
+    err.flush()
+    return remote_exec.Result(channel.recv_exit_status(), out.lines, err.lines)
+
+
+async def connect(host, username, password, port=None, max_sessions=MAX_SESSIONS, **connect_kwargs):
+    '''
+    Returns an AsyncClient on the pooled transport of host, the sync
+    scripts' ssh_pool.get_client() shares it. port defaults to
+    ssh_pool.resolve_port().
+    '''
+    # Imported on use, a script can offer BACKENDS without loading paramiko
+    import ssh_pool
+    loop = asyncio.get_running_loop()
+    pooled = await loop.run_in_executor(
+        None, lambda: ssh_pool.get_client(host, username, password, port, **connect_kwargs))
+    return AsyncClient(pooled, max_sessions)
+
+
+async def _run_async(jobs, timeout, on_line, workers):
+    clients = {}
+
+    async def job(client, command):
+        if client not in clients:
+            clients[client] = AsyncClient(client, workers)
+        try:
+            return await clients[client].run(command, timeout, on_line)
+        except Exception as e:
+            return e
+
+    return await asyncio.gather(*(job(client, command) for client, command in jobs))
+
+
+def _run_threads(jobs, timeout, on_line, workers):
+    def job(client, command):
+        try:
+            return remote_exec.run(client, command, timeout, on_line)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda each: job(*each), jobs))
+
+
+def run_commands(jobs, backend='thread', timeout=None, on_line=None, workers=MAX_SESSIONS):
+    '''
+    Runs (ssh_pool client, command) jobs concurrently and returns one
+    remote_exec.Result per job, in order, or the exception that job
+    raised. 'thread' runs workers commands at a time on as many
+    threads, 'async' workers commands per transport on one event loop.
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, one of {', '.join(BACKENDS)}")
+    if backend == 'async':
+        return asyncio.run(_run_async(jobs, timeout, on_line, workers))
+    return _run_threads(jobs, timeout, on_line, workers)
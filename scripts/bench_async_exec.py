@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+'''
+ Benchmark of the async_exec backends against localstack_simulator.
+ N commands, each sleeping S seconds on the simulated VM and
+ echoing its index, run through async_exec.run_commands with the
+ thread and the async backend. The simulator runs as its own
+ process, so only the threads of the client side are counted.
+ Reported per backend:
+   wall     wall-clock seconds until the last command returned
+   threads  peak threads of this process while the commands ran
+   ok       commands whose output was their own index
+
+  -h, --help  show this help message and exit
+  -n N        Commands to run (default: 300)
+  -s S        Seconds every command sleeps on the VM (default: 0.5)
+  -c C        SSH connections the commands are spread over (default: 1)
+  -w W        Concurrent commands per connection (default: N)
+  -r R        Repetitions per backend, the best is kept (default: 3)
+
+'''
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import threading
+import subprocess
+import localstack_simulator
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_simulator():
+    proc = subprocess.Popen([sys.executable, os.path.join(SCRIPTS_DIR, 'localstack_simulator.py')],
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    match = re.search(r'127\.0\.0\.1:(\d+) ', proc.stdout.readline().decode())
+    if not match:
+        proc.kill()
+        sys.exit('localstack_simulator did not start')
+    return proc, int(match.group(1))
+
+
+def peak_threads(done, peak):
+    while not done.is_set():
+        peak[0] = max(peak[0], threading.active_count())
+        time.sleep(0.01)
+
+
+def run_backend(backend, clients, count, seconds, workers):
+    jobs = [(clients[i % len(clients)], f"sleep {seconds} && echo {i}") for i in range(count)]
+    done = threading.Event()
+    peak = [threading.active_count()]
+    sampler = threading.Thread(target=peak_threads, args=(done, peak), daemon=True)
+    sampler.start()
+    start = time.monotonic()
+    # Same concurrency for both, the thread backend counts workers over all connections
+    total = workers * len(clients) if backend == 'thread' else workers
+    results = async_exec.run_commands(jobs, backend, timeout=60, workers=total)
+    elapsed = time.monotonic() - start
+    done.set()
+    sampler.join()
+    ok = sum(1 for i, result in enumerate(results)
+             if not isinstance(result, Exception) and result.exit_status == 0 and result.stdout == [str(i)])
+    return elapsed, peak[0], ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the thread and async remote execution backends')
+    parser.add_argument('-n', type=int, help='Commands to run (default: 300)', default=300)
+    parser.add_argument('-s', type=float, help='Seconds every command sleeps on the VM (default: 0.5)', default=0.5)
+    parser.add_argument('-c', type=int, help='SSH connections the commands are spread over (default: 1)', default=1)
+    parser.add_argument('-w', type=int, help='Concurrent commands per connection (default: N)', default=None)
+    parser.add_argument('-r', type=int, help='Repetitions per backend, the best is kept (default: 3)', default=3)
+    script_namespace = parser.parse_args()
+
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    simulator, port = start_simulator()
+    import ssh_pool
+    import async_exec
+
+    try:
+        # Separate transports, the pool would hand out the same one
+        clients = [ssh_pool.PooledClient('127.0.0.1', localstack_simulator.USERNAME, localstack_simulator.PASSWORD, port)
+                   for _ in range(script_namespace.c)]
+        for client in clients:
+            client.ensure_connected()
+        workers = script_namespace.w or script_namespace.n
+        print(f"{script_namespace.n} commands of {script_namespace.s:g}s over {script_namespace.c} connections, "
+              f"{workers} at a time")
+        print(f"{'backend':<8} {'wall':>8} {'threads':>8} {'ok':>6}")
+        for backend in async_exec.BACKENDS:
+            elapsed, peak, ok = min(run_backend(backend, clients, script_namespace.n, script_namespace.s, workers)
+                                    for _ in range(script_namespace.r))
+            print(f"{backend:<8} {elapsed:>8.3f} {peak:>8} {ok:>6}")
+        for client in clients:
+            client.discard()
+    finally:
+        simulator.kill()
+    sys.exit(0)
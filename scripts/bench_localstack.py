@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''
+ End-to-end benchmark of the local-stack scripts against
+ localstack_simulator. Every script runs as its own process,
+ the way the Jenkinsfile calls it, against a fresh simulator
+ with a scripted scenario. Reported per script:
+   wall        wall-clock seconds of the script process
+   handshakes  SSH connections opened to the VM
+   execs       SSH round-trips (exec channels)
+   dead-wait   seconds between the last VM state change the
+               script waits for and the script exiting
+
+  -h, --help  show this help message and exit
+  -c C        Only run the cases whose name contains C
+  -o O        Write the results as json to O
+  -b B        Compare with a previous json result and fail on regressions
+  -t T        Allowed relative regression for -b (default: 0.2)
+
+'''
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+import localstack_simulator
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (name, script, extra arguments, scenario)
+CASES = [
+    ('poll_localstack_is_up', 'poll_localstack_is_up.py', ['-t', '60', '-s', '1'],
+        {'status': 'starting', 'status_timeline': [(3, 'UP')]}),
+    ('poll_localstack_is_up fatal log', 'poll_localstack_is_up.py', ['-t', '60', '-s', '1'],
+        {'status': 'starting', 'status_timeline': [(30, 'DOWN')],
+         'log_timeline': [(1, 'DB migration started'), (2, 'ERROR DB migration failed')]}),
+    ('check_image_availability', 'check_image_availability.py', ['-r', 'development'],
+        {'present_images': [f"svc{i}" for i in range(1, 11)], 'missing_images': ['svc34']}),
+    ('check_image_availability -c', 'check_image_availability.py',
+        ['-r', 'development', '-c', '-e', 'http://127.0.0.1:{registry_port}'], {'missing_images': ['svc34']}),
+    ('ls_state', 'ls_state.py', [], {}),
+    ('ls_state batch', 'ls_state.py', ['-b'], {}),
+    ('add_sdwan_release_in_localstack', 'add_sdwan_release_in_localstack.py', ['-b', '11.3.0_5', '-t', '60'], {}),
+    ('add_sdwan_release_in_localstack x3', 'add_sdwan_release_in_localstack.py',
+        ['-b', '11.2.2_14', '11.3.0_5', '11.4.0_2', '-t', '60'], {}),
+]
+
+
+def run_case(script, extra_args, scenario):
+    sim = localstack_simulator.Simulator(scenario)
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, script), '-i', '127.0.0.1',
+           '-u', localstack_simulator.USERNAME, '-p', localstack_simulator.PASSWORD]
+    cmd += [arg.format(registry_port=sim.registry.port) for arg in extra_args]
+    # The scripts' timing records are not needed after the run
+    with tempfile.TemporaryDirectory(prefix='bench-timing-') as timing_dir:
+        env = dict(os.environ, LS_SIM_SSH_PORT=str(sim.port), TIMING_DIR=timing_dir)
+        sim.start()
+        start = time.monotonic()
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        end = time.monotonic()
+        sim.close()
+
+    events = [at for at, name in sim.events if at <= end]
+    return {
+        'exit_status': proc.returncode,
+        'wall': round(end - start, 3),
+        'handshakes': sim.handshakes,
+        'execs': len(sim.execs),
+        'dead_wait': round(end - max(events), 3) if events else 0.0,
+        'stderr': proc.stderr.decode().strip()[-200:],
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in ('wall', 'handshakes', 'execs', 'dead_wait'):
+            # Half a second of slack keeps process startup noise out of short metrics
+            limit = previous[metric] * (1 + tolerance) + (0.5 if metric in ('wall', 'dead_wait') else 0)
+            if result[metric] > limit:
+                regressions.append(f"{name}: {metric} {previous[metric]} -> {result[metric]}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the local-stack scripts against a simulated VM')
+    parser.add_argument('-c', help='Only run the cases whose name contains C', default='')
+    parser.add_argument('-o', help='Write the results as json to O', default=None)
+    parser.add_argument('-b', help='Compare with a previous json result and fail on regressions', default=None)
+    parser.add_argument('-t', type=float, help='Allowed relative regression for -b (default: 0.2)', default=0.2)
+    script_namespace = parser.parse_args()
+
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    results = {}
+    print(f"{'script':<34} {'exit':>4} {'wall':>8} {'handshakes':>10} {'execs':>6} {'dead-wait':>9}")
+    for name, script, extra_args, scenario in CASES:
+        if script_namespace.c not in name:
+            continue
+        result = run_case(script, extra_args, scenario)
+        results[name] = result
+        print(f"{name:<34} {result['exit_status']:>4} {result['wall']:>8.2f} {result['handshakes']:>10} "
+              f"{result['execs']:>6} {result['dead_wait']:>9.2f}", flush=True)
+
+    if script_namespace.o:
+        with open(script_namespace.o, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if script_namespace.b:
+        with open(script_namespace.b) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), script_namespace.t)
+        if regressions:
+            print("Regressions:", *regressions, sep="\n")
+            sys.exit(1)
+    sys.exit(0)
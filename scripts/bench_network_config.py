@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+'''
+ Benchmark of multi-customer provisioning in network_config against
+ orchestrator_simulator. network_config runs as its own process, the
+ way the Jenkinsfile calls it, with N customers at -P 1 (one
+ customer after the other) and at -P P, then once more with one
+ customer whose set_version fails. Reported per run:
+   wall         wall-clock seconds of the network_config process
+   requests     HTTP requests the simulator answered
+   connections  distinct client connections, below requests when pooled
+   in-flight    peak of requests served at the same time
+   activated    customers that reached stage and activate
+   exit         exit status of network_config
+
+  -h, --help  show this help message and exit
+  -n N        Customers (default: 24)
+  -P P        Customers provisioned at the same time (default: 8)
+  -l L        Seconds every request takes (default: 0.05)
+  -o O        Seconds after set_version until the sites are online (default: 1)
+
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import orchestrator_simulator
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG = {'sites': [{'name': 'lab-mcn', 'serial': 'MCN-0001'}, {'name': 'lab-branch', 'serial': 'BR-0001'}]}
+
+
+def run(customers, parallel, scenario, config_file):
+    sim = orchestrator_simulator.OrchestratorSimulator(scenario).start()
+    env = dict(os.environ, ORCHESTRATOR_CLIENT='orchestrator_simulator', TIMING_DIR=tempfile.mkdtemp(prefix='bench-timing-'))
+    command = [sys.executable, os.path.join(SCRIPTS_DIR, 'network_config.py'), '-l', f"127.0.0.1:{sim.port}",
+               '-j', config_file, '-t', '30', '-w', '0', '-i', '1', '-P', str(parallel), '-c'] + customers
+    start = time.monotonic()
+    status = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+    elapsed = time.monotonic() - start
+    activated = sum(1 for customer in sim.customers.values() if customer['activated'])
+    sim.close()
+    return elapsed, sim.requests, sim.connections, sim.peak_in_flight, activated, status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark multi-customer provisioning in network_config')
+    parser.add_argument('-n', type=int, help='Customers (default: 24)', default=24)
+    parser.add_argument('-P', type=int, help='Customers provisioned at the same time (default: 8)', default=8)
+    parser.add_argument('-l', type=float, help='Seconds every request takes (default: 0.05)', default=0.05)
+    parser.add_argument('-o', type=float, help='Seconds after set_version until the sites are online (default: 1)', default=1)
+    script_namespace = parser.parse_args()
+
+    config_file = os.path.join(tempfile.mkdtemp(prefix='bench-network-config-'), 'config.json')
+    with open(config_file, 'w') as config:
+        json.dump(CONFIG, config)
+    customers = [f"customer{i}" for i in range(1, script_namespace.n + 1)]
+    scenario = {'latency': script_namespace.l, 'online_after': script_namespace.o}
+    cases = [
+        ("-P 1", 1, scenario, script_namespace.n),
+        (f"-P {script_namespace.P}", script_namespace.P, scenario, script_namespace.n),
+        (f"-P {script_namespace.P}, 1 failing", script_namespace.P, dict(scenario, fail={customers[-1]: 'set_version'}),
+         script_namespace.n - 1),
+    ]
+    print(f"{script_namespace.n} customers")
+    print(f"{'case':<20} {'wall':>8} {'requests':>9} {'connections':>12} {'in-flight':>10} {'activated':>10} {'exit':>5}")
+    failed = False
+    for name, parallel, case_scenario, expected in cases:
+        elapsed, requests, connections, in_flight, activated, status = run(customers, parallel, case_scenario, config_file)
+        print(f"{name:<20} {elapsed:>8.2f} {requests:>9} {connections:>12} {in_flight:>10} {activated:>10} {status:>5}")
+        if activated != expected or (status != 0) != (expected != script_namespace.n):
+            failed = True
+    sys.exit(1 if failed else 0)
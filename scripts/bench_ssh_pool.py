@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''
+ Benchmark of ssh_pool against one SSH handshake per command.
+ Starts localstack_simulator and runs the same commands
+ with a fresh paramiko.SSHClient each time and through the pool,
+ then reports handshakes and wall-clock time for both.
+
+  -h, --help  show this help message and exit
+  -n N        Number of commands to run (default: 20)
+
+'''
+import sys
+import time
+import logging
+import argparse
+import paramiko
+import ssh_pool
+import localstack_simulator
+
+USERNAME = localstack_simulator.USERNAME
+PASSWORD = localstack_simulator.PASSWORD
+
+
+def run_unpooled(port, commands):
+    for cmd in commands:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect('127.0.0.1', port=port, username=USERNAME, password=PASSWORD, allow_agent=False, look_for_keys=False)
+        stdin, stdout, stderr = client.exec_command(cmd)
+        stdout.read()
+        stdout.channel.recv_exit_status()
+        client.close()
+
+
+def run_pooled(port, commands):
+    for cmd in commands:
+        ssh_pool.run('127.0.0.1', USERNAME, PASSWORD, cmd, port=port, look_for_keys=False)
+    ssh_pool.close_all()
+
+
+def measure(sim, func, commands):
+    before = sim.handshakes
+    start = time.monotonic()
+    func(sim.port, commands)
+    return sim.handshakes - before, time.monotonic() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark pooled against per-command SSH connections')
+    parser.add_argument('-n', type=int, default=20, help='Number of commands to run (default: 20)')
+    args = parser.parse_args()
+
+    # Server transports log every client disconnect as an error
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    sim = localstack_simulator.Simulator().start()
+    commands = [f"cat /local-stack/status_file # {i}" for i in range(args.n)]
+    results = {
+        'unpooled': measure(sim, run_unpooled, commands),
+        'pooled': measure(sim, run_pooled, commands),
+    }
+    sim.close()
+
+    print(f"{'mode':<10} {'commands':>8} {'handshakes':>10} {'seconds':>8}")
+    for mode, (handshakes, elapsed) in results.items():
+        print(f"{mode:<10} {args.n:>8} {handshakes:>10} {elapsed:>8.3f}")
+    saved = results['unpooled'][1] - results['pooled'][1]
+    print(f"Saved {results['unpooled'][0] - results['pooled'][0]} handshakes and {saved:.3f}s")
+    sys.exit(0)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''
+ Benchmark of interpreter startup and import cost of the stage
+ scripts. Three measurements:
+   imports  python -X importtime of every stage script: import
+            milliseconds and which heavy packages (paramiko,
+            requests, yaml) it pulls in
+   help     every stage script's --help, one process per script
+            against one stages.py batch, i.e. the bare cost of
+            starting the stages
+   batch    a bring-up like sequence of stages against
+            localstack_simulator, one process per stage against
+            one stages.py batch: wall-clock time and SSH handshakes
+
+  -h, --help  show this help message and exit
+  -r R        Repetitions of each measurement, the best is kept (default: 3)
+
+'''
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+import localstack_simulator
+import stages
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+HEAVY = ('paramiko', 'requests', 'yaml', 'cryptography')
+HELP_STAGES = ['add_sdwan_release', 'apply_license', 'check_images', 'ls_state', 'network_config', 'poll_up',
+               'publish_sdwan_script', 'publish_utm_config_client', 'tf_output', 'wait_for']
+
+
+def import_time(module):
+    '''
+    Returns (milliseconds, heavy packages) of importing module in a
+    fresh interpreter, or (None, error) when it cannot be imported.
+    '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=SCRIPTS_DIR,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode:
+        return None, proc.stderr.decode().strip().splitlines()[-1]
+    total = 0
+    heavy = set()
+    # import time: self [us] | cumulative | imported package
+    for line in proc.stderr.decode().splitlines():
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[0].startswith('import time:') or 'self' in fields[0]:
+            continue
+        total += int(fields[0].split(':')[1])
+        name = fields[2].strip()
+        if name in HEAVY:
+            heavy.add(name)
+    return total / 1000, sorted(heavy)
+
+
+def best_of(repetitions, func, *args):
+    return min((func(*args) for _ in range(repetitions)), key=lambda result: (result[0] is None, result[0] or 0))
+
+
+def run_processes(commands, env):
+    start = time.monotonic()
+    statuses = [subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, stages.resolve(name) + '.py')] + argv, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+                for name, argv in commands]
+    return time.monotonic() - start, statuses
+
+
+def run_batch(commands, env):
+    batch = '\n'.join(subprocess.list2cmdline([name] + argv) for name, argv in commands)
+    start = time.monotonic()
+    proc = subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, 'stages.py'), '-b', '-', '-k'], input=batch.encode(),
+                          env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - start, [proc.returncode]
+
+
+def simulated(runner, repetitions):
+    results = []
+    for _ in range(repetitions):
+        sim = localstack_simulator.Simulator().start()
+        env = dict(os.environ, LS_SIM_SSH_PORT=str(sim.port), TIMING_DIR=tempfile.mkdtemp(prefix='bench-timing-'))
+        credentials = ['-i', '127.0.0.1', '-u', localstack_simulator.USERNAME, '-p', localstack_simulator.PASSWORD]
+        commands = [
+            ('wait_for', ['-t', '10', 'tcp', '127.0.0.1', str(sim.registry.port)]),
+            ('check_images', credentials + ['-r', 'development', '-c', '-e', f"http://127.0.0.1:{sim.registry.port}"]),
+            ('poll_up', credentials + ['-t', '30', '-s', '1']),
+            ('add_sdwan_release', credentials + ['-b', '11.2.2_14']),
+            ('ls_state', credentials + ['-b']),
+        ]
+        elapsed, statuses = runner(commands, env)
+        results.append((elapsed, sim.handshakes, len(commands), statuses))
+        sim.close()
+    return min(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark startup and import cost of the stage scripts')
+    parser.add_argument('-r', type=int, default=3, help='Repetitions of each measurement, the best is kept (default: 3)')
+    script_namespace = parser.parse_args()
+
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    print(f"{'module':<42} {'import ms':>9}  heavy packages")
+    for name, module in sorted(stages.STAGES.items(), key=lambda item: item[1]):
+        milliseconds, heavy = best_of(script_namespace.r, import_time, module)
+        if milliseconds is None:
+            print(f"{module:<42} {'-':>9}  {heavy}")
+        else:
+            print(f"{module:<42} {milliseconds:>9.1f}  {', '.join(heavy) or '-'}")
+
+    env = dict(os.environ, TIMING_DIR=tempfile.mkdtemp(prefix='bench-timing-'))
+    commands = [(name, ['-h']) for name in HELP_STAGES]
+    processes, _ = best_of(script_namespace.r, run_processes, commands, env)
+    batch, _ = best_of(script_namespace.r, run_batch, commands, env)
+    print(f"\n{'--help of ' + str(len(commands)) + ' stages':<34} {'seconds':>8}")
+    print(f"{'one process per stage':<34} {processes:>8.3f}")
+    print(f"{'stages.py batch':<34} {batch:>8.3f}")
+    print(f"Saved {processes - batch:.3f}s, {(processes - batch) / len(commands) * 1000:.0f}ms per stage")
+
+    processes = simulated(run_processes, script_namespace.r)
+    batch = simulated(run_batch, script_namespace.r)
+    print(f"\n{'simulated bring-up, ' + str(processes[2]) + ' stages':<34} {'seconds':>8} {'handshakes':>10}  exit")
+    print(f"{'one process per stage':<34} {processes[0]:>8.3f} {processes[1]:>10}  {processes[3]}")
+    print(f"{'stages.py batch':<34} {batch[0]:>8.3f} {batch[1]:>10}  {batch[3]}")
+    print(f"Saved {processes[0] - batch[0]:.3f}s and {processes[1] - batch[1]} handshakes")
+    sys.exit(0)
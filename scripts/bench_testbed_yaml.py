@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+'''
+ Benchmark of generate_testbed_yaml on large topologies. A fake
+ terraform output with one mcn and N branches, every appliance
+ with one host, goes through the script's cli() the way a stage
+ runs it, then the descriptor is dumped and loaded again with the
+ pure python and the libyaml classes. Reported per branch count:
+   cli       milliseconds of generate_testbed_yaml.cli()
+   build     milliseconds of discovering the sites and building the descriptor
+   dump      milliseconds of writing edge_config.yaml, python / libyaml
+   load      milliseconds of reading it back, python / libyaml
+   kB        size of edge_config.yaml
+
+  -h, --help  show this help message and exit
+  -n N        Branch counts, 1 is today's mcn and branch (default: 1 100 1000)
+  -r R        Repetitions, the best is kept (default: 3)
+
+'''
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import yaml
+import generate_testbed_yaml
+import tf_output
+
+TEMPLATE = '''
+STATE: AVAILABLE
+ENV:
+  ORCHESTRATOR:
+    name: placeholder
+    ip: placeholder_only_valid_for_localstack
+  CUSTOMER:
+    name: placeholder
+SITES:
+  BRANCH1:
+    basic_settings:
+      mode: client
+      model: cbvpx
+      site_name: BRANCH1_KVMVPX
+    vm_ip: placeholder
+  MCN:
+    basic_settings:
+      mode: primary_mcn
+      model: cbvpx
+      site_name: MCN_KVMVPX
+    vm_ip: placeholder
+CLIENT:
+  ip: placeholder
+  username: placeholder
+  password: placeholder
+SERVER:
+  ip: placeholder
+  username: placeholder
+  password: placeholder
+'''
+
+
+def fake_output(branches):
+    # mcn, branch, branch2 ... like the lab's terraform outputs
+    output = {}
+    for i in range(branches + 1):
+        appliance = 'mcn' if i == 0 else 'branch' if i == 1 else f"branch{i}"
+        output[appliance] = {'value': {'name': f"{appliance.upper()}_KVMVPX", 'mgmt_ip': f"10.{i // 250}.{i % 250}.10"}}
+        output[f"{appliance}-host1"] = {'value': {'name': f"{appliance}-host1", 'mgmt_ip': f"10.{i // 250}.{i % 250}.20"}}
+    return output
+
+
+def lab(branches):
+    # A lab directory whose tf_output cache answers for terraform
+    root = tempfile.mkdtemp(prefix='bench-testbed-')
+    wd = os.path.join(root, 'labs', 'bench')
+    os.makedirs(wd)
+    with open(os.path.join(wd, tf_output.STATE_FILE), 'w') as state_file:
+        state_file.write(f"{branches}\n")
+    with open(os.path.join(wd, tf_output.CACHE_FILE), 'w') as cache_file:
+        json.dump({'key': tf_output.state_key(wd), 'output': fake_output(branches)}, cache_file)
+    with open(os.path.join(root, 'testbed_template.yaml'), 'w') as template_file:
+        template_file.write(TEMPLATE)
+    return root, wd
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def run_cli(root):
+    os.environ.update(agent_root_dir=root, labs_path='/labs/', lab_name='bench', openstack_path='',
+                      TIMING_DIR=os.path.join(root, 'timing'))
+    cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_testbed_yaml.cli(['10.0.0.1'])
+    except SystemExit as e:
+        if e.code:
+            sys.exit(f"generate_testbed_yaml exited with {e.code}")
+    finally:
+        os.chdir(cwd)
+
+
+def measure(branches):
+    root, wd = lab(branches)
+    cli_ms, _ = timed(run_cli, root)
+    output = fake_output(branches)
+    template = yaml.safe_load(TEMPLATE)
+    build_ms, testbed = timed(lambda: generate_testbed_yaml.build_testbed(
+        template, generate_testbed_yaml.discover_sites(output), '10.0.0.1', 'bench'))
+    if len(testbed['SITES']) != branches + 1:
+        sys.exit(f"{len(testbed['SITES'])} sites instead of {branches + 1}")
+
+    dump = {}
+    load = {}
+    for name, dumper, loader in (('python', yaml.SafeDumper, yaml.SafeLoader),
+                                 ('libyaml', getattr(yaml, 'CSafeDumper', None), getattr(yaml, 'CSafeLoader', None))):
+        if dumper is None:
+            continue
+        dump[name], text = timed(lambda: yaml.dump(testbed, Dumper=dumper, allow_unicode=True, default_flow_style=False))
+        load[name], loaded = timed(yaml.load, text, loader)
+        if loaded != testbed:
+            sys.exit(f"{name} round-trip of {branches} branches differs")
+    with open(os.path.join(wd, generate_testbed_yaml.OUTPUT_FILE)) as output_file:
+        if yaml.safe_load(output_file)['SITES'].keys() != testbed['SITES'].keys():
+            sys.exit(f"edge_config.yaml of {branches} branches differs")
+    return cli_ms, build_ms, dump, load, len(text) / 1024
+
+
+def slash(times):
+    return ' / '.join(f"{times[name]:.1f}" if name in times else '-' for name in ('python', 'libyaml'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark generate_testbed_yaml on large topologies')
+    parser.add_argument('-n', type=int, nargs='+', help="Branch counts, 1 is today's mcn and branch (default: 1 100 1000)", default=[1, 100, 1000])
+    parser.add_argument('-r', type=int, help='Repetitions, the best is kept (default: 3)', default=3)
+    script_namespace = parser.parse_args()
+
+    print(f"libyaml {'available' if yaml.__with_libyaml__ else 'not available'}, generate_testbed_yaml uses "
+          f"{generate_testbed_yaml.Dumper.__name__}")
+    print(f"{'branches':>8} {'cli':>8} {'build':>8} {'dump py / C':>18} {'load py / C':>18} {'kB':>8}")
+    for count in script_namespace.n:
+        results = [measure(count) for _ in range(script_namespace.r)]
+        cli_ms = min(result[0] for result in results)
+        build_ms = min(result[1] for result in results)
+        dump = {name: min(result[2][name] for result in results) for name in results[0][2]}
+        load = {name: min(result[3][name] for result in results) for name in results[0][3]}
+        print(f"{count:>8} {cli_ms:>8.1f} {build_ms:>8.1f} {slash(dump):>18} {slash(load):>18} {results[0][4]:>8.1f}")
+    sys.exit(0)
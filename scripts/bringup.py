@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+'''
+ Lab bring-up as a dependency graph. The stages of the Jenkinsfile
+ are run as the same commands, but every stage starts as soon as
+ the stages it needs are done instead of after the previous one:
+
+   create_localstack -> localstack_ip --+-> localstack_ssh -> check_images -> poll_up -+
+                                        +-> testbed_yaml -------------------------------+-> network_config -> apply_license
+                                        +-> device_ips -> nitro                         |
+   create_lab --------------------------+     -> connect_devices -> update_serials -----+
+
+ poll_up waits for check_images as in the Jenkinsfile: the stack
+ only comes UP once the images check_images pulls are on the VM.
+
+ Values printed by a stage (localstack_ip, branch_ip, mcn_ip) are
+ passed to the stages that need them. At the end a report shows
+ every stage's start and duration and the critical path, the
+ chain of stages that decided the total time.
+
+  -h, --help  show this help message and exit
+  -l L        Lab name
+  -u U        Username of the local-stack VM and the devices
+  -p P        Password of the local-stack VM and the devices
+  -U U        Username of the branch UTM (license workaround)
+  -P P        Password of the branch UTM (license workaround)
+  -k K        Key file imported into the local-stack instance
+  -v V        Target version for staging (default: R11_2_2_13_888881)
+  -r R        Services registry (default: development)
+  -s S        KEY=VALUE known beforehand i.e. localstack_ip=10.0.0.1,
+              stages that only produce known values are skipped
+  -x X        Skip stage X, i.e. create_localstack when it exists
+  -n          Print the stages and their dependencies and exit
+
+'''
+import os
+import sys
+import json
+import time
+import shlex
+import asyncio
+import argparse
+import timing
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    def __init__(self, name, command, needs=(), provides=(), cwd=None):
+        self.name = name
+        self.command = command      # callable(ctx) -> shell command
+        self.needs = needs
+        self.provides = provides    # stdout lines, in order, are stored as these ctx keys
+        self.cwd = cwd
+
+
+class StageFailed(Exception):
+    pass
+
+
+def script(name, *args):
+    return ' '.join([shlex.quote(os.path.join(SCRIPTS_DIR, name))] + [shlex.quote(str(arg)) for arg in args])
+
+
+def build_stages(env):
+    openstack_path = env['agent_root_dir'] + env['openstack_path']
+    vpx_create_script = env['agent_root_dir'] + env['vpx_create_script_path']
+    orch_lib = env['agent_root_dir'] + env['orch_lib']
+    return [
+        Stage('create_localstack', lambda ctx:
+              ". /sdwan-openrc.sh && openstack --insecure stack create --wait"
+              f" --parameter services_registry={shlex.quote(ctx['services_registry'])}"
+              f" --parameter-file import_key={shlex.quote(ctx['key_file'])}"
+              f" -t {shlex.quote(openstack_path + 'heat/localstack.yaml')} {shlex.quote(ctx['lab_name'] + '_localstack')}"),
+        Stage('localstack_ip', lambda ctx:
+              f". /sdwan-openrc.sh && openstack --insecure stack output show --all {shlex.quote(ctx['lab_name'] + '_localstack')}"
+              " -f json | jq -r '.instance_ip' | jq -r '.output_value'",
+              needs=('create_localstack',), provides=('localstack_ip',)),
+        Stage('localstack_ssh', lambda ctx: 'python ' + script('wait_for.py', '-t', 600, 'tcp', ctx['localstack_ip'], 22),
+              needs=('localstack_ip',)),
+        Stage('create_lab', lambda ctx: f"{shlex.quote(vpx_create_script)} {shlex.quote(ctx['lab_name'])} 1wan dev"),
+        Stage('device_ips', lambda ctx: 'python ' + script('get_device_ip.py', ctx['localstack_ip'], 'branch', 'mcn'),
+              needs=('create_lab', 'localstack_ip'), provides=('branch_ip', 'mcn_ip')),
+        Stage('testbed_yaml', lambda ctx: 'python ' + script('generate_testbed_yaml.py', ctx['localstack_ip']),
+              needs=('create_lab', 'localstack_ip')),
+        # The devices need time for nitro to come up after the lab is created
+        Stage('nitro', lambda ctx: ' && '.join(
+              'python ' + script('wait_for.py', '-t', 900, 'http', f"https://{ip}/sdwan/nitro/v1/config/login",
+                                 '--data_env', 'NITRO_LOGIN')
+              for ip in (ctx['branch_ip'], ctx['mcn_ip'])),
+              needs=('device_ips',)),
+        Stage('connect_devices', lambda ctx: script('connect_devices_to_localstack.sh', '-l', ctx['localstack_ip'],
+                                                    '-b', ctx['branch_ip'], '-m', ctx['mcn_ip'], '-p', ctx['password']),
+              needs=('nitro',)),
+        Stage('update_serials', lambda ctx: script('update_serial_numbers.py', '-c', ctx['lab_name'], '-m', ctx['mcn_ip'],
+                                                   '-b', ctx['branch_ip'], '-p', ctx['password']),
+              needs=('connect_devices',)),
+        Stage('check_images', lambda ctx: script('check_image_availability.py', '-i', ctx['localstack_ip'], '-u', ctx['username'],
+                                                 '-p', ctx['password'], '-r', ctx['services_registry']),
+              needs=('localstack_ssh',)),
+        Stage('poll_up', lambda ctx: script('poll_localstack_is_up.py', '-i', ctx['localstack_ip'], '-u', ctx['username'],
+                                            '-p', ctx['password']),
+              needs=('check_images',)),
+        Stage('network_config', lambda ctx:
+              'export PYTHONPATH="$(dirname $(readlink -f $(locate -b \'\\orchestrator_utils.py\' | grep patras)))" && '
+              + script('network_config.py', '-c', ctx['lab_name'], '-v', ctx['target_version'], '-l', ctx['localstack_ip'],
+                       '-j', os.path.join(SCRIPTS_DIR, 'config.json')),
+              needs=('poll_up', 'update_serials', 'testbed_yaml'), cwd=orch_lib),
+        Stage('apply_license', lambda ctx: script('workaround_utm_licenses.py', '-i', ctx['branch_ip'], '-u', ctx['utm_username'],
+                                                  '-p', ctx['utm_password'], '-f', os.path.join(SCRIPTS_DIR, 'licenses.js-workaround')),
+              needs=('network_config',)),
+    ]
+
+
+def check_graph(stages):
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        for need in stage.needs:
+            if need not in names:
+                raise ValueError(f"Stage {stage.name} needs unknown stage {need}")
+    levels = {}
+
+    def level(stage_name, seen=()):
+        if stage_name in seen:
+            raise ValueError(f"Dependency cycle: {' -> '.join(seen + (stage_name,))}")
+        if stage_name not in levels:
+            stage = next(stage for stage in stages if stage.name == stage_name)
+            levels[stage_name] = max((level(need, seen + (stage_name,)) + 1 for need in stage.needs), default=0)
+        return levels[stage_name]
+
+    for stage in stages:
+        level(stage.name)
+    return levels
+
+
+async def relay(stream, prefix, lines=None):
+    async for line in stream:
+        line = line.decode(errors='replace').rstrip('\n')
+        if lines is not None:
+            lines.append(line)
+        print(f"{prefix} {line}", flush=True)
+
+
+class Runner:
+    def __init__(self, stages, ctx, env, excluded=()):
+        self.stages = {stage.name: stage for stage in stages}
+        self.excluded = excluded
+        self.ctx = ctx
+        self.env = env
+        self.results = {}
+        self.start = None
+
+    async def run_stage(self, stage, tasks):
+        try:
+            await asyncio.gather(*(tasks[need] for need in stage.needs))
+        except StageFailed:
+            self.results[stage.name] = {'status': 'blocked'}
+            raise StageFailed(f"{stage.name} is blocked by a failed dependency")
+        if stage.name in self.excluded or (stage.provides and all(key in self.ctx for key in stage.provides)):
+            self.results[stage.name] = {'status': 'skipped'}
+            return
+
+        try:
+            command = stage.command(self.ctx)
+        except (KeyError, TypeError) as e:
+            self.results[stage.name] = {'status': 'failed'}
+            raise StageFailed(f"{stage.name} is missing a value: {e}")
+        begin = time.monotonic()
+        print(f"[{stage.name}] started", flush=True)
+        proc = await asyncio.create_subprocess_shell(command, cwd=stage.cwd, env=self.env,
+                                                     stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        # Warnings on stderr (i.e. paramiko's Blowfish deprecation) are logged but never taken as values
+        lines = []
+        await asyncio.gather(relay(proc.stdout, f"[{stage.name}]", lines),
+                             relay(proc.stderr, f"[{stage.name}] stderr:"))
+        exit_status = await proc.wait()
+        end = time.monotonic()
+        timing.add('stage', stage.name, begin, end, exit_status=exit_status)
+        self.results[stage.name] = {'status': 'ok' if exit_status == 0 else 'failed', 'start': begin, 'end': end,
+                                    'exit_status': exit_status}
+        if exit_status:
+            raise StageFailed(f"{stage.name} exited with {exit_status}")
+        if stage.provides:
+            values = [line.strip() for line in lines if line.strip()][-len(stage.provides):]
+            if len(values) != len(stage.provides):
+                self.results[stage.name]['status'] = 'failed'
+                raise StageFailed(f"{stage.name} did not print {', '.join(stage.provides)}")
+            self.ctx.update(zip(stage.provides, values))
+            for key, value in zip(stage.provides, values):
+                print(f"[{stage.name}] {key} = {value}", flush=True)
+
+    async def run(self):
+        self.start = time.monotonic()
+        tasks = {}
+        # Every stage is a task that waits for the tasks of its dependencies
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(self.run_stage(stage, tasks))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        return [name for name, result in self.results.items() if result['status'] == 'failed']
+
+    def critical_path(self):
+        ran = {name: result for name, result in self.results.items() if 'end' in result}
+        if not ran:
+            return []
+        path = [max(ran, key=lambda name: ran[name]['end'])]
+        while True:
+            needs = [need for need in self.stages[path[-1]].needs if need in ran]
+            if not needs:
+                break
+            path.append(max(needs, key=lambda name: ran[name]['end']))
+        return path[::-1]
+
+    def report(self):
+        path = self.critical_path()
+        print(f"\n{'stage':<20} {'status':<8} {'start':>8} {'duration':>9}  critical path")
+        for name in self.stages:
+            result = self.results.get(name, {'status': 'skipped'})
+            if 'end' in result:
+                print(f"{name:<20} {result['status']:<8} {result['start'] - self.start:>8.1f} "
+                      f"{result['end'] - result['start']:>9.1f}  {'*' if name in path else ''}")
+            else:
+                print(f"{name:<20} {result['status']:<8} {'-':>8} {'-':>9}")
+        durations = [result['end'] - result['start'] for result in self.results.values() if 'end' in result]
+        if durations:
+            wall = max(result['end'] for result in self.results.values() if 'end' in result) - self.start
+            print(f"\nTotal {wall:.1f}s, {sum(durations):.1f}s of stages run one after the other")
+            print(f"Critical path: {' -> '.join(path)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Bring up a lab running independent stages concurrently')
+    parser.add_argument('-l', help='Lab name', default=os.getenv('lab_name'))
+    parser.add_argument('-u', help='Username of the local-stack VM and the devices', default=os.getenv('USERNAME'))
+    parser.add_argument('-p', help='Password of the local-stack VM and the devices', default=os.getenv('PASSWORD'))
+    parser.add_argument('-U', help='Username of the branch UTM (license workaround)', default=None)
+    parser.add_argument('-P', help='Password of the branch UTM (license workaround)', default=None)
+    parser.add_argument('-k', help='Key file imported into the local-stack instance', default=None)
+    parser.add_argument('-v', help='Target version for staging (default: R11_2_2_13_888881)', default='R11_2_2_13_888881')
+    parser.add_argument('-r', help='Services registry (default: development)', default='development')
+    parser.add_argument('-s', action='append', default=[],
+                        help='KEY=VALUE known beforehand i.e. localstack_ip=10.0.0.1, stages that only produce known values are skipped')
+    parser.add_argument('-x', action='append', default=[], help='Skip stage X, i.e. create_localstack when it exists')
+    parser.add_argument('-n', action='store_true', help='Print the stages and their dependencies and exit')
+    script_namespace = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('agent_root_dir', '/var/jenkins')
+    env.setdefault('scripts_path', '/sdwan_pipeline_test_aut/lab_infra/scripts/')
+    env.setdefault('openstack_path', '/sdwan_pipeline_test_aut/lab_infra/openstack/')
+    env.setdefault('devtest_openstack_path', '/devtest/SDWAN_CORE/Lib/SDWAN_LIB/patras_infra/openstack/')
+    env.setdefault('vpx_create_script_path', env['devtest_openstack_path'] + 'topologies/vpx-labs/tools/provision_vpx_basic_labs/create_vpx_lab.py')
+    env.setdefault('labs_path', env['devtest_openstack_path'] + 'instances/')
+    env.setdefault('orch_lib', '/devtest/SDWAN_CORE/Lib/SDWAN_LIB/patras_orchestrator_utils/')
+    stages = build_stages(env)
+
+    try:
+        levels = check_graph(stages)
+    except ValueError as e:
+        sys.exit(str(e))
+    if script_namespace.n:
+        for stage in sorted(stages, key=lambda stage: levels[stage.name]):
+            print(f"{levels[stage.name]}  {stage.name:<20} needs: {', '.join(stage.needs) or '-'}")
+        sys.exit(0)
+
+    if not script_namespace.l:
+        sys.exit('Lab name is required (-l or $lab_name)')
+    env['lab_name'] = script_namespace.l
+    ctx = {
+        'lab_name': script_namespace.l,
+        'username': script_namespace.u,
+        'password': script_namespace.p,
+        'utm_username': script_namespace.U or script_namespace.u,
+        'utm_password': script_namespace.P or script_namespace.p,
+        'key_file': script_namespace.k,
+        'target_version': script_namespace.v,
+        'services_registry': script_namespace.r,
+    }
+    for item in script_namespace.s:
+        key, _, value = item.partition('=')
+        ctx[key] = value
+    # The nitro stage reads its login body from the environment, the password stays off the command line
+    env['NITRO_LOGIN'] = json.dumps({'login': {'username': 'admin', 'password': ctx['password']}})
+
+    timing.start()
+    runner = Runner(stages, ctx, env, script_namespace.x)
+    failures = asyncio.run(runner.run())
+    runner.report()
+    if failures:
+        sys.exit('Failed stages: ' + ', '.join(failures))
+    sys.exit(0)
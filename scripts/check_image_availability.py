@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 '''
  Script for pulling orchestrator service images before
- calling local-stack.sh up and report any missing images
+ calling local-stack.sh up and report any missing images.
+ Images whose local digest already matches the registry
+ are skipped, the rest are pulled by a bounded worker pool
+ sharing one SSH transport.
 
   +-------+           +-------------+
   |       |    ssh    |             |
@@ -14,13 +17,38 @@
   -u U        VM username
   -p P        VM password
   -r R        Docker registry for Orchestrator services
+  -w W        Concurrent image pulls or registry checks (default: 4)
+  -c          Only check the registry for every image's manifest
+              (HTTP HEAD on the v2 API), nothing is pulled
+  -e E        Registry endpoint instead of the registry of each
+              image, i.e. a mirror http://127.0.0.1:5000, for -c and
+              for the digests of the up-to-date check
+  --registry_user, --registry_password
+              Credentials for the registry token endpoint
+  -C C        Node-side image cache directory: missing images are
+              streamed from cached `docker save` archives into
+              `docker load` and only pulled on a miss (see image_cache.py)
+  --cache_size S
+              Size cap of the image cache in GiB (default: 50)
+  -s S        Seconds to wait for settings.env to appear (default: 600)
+  --full      Pull every image, also those unchanged since the last run
+
+ The references processed on a VM are kept in
+ /local-stack/.images_processed, a repeat run only pulls the
+ images whose reference changed in settings.env since then.
 
 '''
 import re
 import sys
+import json
 import argparse
-import paramiko
+import timing
 import time
+import image_cache
+import settings_env
+import shlex
+import wait_for
+from concurrent.futures import ThreadPoolExecutor
 
 # Parse Arguments
 parser = argparse.ArgumentParser(description='Provides information about local-stack health and status.')
@@ -28,34 +56,38 @@ parser.add_argument('-i', "--ip_address", type=str, required=True, help='VM ip w
 parser.add_argument('-u', "--username", type=str, required=True, help='VM username')
 parser.add_argument('-p', "--password", type=str, required=True, help='VM password')
 parser.add_argument('-r', "--services_registry", type=str, required=True, help='Docker registry for Orchestrator services')
-args = parser.parse_args()
+parser.add_argument('-w', "--workers", type=int, required=False, default=4, help='Concurrent image pulls or registry checks (default: 4)')
+parser.add_argument('-c', "--check_only", action='store_true', help="Only check the registry for every image's manifest, nothing is pulled")
+parser.add_argument('-e', "--registry_endpoint", type=str, required=False, default=None, help='Registry endpoint instead of the registry of each image, for -c and the up-to-date check')
+parser.add_argument("--registry_user", type=str, required=False, default=None, help='Username for the registry token endpoint')
+parser.add_argument("--registry_password", type=str, required=False, default=None, help='Password for the registry token endpoint')
+parser.add_argument('-C', "--cache_dir", type=str, required=False, default=None, help='Node-side image cache directory, images are pulled only on a cache miss')
+parser.add_argument("--cache_size", type=float, required=False, default=image_cache.DEFAULT_MAX_GIB, help='Size cap of the image cache in GiB (default: 50)')
+parser.add_argument('-s', "--settings_timeout", type=int, required=False, default=600, help='Seconds to wait for settings.env to appear (default: 600)')
+parser.add_argument("--full", action='store_true', help='Pull every image, also those unchanged since the last run')
 
 ls_basepath = '/local-stack'
-vm_ip = args.ip_address
-vm_user = args.username
-vm_pass = args.password
-services_registry = args.services_registry
-
-# Check IP validity
-pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
-if not pattern.match(vm_ip):
-    sys.exit('Invalid local-stack IP')
-
-try:
-    ssh_handle = paramiko.SSHClient()
-    ssh_handle.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh_handle.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
-except paramiko.AuthenticationException:
-    sys.exit('Authentication failed')
-except paramiko.ssh_exception.BadHostKeyException:
-    sys.exit('Host key could not be verified')
-except paramiko.SSHException:
-    sys.exit('Unable to establish SSH connection')
-
-def ensure_docker_installed():
+settings_file = f"{ls_basepath}/settings.env"
+state_file = f"{ls_basepath}/.images_processed"
+state_marker = '### images processed ###'
+
+class Run:
+    '''
+    State of one run, handed to the functions that need it, so that
+    stages.py can call cli() again in the same interpreter.
+    '''
+    def __init__(self, args, ssh_handle):
+        self.args = args
+        self.ssh_handle = ssh_handle
+        self.workers = args.workers
+        self.cache = image_cache.ImageCache(args.cache_dir, int(args.cache_size * image_cache.GIB)) if args.cache_dir else None
+        self.registry = None    # ManifestChecker for the up-to-date check, None asks the VM
+        self.not_found = []
+
+def ensure_docker_installed(run):
     cmd = f"docker -v &>/dev/null; echo $?"
     for i in range(30):
-        stdin, stdout, stderr = ssh_handle.exec_command(cmd)
+        stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
         out = stdout.readlines()
         if int(out[0].strip()) == 127:
             print("Docker is not yet available")
@@ -64,43 +96,238 @@ def ensure_docker_installed():
         break
     return True
 
-def get_image_list():
-    image_list = []
-    cmd = f"grep sdwan-services-{services_registry} {ls_basepath}/settings.env"
-    while not image_list:
-        stdin, stdout, stderr = ssh_handle.exec_command(cmd)
-        out = stdout.readlines()
-        for line in out:
-            line = line.strip().replace(' \\', '').split(':')
-            url = line[2] + ":" + line[3]
-            image_list.append(url)
-        if image_list:
-            break
-        print("Settings file not found")
-        time.sleep(10)
-    return image_list
-
-not_found = []
-def pull_images(image_list):
-    for item in image_list:
-        cmd = f"docker pull {item}"
-        print("Pulling image: {}".format(item))
-        stdin, stdout, stderr = ssh_handle.exec_command(cmd)
-        err = stderr.readlines()
-        if len(err) > 0:
-            err = err[0].strip()
-        if any(word in err for word in ['Error', 'not found', 'manifest unknown']):
+def read_settings(run):
+    # settings.env and the state of the last run in one round-trip
+    args = run.args
+    try:
+        wait_for.wait(wait_for.remote_file(args.ip_address, args.username, args.password, settings_file),
+                      args.settings_timeout, max_interval=10)
+    except wait_for.ProbeTimeout:
+        sys.exit(f"Settings file not found after {args.settings_timeout}s")
+    cmd = f"cat {settings_file}; echo '{state_marker}'; cat {state_file} 2>/dev/null"
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    settings, _, state = stdout.read().decode().partition(state_marker)
+    return settings, settings_env.load_state(state)
+
+def save_state(run, images, done):
+    cmd = f"echo {shlex.quote(settings_env.dump_state(images, done))} > {state_file}"
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    return stdout.channel.recv_exit_status() == 0
+
+def get_image_list(settings, services_registry):
+    images = settings_env.parse(settings, services_registry)
+    if not images:
+        sys.exit(f"No sdwan-services-{services_registry} images in settings.env")
+    return images
+
+def get_local_digests(run, image_list):
+    # One round-trip for every image: "<image> <repo@digest> ..." or just "<image>" when absent
+    cmd = "; ".join(f"echo {item} $(docker image inspect --format '{{{{join .RepoDigests \" \"}}}}' {item} 2>/dev/null)" for item in image_list)
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    digests = {}
+    for line in stdout.readlines():
+        fields = line.split()
+        if fields:
+            digests[fields[0]] = set(fields[1:])
+    return digests
+
+def make_checker(args, pool_size):
+    # requests is only needed for the registry checks
+    import orchestrator_http
+    import registry_v2
+    auth = (args.registry_user, args.registry_password) if args.registry_user else None
+    return registry_v2.ManifestChecker(orchestrator_http.make_session(pool_size=pool_size), args.registry_endpoint, auth=auth)
+
+def get_remote_digest(run, item):
+    # The registry's Docker-Content-Digest is the digest docker keeps in RepoDigests, for a
+    # multi-arch image that is the index digest, which docker manifest inspect does not show
+    registry = run.registry
+    if registry is not None:
+        import requests
+        try:
+            return registry.digest(item)
+        except (requests.ConnectionError, requests.Timeout):
+            # The node cannot reach the registry, ask the VM from now on
+            run.registry = None
+        except requests.RequestException:
+            pass
+    cmd = f"docker manifest inspect -v {item} 2>/dev/null"
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    try:
+        manifest = json.loads(stdout.read().decode())
+    except ValueError:
+        return None
+    if not isinstance(manifest, dict):
+        # A list of platform manifests, none of their digests is the one in RepoDigests
+        return None
+    return manifest.get('Descriptor', {}).get('digest')
+
+def is_up_to_date(item, local_digests, remote_digest):
+    if not local_digests or remote_digest is None:
+        return False
+    repository = item.rsplit(':', 1)[0] if '/' not in item.rsplit(':', 1)[-1] else item
+    return f"{repository}@{remote_digest}" in local_digests
+
+def load_image(run, item, archive_path):
+    # The archive goes from the node's disk into docker load's stdin, no copy lands on the VM.
+    # An archive saved under another name with the same digest is tagged as item
+    cmd = (f"loaded=$(docker load | sed -n 's/^Loaded image: //p' | head -n 1) && "
+           f"{{ [ \"$loaded\" = '{item}' ] || docker tag \"$loaded\" '{item}'; }}")
+    try:
+        # Opened before docker load starts, an eviction by another worker or run after this still
+        # leaves the open file readable; one before it makes the archive a miss, item gets pulled
+        archive = open(archive_path, 'rb')
+    except OSError as e:
+        print("Could not load {} from cache: {}\n".format(item, e), end='', flush=True)
+        return False
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    channel = stdout.channel
+    sent = 0
+    try:
+        with archive:
+            for chunk in iter(lambda: archive.read(image_cache.CHUNK_SIZE), b''):
+                channel.sendall(chunk)
+                sent += len(chunk)
+    except OSError as e:
+        channel.close()
+        print("Could not load {} from cache: {}\n".format(item, e), end='', flush=True)
+        return False
+    channel.shutdown_write()
+    err = stderr.read().decode().strip()
+    if channel.recv_exit_status():
+        print("Could not load {} from cache: {}\n".format(item, err), end='', flush=True)
+        return False
+    run.cache.count('bytes_loaded', sent)
+    return True
+
+def save_image(run, item, digest):
+    stdin, stdout, stderr = run.ssh_handle.exec_command(f"docker save '{item}'")
+    channel = stdout.channel
+
+    def chunks():
+        for chunk in iter(lambda: channel.recv(image_cache.CHUNK_SIZE), b''):
+            yield chunk
+        if channel.recv_exit_status():
+            raise IOError(stderr.read().decode().strip() or f"docker save {item} failed")
+
+    return run.cache.put(digest, chunks())
+
+def pull_image(run, item, local_digests):
+    import paramiko
+    cache = run.cache
+    start = time.monotonic()
+    remote_digest = get_remote_digest(run, item) if local_digests or cache else None
+    if is_up_to_date(item, local_digests, remote_digest):
+        return item, 'up-to-date', None, time.monotonic() - start
+    if cache and remote_digest:
+        archive_path = cache.get(remote_digest)
+        if archive_path:
+            print("Loading image from cache: {}\n".format(item), end='', flush=True)
+            if load_image(run, item, archive_path):
+                return item, 'cached', None, time.monotonic() - start
+    cmd = f"docker pull {item} > /dev/null"
+    # Single write so lines of concurrent workers don't interleave
+    print("Pulling image: {}\n".format(item), end='', flush=True)
+    stdin, stdout, stderr = run.ssh_handle.exec_command(cmd)
+    err = stderr.readlines()
+    err = err[0].strip() if len(err) > 0 else ''
+    if any(word in err for word in ['Error', 'not found', 'manifest unknown']):
+        return item, 'not-found', err, time.monotonic() - start
+    if cache and remote_digest:
+        try:
+            save_image(run, item, remote_digest)
+        except (IOError, paramiko.SSHException) as e:
+            print("Could not cache {}: {}\n".format(item, e), end='', flush=True)
+    return item, 'pulled', None, time.monotonic() - start
+
+def print_timing_summary(results, elapsed, workers, title="Image pull"):
+    print("\n{} timing summary ({} workers):".format(title, workers))
+    for item, outcome, err, duration in sorted(results, key=lambda result: result[3], reverse=True):
+        print("{:>8.1f}s  {:<10}  {}".format(duration, outcome, item))
+    print("Total: {:.1f}s for {} images".format(elapsed, len(results)))
+
+def pull_images(run, image_list):
+    start = time.monotonic()
+    digests = get_local_digests(run, image_list)
+    with ThreadPoolExecutor(max_workers=run.workers) as executor:
+        results = list(executor.map(lambda item: pull_image(run, item, digests.get(item)), image_list))
+    for item, outcome, err, duration in results:
+        if outcome == 'not-found':
             print("Image not found: {}".format(err))
-            not_found.append(item)
-    if len(not_found) > 0:
+            run.not_found.append(item)
+    print_timing_summary(results, time.monotonic() - start, run.workers)
+    if run.cache:
+        print("Image cache:", image_cache.format_stats(run.cache.stats))
+        run.cache.save_stats()
+    if len(run.not_found) > 0:
         return False
     return True
 
-if __name__ == "__main__":
-    ensure_docker_installed()
-    image_list = get_image_list()
-    if not pull_images(image_list):
-        print("The following images were not available in the registry: ", *not_found, sep = "\n")
-        sys.exit(1)
+def check_image(checker, item):
+    start = time.monotonic()
+    found, detail = checker.exists(item)
+    if found:
+        return item, 'available', None, time.monotonic() - start
+    return item, 'not-found', detail, time.monotonic() - start
+
+def check_images(run, image_list):
+    start = time.monotonic()
+    checker = make_checker(run.args, run.workers)
+    with ThreadPoolExecutor(max_workers=run.workers) as executor:
+        results = list(executor.map(lambda item: check_image(checker, item), image_list))
+    for item, outcome, err, duration in results:
+        if outcome == 'not-found':
+            print("Image not found: {}".format(err))
+            run.not_found.append(item)
+    print_timing_summary(results, time.monotonic() - start, run.workers, "Registry check")
+    if len(run.not_found) > 0:
+        return False
+    return True
+
+def cli(argv=None):
+    args = parser.parse_args(argv)
+    timing.start()
 
+    # Check IP validity
+    pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
+    if not pattern.match(args.ip_address):
+        sys.exit('Invalid local-stack IP')
 
+    # paramiko is imported once the arguments are valid, --help does not pay for it
+    import paramiko
+    import ssh_pool
+    try:
+        ssh_handle = ssh_pool.get_client(args.ip_address, args.username, args.password)
+    except paramiko.AuthenticationException:
+        sys.exit('Authentication failed')
+    except paramiko.ssh_exception.BadHostKeyException:
+        sys.exit('Host key could not be verified')
+    except paramiko.SSHException:
+        sys.exit('Unable to establish SSH connection')
+    main(Run(args, ssh_handle))
+
+def main(run):
+    args = run.args
+    settings, state = read_settings(run)
+    images = get_image_list(settings, args.services_registry)
+    image_list = [image.ref for image in images]
+    if args.check_only:
+        available = check_images(run, image_list)
+    else:
+        todo = image_list if args.full else [image.ref for image in settings_env.changed(images, state)]
+        if not todo:
+            print("settings.env unchanged since the last run, no images to pull")
+            available = True
+        else:
+            if len(todo) < len(image_list):
+                print("{} of {} images changed since the last run".format(len(todo), len(image_list)))
+            ensure_docker_installed(run)
+            run.registry = make_checker(args, run.workers)
+            available = pull_images(run, todo)
+        save_state(run, images, (state['refs'] | set(todo)) - set(run.not_found))
+    if not available:
+        print("The following images were not available in the registry: ", *run.not_found, sep = "\n")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    cli()
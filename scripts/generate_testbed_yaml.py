@@ -1,80 +1,208 @@
 #!/usr/bin/python
-import json
-import yaml
-import subprocess
+'''
+ Script that writes edge_config.yaml, the testbed descriptor of
+ the lab, from testbed_template.yaml and the terraform output.
+ Every appliance of the lab becomes a SITES entry, so topologies
+ with any number of branches need no changes here:
+   mcn               -> MCN      (primary_mcn)
+   mcn<N>            -> MCN<N>   (secondary_mcn)
+   branch, branch<N> -> BRANCH1, BRANCH<N> (client)
+   <appliance>-host<N> is a host of that appliance's site
+ A site the template already has keeps its entry with mode,
+ site_name and vm_ip filled in, a new site starts from the
+ template's MCN or BRANCH1 entry, and template sites the lab does
+ not have stay as they are. CLIENT is the first mcn host and
+ SERVER the first host of the first branch, as before.
+
+  +-----------+        +----------+        +------------------+
+  | terraform |------->| template |------->| edge_config.yaml |
+  |  output   |        |  .yaml   |        |                  |
+  +-----------+        +----------+        +------------------+
+
+  -h, --help  show this help message and exit
+  -t T        Testbed template (default: $agent_root_dir$openstack_path/testbed_template.yaml)
+  -o O        Output file in the lab directory (default: edge_config.yaml)
+  localstack_ip
+
+'''
+import re
 import os
 import sys
+import copy
+import argparse
+import yaml
+from tf_output import load as load_terraform_output
+import timing
+
+# libyaml is several times faster on large testbeds, pure python otherwise
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+OUTPUT_FILE = 'edge_config.yaml'
+APPLIANCE_PATTERN = re.compile(r'^(?P<role>mcn|branch)(?P<index>\d*)$')
+HOST_PATTERN = re.compile(r'^(?P<appliance>.+)-host(?P<index>\d+)$')
+# role -> template site the sites of that role are copied from
+ROLES = {
+    'mcn': 'MCN',
+    'branch': 'BRANCH1',
+}
+
+
+def load_yaml(stream):
+    return yaml.load(stream, Loader=Loader)
+
+
+def dump_yaml(data, stream=None):
+    return yaml.dump(data, stream, Dumper=Dumper, allow_unicode=True, default_flow_style=False)
+
+
+def site_key(role, index):
+    if role == 'mcn':
+        return 'MCN' if index == 1 else f"MCN{index}"
+    return f"BRANCH{index}"
+
+
+def site_mode(role, index):
+    if role == 'branch':
+        return 'client'
+    return 'primary_mcn' if index == 1 else 'secondary_mcn'
+
+
+def discover_sites(tf_output):
+    '''
+    Returns {appliance output: site} of every appliance in the
+    terraform output, each site with its key, role, index, name,
+    mgmt_ip and the mgmt_ip of its hosts ordered by host number.
+    Raises ValueError when two outputs map to the same site.
+    '''
+    sites = {}
+    for output, entry in tf_output.items():
+        match = APPLIANCE_PATTERN.match(output)
+        if match:
+            value = entry['value']
+            index = int(match['index'] or 1)
+            sites[output] = {'key': site_key(match['role'], index), 'role': match['role'], 'index': index,
+                             'name': value['name'], 'mgmt_ip': value['mgmt_ip'], 'hosts': []}
+    keys = {}
+    for output, site in sites.items():
+        if site['key'] in keys:
+            raise ValueError(f"Terraform outputs {keys[site['key']]} and {output} are both site {site['key']}")
+        keys[site['key']] = output
+
+    hosts = []
+    for output, entry in tf_output.items():
+        match = HOST_PATTERN.match(output)
+        if not match:
+            continue
+        if match['appliance'] not in sites:
+            print(f"Skipping {output}, there is no appliance {match['appliance']}")
+            continue
+        hosts.append((match['appliance'], int(match['index']), entry['value']['mgmt_ip']))
+    for appliance, index, mgmt_ip in sorted(hosts):
+        sites[appliance]['hosts'].append(mgmt_ip)
+    return sites
+
+
+def build_testbed(template, sites, localstack_ip, lab_name):
+    """
+    Example for testbed yaml:
+    STATE: AVAILABLE
+    ENV:
+      ORCHESTRATOR:
+        name: placeholder
+        ip: placeholder_only_valid_for_localstack
+      CUSTOMER:
+        name: placeholder
+    SITES:
+      BRANCH1:
+        basic_settings:
+          mode: client
+          model: cbvpx
+          site_name: BRANCH1_KVMVPX
+        vm_ip: placeholder
+      MCN:
+        basic_settings:
+          mode: primary_mcn
+          model: cbvpx
+          site_name: MCN_KVMVPX
+        vm_ip: placeholder
+    CLIENT:
+      ip: placeholder
+      username: placeholder
+      password: placeholder
+    SERVER:
+      ip: placeholder
+      username: placeholder
+      password: placeholder
+
+    Raises ValueError when the lab lacks an mcn, a branch or their hosts.
+    """
+    testbed_description = copy.deepcopy(template)
+    testbed_description["ENV"]["ORCHESTRATOR"]["name"] = "localstack"
+    testbed_description["ENV"]["ORCHESTRATOR"]["ip"] = localstack_ip
+    testbed_description["ENV"]["CUSTOMER"]["name"] = lab_name
+
+    prototypes = {role: template["SITES"][key] for role, key in ROLES.items()}
+    by_role = {role: sorted((site for site in sites.values() if site['role'] == role), key=lambda site: site['index'])
+               for role in ROLES}
+    if not by_role['mcn'] or not by_role['branch']:
+        raise ValueError("The terraform output needs an mcn and at least one branch")
+
+    for role, role_sites in by_role.items():
+        for site in role_sites:
+            entry = testbed_description["SITES"].setdefault(site['key'], copy.deepcopy(prototypes[role]))
+            entry.setdefault("basic_settings", {})
+            entry["basic_settings"]["mode"] = site_mode(role, site['index'])
+            entry["basic_settings"]["site_name"] = site['name']
+            entry["vm_ip"] = site['mgmt_ip']
+
+    client_site = next((site for site in by_role['mcn'] if site['hosts']), None)
+    server_site = next((site for site in by_role['branch'] if site['hosts']), None)
+    if not client_site or not server_site:
+        raise ValueError("The terraform output needs a host on an mcn and on a branch")
+    testbed_description["CLIENT"]["ip"] = client_site['hosts'][0]
+    testbed_description["SERVER"]["ip"] = server_site['hosts'][0]
+    return testbed_description
+
+
+def cli(argv=None):
+    template_path = (os.getenv('agent_root_dir') or '') + (os.getenv('openstack_path') or '') + '/testbed_template.yaml'
+    parser = argparse.ArgumentParser(description='Generate the testbed descriptor of the lab')
+    parser.add_argument('-t', help='Testbed template (default: $agent_root_dir$openstack_path/testbed_template.yaml)', default=template_path)
+    parser.add_argument('-o', help='Output file in the lab directory (default: edge_config.yaml)', default=OUTPUT_FILE)
+    parser.add_argument('localstack_ip')
+    script_namespace = parser.parse_args(argv)
+    timing.start()
+    lab_name = os.getenv('lab_name')
+    localstack_ip = script_namespace.localstack_ip
+    print("localstack_ip=", localstack_ip)
+    wd = os.getenv('agent_root_dir') + os.getenv('labs_path') + lab_name
+    with open(script_namespace.t) as testbed_file:
+        template = load_yaml(testbed_file)
+    os.chdir(wd)
+    tf_output = load_terraform_output(wd)
+
+    try:
+        sites = discover_sites(tf_output)
+        testbed_description = build_testbed(template, sites, localstack_ip, lab_name)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    print(f"Testbed descriptor yaml, {len(testbed_description['SITES'])} sites:")
+    hosts = {site['key']: site['hosts'] for site in sites.values()}
+    for key, site in testbed_description["SITES"].items():
+        # Template sites the lab does not have may lack basic_settings or a vm_ip
+        site = site or {}
+        site_name = (site.get('basic_settings') or {}).get('site_name') or '-'
+        vm_ip = site.get('vm_ip') or '-'
+        print(f"  {key:<12} {str(site_name):<24} {str(vm_ip):<16} {' '.join(hosts.get(key, []))}")
+    print(f"  CLIENT {testbed_description['CLIENT']['ip']}, SERVER {testbed_description['SERVER']['ip']}")
 
+    with open(script_namespace.o, 'w') as f:
+        dump_yaml(testbed_description, f)
 
-lab_name = os.getenv('lab_name')
-localstack_ip = sys.argv[1]
-print("localstack_ip=", localstack_ip)
-wd = os.getenv('agent_root_dir') + os.getenv('labs_path') + lab_name
-os.chdir(wd)
-json_file = subprocess.check_output(['terraform', 'output', '-json'])
-tf_output = json.loads(json_file)
-
-# Read all needed info from terraform output
-mcn_mgmt_ip = tf_output['mcn']['value']['mgmt_ip']
-mcn_name = tf_output['mcn']['value']['name']
-branch_mgmt_ip = tf_output['branch']['value']['mgmt_ip']
-branch_name = tf_output['branch']['value']['name']
-mcn_host_mgmt_ip = tf_output['mcn-host1']['value']['mgmt_ip']
-branch_host_mgmt_ip = tf_output['branch-host1']['value']['mgmt_ip']
-
-with open(os.getenv('agent_root_dir') + os.getenv('openstack_path') +'/testbed_template.yaml') as testbed_file:
-    testbed_description = yaml.load(testbed_file, Loader=yaml.FullLoader)
-"""
-Example for testbed yaml:
-STATE: AVAILABLE
-ENV:
-  ORCHESTRATOR:
-    name: placeholder
-    ip: placeholder_only_valid_for_localstack
-  CUSTOMER:
-    name: placeholder
-SITES:
-  BRANCH1:
-    basic_settings:
-      mode: client
-      model: cbvpx
-      site_name: BRANCH1_KVMVPX
-    vm_ip: placeholder
-  MCN:
-    basic_settings:
-      mode: primary_mcn
-      model: cbvpx
-      site_name: MCN_KVMVPX
-    vm_ip: placeholder
-CLIENT:
-  ip: placeholder
-  username: placeholder
-  password: placeholder
-SERVER:
-  ip: placeholder
-  username: placeholder
-  password: placeholder
-  
-"""
-testbed_description["ENV"]["ORCHESTRATOR"]["name"] = "localstack"
-testbed_description["ENV"]["ORCHESTRATOR"]["ip"] = localstack_ip
-testbed_description["ENV"]["CUSTOMER"]["name"] = lab_name
-
-testbed_description["SITES"]["BRANCH1"]["basic_settings"]["site_name"] = branch_name
-testbed_description["SITES"]["BRANCH1"]["vm_ip"] = branch_mgmt_ip
-
-testbed_description["SITES"]["MCN"]["basic_settings"]["site_name"] = mcn_name
-testbed_description["SITES"]["MCN"]["vm_ip"] = mcn_mgmt_ip
-
-testbed_description["CLIENT"]["ip"] = tf_output['mcn-host1']['value']['mgmt_ip']
-testbed_description["SERVER"]["ip"] = tf_output['branch-host1']['value']['mgmt_ip']
-
-print("Testbed descriptor yaml:")
-print(testbed_description)
-
-with open('edge_config.yaml', 'w') as f:
-    yaml.safe_dump(testbed_description, f, allow_unicode=True, default_flow_style=False)
-
-sys.exit(0)
+    sys.exit(0)
 
 
+if __name__ == "__main__":
+    cli()
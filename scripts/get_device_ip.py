@@ -1,20 +1,25 @@
-import json
-import subprocess
 import os
 import sys
+import tf_output
+import timing
 
-lab_name = os.getenv('lab_name')
-localstack_ip = sys.argv[1]
-device_type = sys.argv[2] # Can be mcn or branch
-wd = os.getenv('agent_root_dir') + os.getenv('labs_path') + lab_name
-os.chdir(wd)
-json_file = subprocess.check_output(['terraform', 'output', '-json'])
-tf_output = json.loads(json_file)
+def cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    timing.start()
+    lab_name = os.getenv('lab_name')
+    localstack_ip = argv[0]
+    device_types = argv[1:] # Can be mcn or branch, several are resolved with one terraform call
+    wd = os.getenv('agent_root_dir') + os.getenv('labs_path') + lab_name
 
-# Read info from terraform output
-device_mgmt_ip = tf_output[device_type]['value']['mgmt_ip']
-print(device_mgmt_ip)
+    # Read info from terraform output
+    try:
+        print(*tf_output.resolve(device_types, 'mgmt_ip', wd), sep='\n')
+    except KeyError as e:
+        sys.exit(f"No terraform output {e}")
 
-sys.exit(0)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    cli()
 
 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+'''
+ Node-side cache of `docker save` archives keyed by the image's
+ registry digest. check_image_availability streams a cached
+ archive straight into `docker load` on a fresh local-stack VM
+ and only pulls from the registry on a miss, saving the pulled
+ image back into the cache. The cache is capped in size and the
+ least recently used archives are evicted first; a file's mtime
+ is its last use.
+
+  +-------+   docker save / load   +-------------+
+  |       |<======================>|             |
+  | cache |     ssh exec channel   | local-stack |
+  |       |                        |             |
+  +-------+                        +-------------+
+
+  -h, --help  show this help message and exit
+  -d D        Cache directory (default: $IMAGE_CACHE_DIR or ~/.cache/localstack-images)
+  -s S        Size cap in GiB, evicts down to it (default: 50)
+  action      stats (default), list, evict or clear
+
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+DEFAULT_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR') or os.path.expanduser('~/.cache/localstack-images')
+DEFAULT_MAX_GIB = 50
+GIB = 1024 ** 3
+CHUNK_SIZE = 1024 * 1024
+STATS_FILE = 'stats.json'
+COUNTERS = ('hits', 'misses', 'stored', 'evicted', 'bytes_loaded', 'bytes_stored')
+
+
+class ImageCache:
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_GIB * GIB):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def archive_path(self, digest):
+        return os.path.join(self.path, digest.replace(':', '_') + '.tar')
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.stats[counter] += value
+
+    def get(self, digest):
+        '''
+        Returns the path of the cached archive, or None on a miss.
+        '''
+        path = self.archive_path(digest)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.count('misses')
+            return None
+        self.count('hits')
+        return path
+
+    def put(self, digest, chunks):
+        '''
+        Stores the archive streamed as chunks under digest. Nothing
+        is kept when the stream raises.
+        '''
+        path = self.archive_path(digest)
+        part_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        size = 0
+        try:
+            with open(part_path, 'wb') as archive:
+                for chunk in chunks:
+                    archive.write(chunk)
+                    size += len(chunk)
+            os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        self.count('stored')
+        self.count('bytes_stored', size)
+        self.evict()
+        return size
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.tar'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    # Evicted by another run sharing the directory
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        return sorted(entries)
+
+    def evict(self, max_bytes=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for mtime, size, name in entries)
+            evicted = []
+            for mtime, size, name in entries:
+                if total <= max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted.append(name)
+            self.stats['evicted'] += len(evicted)
+        return evicted
+
+    def size(self):
+        return sum(size for mtime, size, name in self.entries())
+
+    def save_stats(self):
+        '''
+        Adds this run's counters to the cumulative ones kept in the
+        cache directory and returns the totals.
+        '''
+        stats_path = os.path.join(self.path, STATS_FILE)
+        with self.lock:
+            totals = load_stats(self.path)
+            for counter in COUNTERS:
+                totals[counter] += self.stats[counter]
+            tmp_path = f"{stats_path}.{os.getpid()}"
+            with open(tmp_path, 'w') as stats_file:
+                json.dump(totals, stats_file)
+            os.replace(tmp_path, stats_path)
+        return totals
+
+
+def load_stats(path):
+    totals = dict.fromkeys(COUNTERS, 0)
+    try:
+        with open(os.path.join(path, STATS_FILE)) as stats_file:
+            totals.update(json.load(stats_file))
+    except (FileNotFoundError, ValueError):
+        pass
+    return totals
+
+
+def format_stats(stats):
+    lookups = stats['hits'] + stats['misses']
+    ratio = f"{100 * stats['hits'] / lookups:.0f}%" if lookups else '-'
+    return (f"hits {stats['hits']}, misses {stats['misses']} (hit ratio {ratio}), stored {stats['stored']}, "
+            f"evicted {stats['evicted']}, loaded {stats['bytes_loaded'] / GIB:.2f} GiB, "
+            f"stored {stats['bytes_stored'] / GIB:.2f} GiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or trim the node-side docker image cache')
+    parser.add_argument('-d', help='Cache directory (default: $IMAGE_CACHE_DIR or ~/.cache/localstack-images)', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('-s', type=float, help='Size cap in GiB, evicts down to it (default: 50)', default=DEFAULT_MAX_GIB)
+    parser.add_argument('action', nargs='?', choices=['stats', 'list', 'evict', 'clear'], default='stats')
+    script_namespace = parser.parse_args()
+
+    cache = ImageCache(script_namespace.d, int(script_namespace.s * GIB))
+    if script_namespace.action == 'list':
+        for mtime, size, name in reversed(cache.entries()):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}  {size / GIB:>7.2f} GiB  {name}")
+    elif script_namespace.action in ('evict', 'clear'):
+        evicted = cache.evict(0 if script_namespace.action == 'clear' else None)
+        cache.save_stats()
+        print(f"Evicted {len(evicted)} archives")
+    print(f"{len(cache.entries())} archives, {cache.size() / GIB:.2f} GiB of {script_namespace.s:g} GiB")
+    print("Since created:", format_stats(load_stats(script_namespace.d)))
+    sys.exit(0)
@@ -0,0 +1,802 @@
+#!/usr/bin/env python3
+'''
+ Local stand-in for a local-stack VM, used by the benchmarks.
+ A paramiko SSH server answers the commands the scripts send:
+ status_file transitions (DOWN -> starting -> UP), local-stack.sh
+ down/up, settings.env, docker pull/inspect/socket queries,
+ sdwan_release, publish-sdwan.sh and the sdwan-ae-utm.zip
+ appearance, all with scripted timings. An SFTP subsystem,
+ sha256sum, cat and echo > serve files kept under sim.root,
+ sftp_fail_after drops the connection part way through an
+ upload. Every handshake, exec channel and state change is
+ recorded with a timestamp. A stub Docker registry (HTTP API v2
+ manifests, optional bearer auth) serves the same images on
+ sim.registry.port.
+
+  +---------+           +----------------------+
+  |         |    ssh    |                      |
+  | scripts |---------->| localstack_simulator |
+  |         |           |                      |
+  +---------+           +----------------------+
+
+  -h, --help  show this help message and exit
+  -s S        JSON file with scenario overrides
+  -t T        Seconds to keep serving (default: until interrupted)
+
+ Usage:
+   sim = localstack_simulator.Simulator({'status': 'starting', 'status_timeline': [(2, 'UP')]})
+   sim.start()
+   ... run scripts with LS_SIM_SSH_PORT=sim.port -i 127.0.0.1 -u sim -p sim ...
+   sim.close()
+
+'''
+import os
+import re
+import sys
+import json
+import time
+import socket
+import hashlib
+import logging
+import shutil
+import argparse
+import tempfile
+import threading
+import paramiko
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+USERNAME = 'sim'
+PASSWORD = 'sim'
+LS_BASEPATH = '/local-stack'
+TOTAL_CONTAINERS = 34
+
+DEFAULT_SCENARIO = {
+    'status': 'UP',
+    'status_timeline': [],          # [(seconds after start(), status), ...]
+    'inotify': True,
+    'registry': 'development',
+    'registry_host': 'registry.local',   # may carry a port, i.e. registry.local:5000
+    'image_tags': {},               # service -> tag other than 1.0.0
+    'settings_delay': 0,            # seconds after start() until settings.env exists
+    'images': TOTAL_CONTAINERS,
+    'present_images': [],           # service names already pulled on the VM
+    'missing_images': [],           # service names unknown to the registry
+    'multi_arch_images': [],        # service names published as a multi-arch index
+    'pull_time': 0.2,
+    'releases': ['11.2.2_14'],      # sdwan_release contents
+    'published_builds': ['11.2.2_14'],
+    'publish_time': 1,
+    'down_time': 1,
+    'up_time': 2,
+    'utm_zip_delay': 0,             # seconds after UP until sdwan-ae-utm.zip appears
+    'git_fetch_time': 2,
+    'db_migration_failed': False,
+    'log_timeline': [],             # [(seconds after start(), local-stack-logs.out line), ...]
+    'hang': 0,                      # seconds every command stalls before answering, a hung VM
+    'registry_auth': False,         # stub registry asks for a bearer token
+    'image_size': 1024 * 1024,      # bytes of a `docker save` archive
+    'build_size': 4 * 1024 * 1024,  # bytes of a tar of sdwan_releases/<build>
+    'sftp_fail_after': None,        # bytes of the next SFTP upload after which the connection drops
+}
+
+# SSHServer.wait_command() result for a channel that runs a subsystem instead of a command
+SUBSYSTEM = object()
+
+
+class SSHServer(paramiko.ServerInterface):
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self.commands = {}
+        self.subsystems = set()
+        self.ready = threading.Condition()
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        with self.ready:
+            self.commands[channel.get_id()] = command.decode()
+            self.ready.notify_all()
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        started = super().check_channel_subsystem_request(channel, name)
+        with self.ready:
+            self.subsystems.add(channel.get_id())
+            self.ready.notify_all()
+        return started
+
+    def wait_command(self, channel):
+        with self.ready:
+            self.ready.wait_for(lambda: channel.get_id() in self.commands or channel.get_id() in self.subsystems, timeout=10)
+            if channel.get_id() in self.subsystems:
+                return SUBSYSTEM
+            return self.commands.pop(channel.get_id(), None)
+
+
+class SimulatedSFTPHandle(paramiko.SFTPHandle):
+    def __init__(self, sftp, path, flags, local_file):
+        super().__init__(flags)
+        self.sftp = sftp
+        self.filename = path
+        self.readfile = local_file
+        self.writefile = local_file
+
+    def write(self, offset, data):
+        if self.sftp.dropped or not self.sftp.simulator.sftp_write_allowed(len(data)):
+            # What was written so far stays in the file, like a VM that lost its network,
+            # writes that were already on the wire are lost with the connection
+            self.sftp.dropped = True
+            self.sftp.transport.close()
+            return paramiko.SFTP_FAILURE
+        return super().write(offset, data)
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        if attr._flags & attr.FLAG_SIZE:
+            self.writefile.flush()
+            os.ftruncate(self.writefile.fileno(), attr.st_size)
+        return paramiko.SFTP_OK
+
+
+class SimulatedSFTP(paramiko.SFTPServerInterface):
+    '''
+    SFTP subsystem on the simulator's files, remote paths map into
+    simulator.root.
+    '''
+    def __init__(self, server, simulator, transport):
+        super().__init__(server)
+        self.simulator = simulator
+        self.transport = transport
+        self.dropped = False
+
+    def local(self, path):
+        return self.simulator.local_path(path)
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.local(path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        # Unbuffered, the bytes of a dropped upload are on disk at once
+        return SimulatedSFTPHandle(self, self.local(path), flags, os.fdopen(fd, mode, buffering=0))
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.local(path), name)), name)
+                    for name in os.listdir(self.local(path))]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def remove(self, path):
+        try:
+            os.remove(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self.local(oldpath), self.local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        self.simulator.event(f"sftp rename {oldpath} -> {newpath}")
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class SSHD:
+    '''
+    Threaded SSH server on 127.0.0.1 that hands every exec request
+    to handler(channel, command) on its own thread, and SFTP to
+    SimulatedSFTP on sftp's files when given.
+    '''
+    def __init__(self, handler, username=USERNAME, password=PASSWORD, sftp=None):
+        self.handler = handler
+        self.sftp = sftp
+        self.username = username
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.handshakes = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(100)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.handshakes += 1
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self.serve_transport, args=(conn,), daemon=True).start()
+
+    def serve_transport(self, conn):
+        server = SSHServer(self.username, self.password)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        if self.sftp is not None:
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, SimulatedSFTP, self.sftp, transport)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError):
+            return
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            threading.Thread(target=self.serve_channel, args=(server, channel), daemon=True).start()
+
+    def serve_channel(self, server, channel):
+        command = server.wait_command(channel)
+        if command is SUBSYSTEM:
+            # The subsystem's own thread serves the channel
+            return
+        if command is None:
+            channel.close()
+            return
+        # The exec reply is sent by the transport thread after the check
+        # returns, give it a head start over the handler's first packet
+        time.sleep(0.005)
+        try:
+            self.handler(channel, command)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass
+        finally:
+            channel.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    TOKEN = 'stub-token'
+    MANIFEST = re.compile(r'^/v2/(.+)/manifests/([^/]+)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def handle_manifest(self):
+        registry = self.server.registry
+        registry.record(self)
+        if self.path.startswith('/token'):
+            return self.reply(200, json.dumps({'token': self.TOKEN}).encode(), {'Content-Type': 'application/json'})
+        match = self.MANIFEST.match(self.path)
+        if not match:
+            return self.reply(404)
+        repository, reference = match.groups()
+        if registry.simulator.scenario['registry_auth'] and self.headers.get('Authorization') != f"Bearer {self.TOKEN}":
+            realm = f"http://127.0.0.1:{registry.port}/token"
+            return self.reply(401, headers={'WWW-Authenticate':
+                              f'Bearer realm="{realm}",service="stub",scope="repository:{repository}:pull"'})
+        service = repository.rsplit('/', 1)[-1]
+        if service in registry.simulator.scenario['missing_images'] or service not in registry.simulator.images():
+            return self.reply(404, b'{"errors":[{"code":"MANIFEST_UNKNOWN"}]}', {'Content-Type': 'application/json'})
+        image = registry.simulator.image_ref(service)
+        return self.reply(200, b'{}', {'Docker-Content-Digest': image_digest(image),
+                                       'Content-Type': 'application/vnd.docker.distribution.manifest.v2+json'})
+
+    do_HEAD = handle_manifest
+    do_GET = handle_manifest
+
+
+class StubRegistry:
+    '''
+    Registry HTTP API v2 manifest endpoint for the simulator's images.
+    Counts requests and distinct client connections, so connection
+    reuse shows up as connections < requests.
+    '''
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.requests = 0
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RegistryHandler)
+        self.server.daemon_threads = True
+        self.server.registry = self
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def record(self, handler):
+        with self.lock:
+            self.requests += 1
+            self.clients.add(handler.client_address)
+
+    @property
+    def connections(self):
+        return len(self.clients)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def image_digest(image):
+    return 'sha256:' + hashlib.sha256(image.encode()).hexdigest()
+
+
+class Simulator:
+    def __init__(self, scenario=None):
+        self.scenario = dict(DEFAULT_SCENARIO)
+        self.scenario.update(scenario or {})
+        self.lock = threading.Condition()
+        self.status = self.scenario['status']
+        self.releases = list(self.scenario['releases'])
+        self.published = set(self.scenario['published_builds'])
+        self.present = set(self.scenario['present_images'])
+        self.processed = None       # contents of .images_processed
+        self.utm_zips = {}         # version -> time it was published
+        self.log = []               # local-stack-logs.out lines
+        self.events = []
+        self.execs = []
+        self.started = None
+        self.root = tempfile.mkdtemp(prefix='localstack-sim-')   # the VM's files for SFTP and sha256sum
+        self.sftp_written = 0
+        self.sshd = SSHD(self.handle, sftp=self)
+        self.port = self.sshd.port
+        self.registry = StubRegistry(self)
+        self.handlers = [
+            (r'inotifywait', self.watch_status),
+            (r'^d=\$\(mktemp -d\)', self.batch_probe),
+            (r"^echo \S+ \$\(grep -q", self.release_state),
+            (r"^printf '%s\\n' (.+) >> \S+/sdwan_release$", self.append_releases),
+            (r'mkdir -p \S+/sdwan_releases/(\S+) && \S+publish-sdwan\.sh', self.publish_build),
+            (r'tar -C \S+/sdwan_releases -cf - (\S+)$', self.tar_build),
+            (r'tar -xf - -C \S+/sdwan_releases/\.(\S+)\.part$', self.untar_build),
+            (r'^mv \S+/\.(\S+)\.part/', self.move_build),
+            (r'^rm -rf \S+/sdwan_releases/(\S+?)(?:\.part)?(?:; exit (\d+))?$', self.remove_build),
+            (r'^sleep ([\d.]+) && echo (\S+)$', self.sleep),
+            (r"^head -c (\d+) '([^']+)' \| sha256sum$", self.sha256_prefix),
+            (r"^sha256sum '([^']+)'$", self.sha256sum),
+            (r"^cat '([^']+)'$", self.read_file),
+            (r"^echo (\S+) > '([^']+)'$", self.write_file),
+            (r'local-stack\.sh down', self.stack_down),
+            (r'local-stack\.sh up', self.stack_up),
+            (r'cat \S+/status_file', self.read_status),
+            (r'tail -n \+1 -F \S+/local-stack-logs\.out', self.follow_log),
+            (r'^cat \S+/local-stack-logs\.out$', self.read_log),
+            (r'tail -n 1 \S+/sdwan_release', self.last_release),
+            (r'cat \S+/sdwan_release', self.all_releases),
+            (r'ls \S+/([\d.]+)/sdwan-ae-utm\.zip', self.utm_zip),
+            (r"test -e '\S+/([\d.]+)/sdwan-ae-utm\.zip'(?:.* -ge (\d+))?", self.utm_zip_age),
+            (r'docker -v', self.docker_version),
+            (r"test -e '\S+/settings\.env'", self.settings_exists),
+            (r'cat \S+/settings\.env; echo \'(.+)\'; cat \S+/\.images_processed', self.settings),
+            (r"echo '(.+)' > \S+/\.images_processed", self.save_processed),
+            (r'docker image inspect', self.image_inspect),
+            (r'docker manifest inspect -v (\S+)', self.manifest_inspect),
+            (r'docker pull (\S+)', self.pull),
+            (r"docker save '(\S+)'", self.save),
+            (r'^loaded=\$\(docker load', self.load),
+            (r'curl -fsS http://localhost', self.ui),
+            (r'containers/json', self.container_count),
+            (r'ps -ef \| grep local-stack', self.mode),
+            (r'git fetch', self.git_fetch),
+            (r'docker inspect --format', self.container_images),
+        ]
+
+    # Lifecycle and bookkeeping
+
+    def start(self):
+        self.started = time.monotonic()
+        for delay, status in self.scenario['status_timeline']:
+            self.after(delay, self.set_status, status)
+        for delay, line in self.scenario['log_timeline']:
+            self.after(delay, self.write_log, line)
+        if self.status == 'UP' and self.releases:
+            # A stack that is already UP has published its sdwan-ae-utm.zip
+            self.utm_zips['.'.join(self.releases[-1].split('_')[:2])] = self.started - 3600
+        return self
+
+    def close(self):
+        self.sshd.close()
+        self.registry.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def local_path(self, remote_path):
+        return os.path.join(self.root, os.path.normpath('/' + remote_path).lstrip('/'))
+
+    def sftp_write_allowed(self, size):
+        with self.lock:
+            fail_after = self.scenario['sftp_fail_after']
+            if fail_after is not None and self.sftp_written + size > fail_after:
+                # Only the upload in progress breaks, the next one goes through
+                self.scenario['sftp_fail_after'] = None
+                self.events.append((time.monotonic(), 'sftp connection dropped'))
+                return False
+            self.sftp_written += size
+            return True
+
+    @property
+    def handshakes(self):
+        return self.sshd.handshakes
+
+    def event(self, name):
+        with self.lock:
+            self.events.append((time.monotonic(), name))
+            self.lock.notify_all()
+
+    def after(self, delay, func, *args):
+        timer = threading.Timer(delay, func, args)
+        timer.daemon = True
+        timer.start()
+
+    def set_status(self, status):
+        with self.lock:
+            self.status = status
+        self.event(f"status {status}")
+        if status == 'UP':
+            self.schedule_utm_zip()
+
+    def write_log(self, line):
+        with self.lock:
+            self.log.append(line)
+        self.event(f"log {line}")
+
+    def schedule_utm_zip(self):
+        version = '.'.join(self.releases[-1].split('_')[:2]) if self.releases else None
+        self.after(self.scenario['utm_zip_delay'], self.publish_utm_zip, version)
+
+    def publish_utm_zip(self, version):
+        with self.lock:
+            self.utm_zips[version] = time.monotonic()
+        self.event(f"utm zip {version}")
+
+    def handle(self, channel, command):
+        record = {'start': time.monotonic(), 'end': None, 'command': command}
+        self.execs.append(record)
+        time.sleep(self.scenario['hang'])
+        for pattern, handler in self.handlers:
+            match = re.search(pattern, command)
+            if match:
+                result = handler(channel, match)
+                break
+        else:
+            result = (127, '', f"simulator: unsupported command: {command}\n")
+        if result is not None:
+            exit_status, out, err = result
+            if out:
+                channel.sendall(out.encode())
+            if err:
+                channel.sendall_stderr(err.encode())
+            channel.send_exit_status(exit_status)
+        record['end'] = time.monotonic()
+
+    def images(self):
+        return [f"svc{i}" for i in range(1, self.scenario['images'] + 1)]
+
+    def image_ref(self, service):
+        return f"{self.scenario['registry_host']}/orchestrator/{service}:{self.scenario['image_tags'].get(service, '1.0.0')}"
+
+    def service_of(self, image):
+        return image.rsplit('/', 1)[-1].split(':')[0]
+
+    # Command handlers, returning (exit status, stdout, stderr)
+
+    def watch_status(self, channel, match):
+        if not self.scenario['inotify']:
+            return 127, '', ''
+        last = None
+        while not channel.closed:
+            with self.lock:
+                self.lock.wait_for(lambda: self.status != last or channel.closed, timeout=0.5)
+                status = self.status
+            if status != last:
+                channel.sendall(f"{status}\r\n".encode())
+                last = status
+        return None
+
+    def batch_probe(self, channel, match):
+        timeout = re.search(r'timeout (\d+) git fetch', match.string)
+        time.sleep(min(self.scenario['git_fetch_time'], int(timeout.group(1)) if timeout else 0))
+        fetched = not timeout or self.scenario['git_fetch_time'] <= int(timeout.group(1))
+        return 0, json.dumps({
+            'status': self.status,
+            'ui_up': self.status == 'UP',
+            'containers': TOTAL_CONTAINERS if self.status == 'UP' else 0,
+            'mode': ['onprem'],
+            'git_fetch_ok': fetched,
+            'commits_behind': 0,
+            'sw_versions': self.releases,
+            'images': [f"/{service} {image_digest(service)}" for service in self.images()],
+        }) + '\n', ''
+
+    def release_state(self, channel, match):
+        builds = re.findall(r"grep -q '(\S+)'", match.string)
+        return 0, ''.join(f"{build} {int(build in self.releases)} {int(build in self.published)}\n"
+                          for build in builds), ''
+
+    def append_releases(self, channel, match):
+        self.releases.extend(match.group(1).split())
+        return 0, '', ''
+
+    def publish_build(self, channel, match):
+        build = match.group(1)
+        time.sleep(self.scenario['publish_time'])
+        self.published.add(build)
+        self.event(f"published {build}")
+        return 0, f"Published {build}\n", ''
+
+    def build_archive(self, build):
+        block = hashlib.sha256(build.encode()).digest() * 2048
+        return (block * (self.scenario['build_size'] // len(block) + 1))[:self.scenario['build_size']]
+
+    def tar_build(self, channel, match):
+        build = match.group(1)
+        if build not in self.published:
+            return 2, '', f"tar: {build}: Cannot stat: No such file or directory\n"
+        channel.sendall(self.build_archive(build))
+        return 0, '', ''
+
+    def untar_build(self, channel, match):
+        received = b''
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            received += data
+        if received != self.build_archive(match.group(1)):
+            return 2, '', "tar: Unexpected EOF in archive\n"
+        return 0, '', ''
+
+    def move_build(self, channel, match):
+        build = match.group(1)
+        self.published.add(build)
+        self.event(f"restored {build}")
+        return 0, '', ''
+
+    def remove_build(self, channel, match):
+        self.published.discard(match.group(1).lstrip('.'))
+        return int(match.group(2) or 0), '', ''
+
+    def sleep(self, channel, match):
+        time.sleep(float(match.group(1)))
+        return 0, f"{match.group(2)}\n", ''
+
+    def sha256_prefix(self, channel, match):
+        try:
+            with open(self.local_path(match.group(2)), 'rb') as local_file:
+                data = local_file.read(int(match.group(1)))
+        except OSError:
+            data = b''
+        return 0, f"{hashlib.sha256(data).hexdigest()}  -\n", ''
+
+    def sha256sum(self, channel, match):
+        try:
+            with open(self.local_path(match.group(1)), 'rb') as local_file:
+                digest = hashlib.sha256(local_file.read()).hexdigest()
+        except OSError as e:
+            return 1, '', f"sha256sum: {match.group(1)}: {e.strerror}\n"
+        return 0, f"{digest}  {match.group(1)}\n", ''
+
+    def read_file(self, channel, match):
+        try:
+            with open(self.local_path(match.group(1))) as local_file:
+                return 0, local_file.read(), ''
+        except OSError as e:
+            return 1, '', f"cat: {match.group(1)}: {e.strerror}\n"
+
+    def write_file(self, channel, match):
+        path = self.local_path(match.group(2))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as local_file:
+            local_file.write(match.group(1) + '\n')
+        return 0, '', ''
+
+    def stack_down(self, channel, match):
+        channel.sendall(b"Stopping local-stack\n")
+        time.sleep(self.scenario['down_time'])
+        with self.lock:
+            self.utm_zips.clear()
+        self.set_status('Down')
+        return 0, "local-stack is down\n", ''
+
+    def stack_up(self, channel, match):
+        self.set_status('starting')
+        self.after(self.scenario['up_time'], self.finish_up)
+        return 0, '', ''
+
+    def finish_up(self):
+        if self.scenario['db_migration_failed']:
+            self.write_log("ERROR DB migration failed")
+        self.set_status('DOWN' if self.scenario['db_migration_failed'] else 'UP')
+
+    def read_status(self, channel, match):
+        return 0, f"{self.status}\n", ''
+
+    def follow_log(self, channel, match):
+        sent = 0
+        while not channel.closed:
+            with self.lock:
+                self.lock.wait_for(lambda: len(self.log) != sent or channel.closed, timeout=0.5)
+                lines = self.log[sent:]
+            if lines:
+                channel.sendall(''.join(f"{line}\r\n" for line in lines).encode())
+                sent += len(lines)
+        return None
+
+    def read_log(self, channel, match):
+        with self.lock:
+            return 0, ''.join(f"{line}\n" for line in self.log), ''
+
+    def last_release(self, channel, match):
+        return 0, f"{self.releases[-1]}\n" if self.releases else '', ''
+
+    def all_releases(self, channel, match):
+        return 0, ''.join(f"{release}\n" for release in self.releases), ''
+
+    def utm_zip(self, channel, match):
+        if match.group(1) in self.utm_zips:
+            return 0, f"{match.group(0)[3:]}\n", ''
+        return 2, '', f"ls: cannot access '{match.group(0)[3:]}': No such file or directory\n"
+
+    def utm_zip_age(self, channel, match):
+        published = self.utm_zips.get(match.group(1))
+        if published is None or time.monotonic() - published < int(match.group(2) or 0):
+            return 1, '', ''
+        return 0, "present\n", ''
+
+    def docker_version(self, channel, match):
+        return 0, "0\n", ''
+
+    def settings_exists(self, channel, match):
+        if time.monotonic() - self.started < self.scenario['settings_delay']:
+            return 1, '', ''
+        return 0, "present\n", ''
+
+    def settings(self, channel, match):
+        lines = ["# generated by local-stack", f"REGISTRY={self.scenario['registry_host']}", "SERVICES_IMAGES=\\"]
+        lines += [f"{service.upper()}_IMAGE=sdwan-services-{self.scenario['registry']}:{service}:{self.image_ref(service)} \\"
+                  for service in self.images()]
+        lines.append(f"UI_IMAGE=sdwan-ui:ui:{self.scenario['registry_host']}/ui:2.0.0")
+        out = '\n'.join(lines) + f"\n{match.group(1)}\n"
+        if self.processed is not None:
+            out += self.processed + '\n'
+        return 0, out, ''
+
+    def save_processed(self, channel, match):
+        self.processed = match.group(1)
+        return 0, '', ''
+
+    def image_inspect(self, channel, match):
+        lines = []
+        for image in re.findall(r'echo (\S+) \$\(docker image inspect', match.string):
+            if self.service_of(image) in self.present:
+                lines.append(f"{image} {image.rsplit(':', 1)[0]}@{image_digest(image)}")
+            else:
+                lines.append(image)
+        return 0, ''.join(f"{line}\n" for line in lines), ''
+
+    def manifest_inspect(self, channel, match):
+        image = match.group(1)
+        if self.service_of(image) in self.scenario['missing_images']:
+            return 1, '', f"no such manifest: {image}\n"
+        if self.service_of(image) in self.scenario['multi_arch_images']:
+            # docker manifest inspect -v of an index lists the platform manifests only
+            return 0, json.dumps([{'Ref': f"{image}@{image_digest(image + platform)}",
+                                   'Descriptor': {'digest': image_digest(image + platform),
+                                                  'platform': {'architecture': platform, 'os': 'linux'}}}
+                                  for platform in ('amd64', 'arm64')]), ''
+        return 0, json.dumps({'Ref': image, 'Descriptor': {'digest': image_digest(image)}}), ''
+
+    def pull(self, channel, match):
+        image = match.group(1)
+        time.sleep(self.scenario['pull_time'])
+        if self.service_of(image) in self.scenario['missing_images']:
+            return 1, '', f"Error response from daemon: manifest for {image} not found: manifest unknown\n"
+        self.present.add(self.service_of(image))
+        self.event(f"pulled {image}")
+        return 0, '', ''
+
+    def save(self, channel, match):
+        image = match.group(1)
+        if self.service_of(image) not in self.present:
+            return 1, '', f"Error response from daemon: reference does not exist\n"
+        block = hashlib.sha256(image.encode()).digest() * 2048
+        remaining = self.scenario['image_size']
+        while remaining > 0:
+            channel.sendall(block[:remaining])
+            remaining -= len(block)
+        return 0, '', ''
+
+    def load(self, channel, match):
+        received = 0
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            received += len(data)
+        image = re.search(r"= '(\S+)'", match.string).group(1)
+        if received < self.scenario['image_size']:
+            return 1, '', f"unexpected EOF after {received} bytes\n"
+        self.present.add(self.service_of(image))
+        self.event(f"loaded {image}")
+        return 0, '', ''
+
+    def ui(self, channel, match):
+        return (0 if self.status == 'UP' else 7), '', ''
+
+    def container_count(self, channel, match):
+        return 0, f"{TOTAL_CONTAINERS if self.status == 'UP' else 0}\n", ''
+
+    def mode(self, channel, match):
+        return 0, "onprem\n", ''
+
+    def git_fetch(self, channel, match):
+        time.sleep(self.scenario['git_fetch_time'])
+        return 0, "0\n", ''
+
+    def container_images(self, channel, match):
+        return 0, ''.join(f"/{service} {image_digest(service)}\n" for service in self.images()), ''
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a simulated local-stack VM over SSH on 127.0.0.1')
+    parser.add_argument('-s', help='JSON file with scenario overrides', default=None)
+    parser.add_argument('-t', type=float, help='Seconds to keep serving (default: until interrupted)', default=None)
+    script_namespace = parser.parse_args()
+
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    scenario = {}
+    if script_namespace.s:
+        with open(script_namespace.s) as scenario_file:
+            scenario = json.load(scenario_file)
+    sim = Simulator(scenario).start()
+    print(f"Simulated local-stack listening on 127.0.0.1:{sim.port} (user {USERNAME}, password {PASSWORD}), "
+          f"registry on 127.0.0.1:{sim.registry.port}", flush=True)
+    try:
+        time.sleep(script_namespace.t) if script_namespace.t else threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    sim.close()
+    sys.exit(0)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+ Streaming watcher for local-stack-logs.out. A second exec
+ channel runs tail -F on the log next to the status_file wait,
+ every line is matched against fatal and progress patterns, and
+ the wait is abandoned the moment a fatal pattern shows up
+ instead of after status_file turns DOWN.
+
+  +-------+   status_file changes  +-------------+
+  |       |<-----------------------|             |
+  | node  |   local-stack-logs.out | local-stack |
+  |       |<-----------------------|             |
+  +-------+                        +-------------+
+
+ Usage:
+   with log_watcher.LogWatcher(client) as watcher:
+       status = watcher.run(status_watcher.wait_for_status, client, predicate, deadline)
+
+'''
+import re
+import shlex
+import time
+import socket
+import threading
+import timing
+
+LS_BASEPATH = '/local-stack'
+LOG_FILE = f"{LS_BASEPATH}/local-stack-logs.out"
+FATAL_PATTERNS = [r'DB migration failed']
+PROGRESS_PATTERNS = [r'DB migration']
+CONTEXT_LINES = 5
+
+
+class FatalLogLine(Exception):
+    def __init__(self, pattern, lines, elapsed):
+        super().__init__(f"'{pattern}' in the log after {elapsed:.0f}s")
+        self.pattern = pattern
+        self.lines = lines
+        self.elapsed = elapsed
+
+
+class LogWatcher:
+    def __init__(self, client, log_file=LOG_FILE, fatal=FATAL_PATTERNS, progress=PROGRESS_PATTERNS, on_line=print):
+        self.client = client
+        self.log_file = log_file
+        self.fatal = [re.compile(pattern) for pattern in fatal]
+        self.progress = [re.compile(pattern) for pattern in progress]
+        self.on_line = on_line
+        self.recent = []
+        self.error = None
+        self.done = threading.Event()
+        self.channel = None
+        self.begin = time.monotonic()
+
+    def __enter__(self):
+        # local-stack.sh up rewrites the log, so all of it belongs to this bring-up.
+        # A pty makes sshd hang up tail when the channel closes
+        stdin, stdout, stderr = self.client.exec_command(f"tail -n +1 -F {self.log_file} 2>/dev/null", get_pty=True)
+        self.channel = stdout.channel
+        threading.Thread(target=self.follow, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.channel.close()
+
+    def follow(self):
+        buffer = b''
+        while not self.done.is_set():
+            self.channel.settimeout(1)
+            try:
+                data = self.channel.recv(4096)
+            except socket.timeout:
+                continue
+            except (OSError, EOFError):
+                return
+            if not data:
+                return
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self.match(line.decode(errors='replace').rstrip())
+
+    def match(self, line):
+        self.recent = (self.recent + [line])[-CONTEXT_LINES:]
+        elapsed = time.monotonic() - self.begin
+        for pattern in self.fatal:
+            if pattern.search(line):
+                timing.add('log', f"fatal: {line}", self.begin)
+                self.error = FatalLogLine(pattern.pattern, list(self.recent), elapsed)
+                self.done.set()
+                return
+        for pattern in self.progress:
+            if pattern.search(line):
+                timing.add('log', line, self.begin)
+                if self.on_line:
+                    self.on_line(f"[{elapsed:>5.0f}s] {line}")
+                return
+
+    def run(self, func, *args, **kwargs):
+        '''
+        Returns func(*args, **kwargs), which runs in a thread, or
+        raises FatalLogLine as soon as a fatal pattern matches.
+        '''
+        result = {}
+
+        def target():
+            try:
+                result['value'] = func(*args, **kwargs)
+            except BaseException as e:
+                result['error'] = e
+            self.done.set()
+
+        # A daemon thread, a wait abandoned on a fatal line must not hold the process
+        threading.Thread(target=target, daemon=True).start()
+        self.done.wait()
+        if self.error:
+            raise self.error
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    def search(self):
+        '''
+        Returns (pattern, lines) of the fatal pattern found first in
+        the whole log, (None, []) when there is none.
+        '''
+        # Matched here with the same Python regexes as the streamed lines, grep -E differs in syntax
+        stdin, stdout, stderr = self.client.exec_command(f"cat {shlex.quote(self.log_file)}")
+        matching = {pattern.pattern: [] for pattern in self.fatal}
+        for line in stdout:
+            line = line.rstrip()
+            for pattern in self.fatal:
+                if pattern.search(line):
+                    matching[pattern.pattern].append(line)
+        for pattern in self.fatal:
+            if matching[pattern.pattern]:
+                return pattern.pattern, matching[pattern.pattern]
+        return None, []
@@ -10,80 +10,77 @@
   +-------+           +-------------+
 
   -h, --help  show this help message and exit
-  -i I        VM ip where local-stack is running
+  -i I        VM ip where local-stack is running, several ips probe a fleet
+  -f F        File with one VM ip per line, - for stdin
   -u U        VM username
   -p P        VM password
   -a A        Action - Available choices=['health', 'status', 'all']
+  -b          Run all probes in parallel on the VM in a single round-trip
+  -g G        Timeout in seconds for git fetch in batch mode
+  -w W        VMs probed at the same time in fleet mode (default: 16)
+  -T T        Timeout in seconds per VM in fleet mode, connection and
+              probe included (default: 60)
+  -B B        Fleet backend: thread, a worker thread per VM, or async,
+              every VM on one event loop (default: thread)
+  --json      Print the batch probe result as json (implies -b),
+              or the fleet results as a json list
+
+ Fleet mode runs the batch probe on every VM concurrently and
+ prints one line per VM:
+   ls_state.py -u user -p pass -f localstacks.txt
 
 '''
 import time
 import sys
+import json
 import re
 import pathlib
 import argparse
-import paramiko
-
-# Parse Arguments
-parser = argparse.ArgumentParser(description='Provides information about local-stack health and status.')
-parser.add_argument('-i', "--ip_address", type=str, required=True, help='VM ip where local-stack is running')
-parser.add_argument('-u', "--username", type=str, required=True, help='VM username')
-parser.add_argument('-p', "--password", type=str, required=True, help='VM password')
-parser.add_argument('-a', "--action", choices=['health', 'status', 'all'], type=str, required=False, default="all", help='Action (default: all)')
-args = parser.parse_args()
-
-ls_basepath = '/local-stack'
-vm_ip = args.ip_address
-vm_user = args.username
-vm_pass = args.password
-action = args.action
-
-# Check IP validity
-pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
-if not pattern.match(vm_ip):
-    sys.exit('Invalid local-stack IP')
-
-try:
-    ssh_handle = paramiko.SSHClient()
-    ssh_handle.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh_handle.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
-except paramiko.AuthenticationException:
-    sys.exit('Authentication failed')
-except paramiko.ssh_exception.BadHostKeyException:
-    sys.exit('Host key could not be verified')
-except paramiko.SSHException:
-    sys.exit('Unable to establish SSH connection')
-
-def get_image_list():
+import socket
+import asyncio
+import timing
+import async_exec
+import remote_exec
+from concurrent.futures import ThreadPoolExecutor
+
+LS_BASEPATH = '/local-stack'
+EXPECTED_CONTAINERS = 34
+GIT_TIMEOUT = 20
+HOST_TIMEOUT = 60
+CONNECT_SHARE = 0.25
+FLEET_WORKERS = 16
+
+def get_image_list(ssh_handle):
     cmd = f"docker inspect --format='{{{{.Name}}}} {{{{.Image}}}}' $(docker ps -aq)"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     print("\nDocker containers and image IDs:\n")
     for line in stdout.readlines():
         print(line.strip())
 
-def get_sw_versions():
-    cmd = f"cat {ls_basepath}/sdwan_release"
+def get_sw_versions(ssh_handle):
+    cmd = f"cat {LS_BASEPATH}/sdwan_release"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     print("\nSupported SDWAN appliance software versions:\n")
     for line in stdout.readlines():
         print(line.strip())
 
-def get_ls_mode():
+def get_ls_mode(ssh_handle):
     cmd = f"ps -ef | grep local-stack | grep -v grep | awk '{{print $14}}'"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     print("\nLocal-stack is running in mode:\n")
     for line in stdout.readlines():
         print(line.strip())
 
-def commits_behind_remote_counterpart():
-    cmd = f"cd {ls_basepath}; git fetch; git rev-list --left-right --count origin/development...development | awk '{{print $1}}'"
+def commits_behind_remote_counterpart(ssh_handle):
+    cmd = f"cd {LS_BASEPATH}; git fetch; git rev-list --left-right --count origin/development...development | awk '{{print $1}}'"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     print("\nLocal development branch of current local-stack deployment is behind it's remote counterpart by:\n")
     for line in stdout.readlines():
         print(line.strip()+" commits")
 
-def ls_up():
+def ls_up(ssh_handle):
     print("Polling status_file")
-    cmd = f"cat {ls_basepath}/status_file"
+    cmd = f"cat {LS_BASEPATH}/status_file"
     status_up = False
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     for line in stdout.readlines():
@@ -95,7 +92,7 @@ def ls_up():
     print("Localstack status is down")
     return False
 
-def ls_ui_up():
+def ls_ui_up(ssh_handle):
     cmd = f"curl -fsS http://localhost > /dev/null"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     out = stdout.readlines()
@@ -105,37 +102,261 @@ def ls_ui_up():
     print("Localstack UI is down")
     return False
 
-def ls_containers():
+def ls_containers(ssh_handle):
     cmd = f"curl -s --unix-socket /var/run/docker.sock http://localhost/containers/json | jq '. | length'"
     stdin, stdout, stderr = ssh_handle.exec_command(cmd)
     count = stdout.readlines()[0].strip()
     print("Running local-stack containers: {}".format(count))
     return int(count)
 
-def get_ls_health():
-    if ls_up() and ls_ui_up() and ls_containers() == 34:
+def get_ls_health(ssh_handle):
+    if ls_up(ssh_handle) and ls_ui_up(ssh_handle) and ls_containers(ssh_handle) == EXPECTED_CONTAINERS:
         print("\nLocalstack health: OK")
         return True
     print("\nLocalstack health: UNHEALTHY")
     return False
 
-def get_ls_status():
-    get_ls_mode()
-    commits_behind_remote_counterpart()
-    get_sw_versions()
-    get_image_list()
+def get_ls_status(ssh_handle):
+    get_ls_mode(ssh_handle)
+    commits_behind_remote_counterpart(ssh_handle)
+    get_sw_versions(ssh_handle)
+    get_image_list(ssh_handle)
 
-def main():
-    if action == "health":
-        get_ls_health()
+# Every probe runs in the background on the VM, writing to its own file,
+# and jq assembles the results into a single json document
+PROBE_SCRIPT = '''d=$(mktemp -d); trap 'rm -rf "$d"' EXIT
+cat {LS_BASEPATH}/status_file > $d/status 2>/dev/null &
+(curl -fsS http://localhost > /dev/null 2>&1; echo $? > $d/ui) &
+curl -s --unix-socket /var/run/docker.sock http://localhost/containers/json | jq '. | length' > $d/containers 2>/dev/null &
+ps -ef | grep local-stack | grep -v grep | awk '{{print $14}}' > $d/mode &
+(cd {LS_BASEPATH}; timeout {git_timeout} git fetch -q > /dev/null 2>&1; echo $? > $d/fetch; git rev-list --left-right --count origin/development...development 2>/dev/null | awk '{{print $1}}' > $d/behind) &
+cat {LS_BASEPATH}/sdwan_release > $d/versions 2>/dev/null &
+{{ docker inspect --format='{{{{.Name}}}} {{{{.Image}}}}' $(docker ps -aq); }} > $d/images 2>/dev/null &
+wait
+lines='split("\\n") | map(select(length > 0))'
+jq -n -c --arg status "$(cat $d/status)" --arg ui "$(cat $d/ui)" --arg containers "$(cat $d/containers)" \\
+  --arg mode "$(cat $d/mode)" --arg fetch "$(cat $d/fetch)" --arg behind "$(cat $d/behind)" \\
+  --arg versions "$(cat $d/versions)" --arg images "$(cat $d/images)" \\
+  "{{status: \\$status, ui_up: (\\$ui == \\"0\\"), containers: (\\$containers | tonumber? // 0),
+    mode: (\\$mode | $lines), git_fetch_ok: (\\$fetch == \\"0\\"), commits_behind: (\\$behind | tonumber? // null),
+    sw_versions: (\\$versions | $lines), images: (\\$images | $lines)}}"
+'''
 
-    if action == "status":
-        get_ls_status()
+def probe(ssh_handle, git_timeout=GIT_TIMEOUT, timeout=None):
+    cmd = PROBE_SCRIPT.format(LS_BASEPATH=LS_BASEPATH, git_timeout=git_timeout)
+    stdin, stdout, stderr = ssh_handle.exec_command(cmd, timeout=timeout)
+    return parse_probe(stdout.read().decode())
 
-    if action == "all":
-        get_ls_health()
-        get_ls_status()
+def parse_probe(out):
+    result = json.loads(out)
+    result['healthy'] = result['status'] == 'UP' and result['ui_up'] and result['containers'] == EXPECTED_CONTAINERS
+    return result
 
-if __name__ == "__main__":
-    main()
+def print_probe_health(result):
+    print("Localstack status is {}".format("up" if result['status'] == 'UP' else "down"))
+    print("Localstack UI is {}".format("up" if result['ui_up'] else "down"))
+    print("Running local-stack containers: {}".format(result['containers']))
+    print("\nLocalstack health: {}".format("OK" if result['healthy'] else "UNHEALTHY"))
+
+def print_probe_status(result, git_timeout=GIT_TIMEOUT):
+    print("\nLocal-stack is running in mode:\n")
+    print(*result['mode'], sep="\n")
+    print("\nLocal development branch of current local-stack deployment is behind it's remote counterpart by:\n")
+    if not result['git_fetch_ok']:
+        print("(git fetch failed or timed out after {}s, using last fetched state)".format(git_timeout))
+    print("{} commits".format(result['commits_behind']))
+    print("\nSupported SDWAN appliance software versions:\n")
+    print(*result['sw_versions'], sep="\n")
+    print("\nDocker containers and image IDs:\n")
+    print(*result['images'], sep="\n")
+
+def host_deadline(host_timeout):
+    '''
+    Returns (end, connect_timeout) of one deadline for a host: TCP
+    connect, banner and auth get CONNECT_SHARE of it each at most,
+    the probe what is left, so a hung VM costs host_timeout in all.
+    '''
+    return time.monotonic() + host_timeout, host_timeout * CONNECT_SHARE
+
+def remaining_time(end):
+    remaining = end - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout()
+    return remaining
+
+def probe_host(host, vm_user, vm_pass, git_timeout=GIT_TIMEOUT, host_timeout=HOST_TIMEOUT, opened=None):
+    import paramiko
+    import ssh_pool
+    ip, _, port = host.partition(':')
+    result = {'host': host}
+    end, connect_timeout = host_deadline(host_timeout)
+    try:
+        client = ssh_pool.get_client(ip, vm_user, vm_pass, port=port or None,
+                                     timeout=connect_timeout, banner_timeout=connect_timeout, auth_timeout=connect_timeout)
+        if opened is not None:
+            opened.append(client)
+        remaining = remaining_time(end)
+        result.update(probe(client, max(int(min(git_timeout, remaining)), 1), remaining))
+        if opened is None:
+            client.close()
+    except paramiko.AuthenticationException:
+        result['error'] = 'authentication failed'
+    except socket.timeout:
+        result['error'] = f"timed out after {host_timeout}s"
+    except (paramiko.SSHException, EOFError, OSError, ValueError) as e:
+        result['error'] = str(e) or type(e).__name__
+    return result
+
+async def probe_host_async(host, vm_user, vm_pass, git_timeout=GIT_TIMEOUT, host_timeout=HOST_TIMEOUT, opened=None):
+    import paramiko
+    ip, _, port = host.partition(':')
+    result = {'host': host}
+    end, connect_timeout = host_deadline(host_timeout)
+    try:
+        client = await async_exec.connect(ip, vm_user, vm_pass, port=int(port) if port else None, timeout=connect_timeout,
+                                          banner_timeout=connect_timeout, auth_timeout=connect_timeout)
+        if opened is not None:
+            opened.append(client.pooled)
+        remaining = remaining_time(end)
+        cmd = PROBE_SCRIPT.format(LS_BASEPATH=LS_BASEPATH, git_timeout=max(int(min(git_timeout, remaining)), 1))
+        exit_status, out, err = await client.read(cmd, remaining)
+        result.update(parse_probe(out))
+    except paramiko.AuthenticationException:
+        result['error'] = 'authentication failed'
+    except (socket.timeout, remote_exec.RemoteTimeout):
+        result['error'] = f"timed out after {host_timeout}s"
+    except (paramiko.SSHException, EOFError, OSError, ValueError) as e:
+        result['error'] = str(e) or type(e).__name__
+    return result
+
+async def probe_fleet_async(hosts, vm_user, vm_pass, workers=FLEET_WORKERS, git_timeout=GIT_TIMEOUT,
+                            host_timeout=HOST_TIMEOUT):
+    opened = []
+    # At most workers hosts are probed at a time, like the thread backend
+    slots = asyncio.Semaphore(workers)
+
+    async def bounded(host):
+        async with slots:
+            return await probe_host_async(host, vm_user, vm_pass, git_timeout, host_timeout, opened)
+
+    results = await asyncio.gather(*(bounded(host) for host in hosts))
+    return results, opened
 
+def probe_fleet(hosts, vm_user, vm_pass, workers=FLEET_WORKERS, git_timeout=GIT_TIMEOUT, host_timeout=HOST_TIMEOUT,
+                backend='thread'):
+    if backend == 'async':
+        # Handshakes still take a pool thread each, the probes then share the event loop
+        results, opened = asyncio.run(probe_fleet_async(hosts, vm_user, vm_pass, workers, git_timeout, host_timeout))
+    else:
+        opened = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda host: probe_host(host, vm_user, vm_pass, git_timeout, host_timeout, opened),
+                                        hosts))
+    # Hosts naming the same VM share its pooled client, it is closed once every probe is done
+    for client in set(opened):
+        client.close()
+    return results
+
+def print_fleet(results):
+    print(f"{'host':<21} {'health':<9} {'status':<10} {'containers':>10} {'mode':<10} {'behind':>6}  versions")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['host']:<21} {'ERROR':<9} {result['error']}")
+            continue
+        versions = result['sw_versions']
+        latest = f"{versions[-1]} (+{len(versions) - 1})" if len(versions) > 1 else ''.join(versions)
+        behind = '?' if result['commits_behind'] is None else result['commits_behind']
+        print(f"{result['host']:<21} {'OK' if result['healthy'] else 'UNHEALTHY':<9} {result['status']:<10} "
+              f"{result['containers']:>10} {','.join(result['mode']):<10} {behind:>6}  {latest}")
+
+def read_hosts(hosts, fleet_file):
+    if fleet_file:
+        with (sys.stdin if fleet_file == '-' else open(fleet_file)) as hosts_file:
+            hosts = hosts + [line.split('#')[0].strip() for line in hosts_file]
+    hosts = [host for host in hosts if host]
+    pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(:\d+)?$")
+    for host in hosts:
+        if not pattern.match(host):
+            sys.exit(f'Invalid local-stack IP {host}')
+    return hosts
+
+def main_fleet(args, hosts):
+    results = probe_fleet(hosts, args.username, args.password, args.workers, args.git_timeout, args.host_timeout,
+                          args.backend)
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print_fleet(results)
+    if any('error' in result or not result['healthy'] for result in results):
+        sys.exit(1)
+
+def main_batch(ssh_handle, args):
+    result = probe(ssh_handle, args.git_timeout)
+    if args.json:
+        print(json.dumps(result))
+        return
+    if args.action in ("health", "all"):
+        print_probe_health(result)
+    if args.action in ("status", "all"):
+        print_probe_status(result, args.git_timeout)
+
+def main(args):
+    hosts = read_hosts(args.ip_address, args.fleet_file)
+    if not hosts:
+        sys.exit('No local-stack IP given')
+    if len(hosts) > 1 or args.fleet_file:
+        main_fleet(args, hosts)
+        return
+
+    # Check IP validity
+    pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
+    if not pattern.match(hosts[0]):
+        sys.exit('Invalid local-stack IP')
+
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
+
+    try:
+        ssh_handle = ssh_pool.get_client(hosts[0], args.username, args.password)
+    except paramiko.AuthenticationException:
+        sys.exit('Authentication failed')
+    except paramiko.ssh_exception.BadHostKeyException:
+        sys.exit('Host key could not be verified')
+    except paramiko.SSHException:
+        sys.exit('Unable to establish SSH connection')
+
+    if args.batch or args.json:
+        main_batch(ssh_handle, args)
+        return
+
+    if args.action == "health":
+        get_ls_health(ssh_handle)
+
+    if args.action == "status":
+        get_ls_status(ssh_handle)
+
+    if args.action == "all":
+        get_ls_health(ssh_handle)
+        get_ls_status(ssh_handle)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='Provides information about local-stack health and status.')
+    parser.add_argument('-i', "--ip_address", type=str, nargs='+', default=[], help='VM ip where local-stack is running, several ips probe a fleet')
+    parser.add_argument('-f', "--fleet_file", type=str, required=False, default=None, help='File with one VM ip per line, - for stdin')
+    parser.add_argument('-u', "--username", type=str, required=True, help='VM username')
+    parser.add_argument('-p', "--password", type=str, required=True, help='VM password')
+    parser.add_argument('-a', "--action", choices=['health', 'status', 'all'], type=str, required=False, default="all", help='Action (default: all)')
+    parser.add_argument('-b', "--batch", action='store_true', help='Run all probes in parallel on the VM in a single round-trip')
+    parser.add_argument('-g', "--git_timeout", type=int, required=False, default=GIT_TIMEOUT, help='Timeout in seconds for git fetch in batch mode (default: 20)')
+    parser.add_argument('-w', "--workers", type=int, required=False, default=FLEET_WORKERS, help='VMs probed at the same time in fleet mode (default: 16)')
+    parser.add_argument('-T', "--host_timeout", type=int, required=False, default=HOST_TIMEOUT, help='Timeout in seconds per VM in fleet mode, connection and probe included (default: 60)')
+    parser.add_argument('-B', "--backend", choices=async_exec.BACKENDS, type=str, required=False, default='thread', help='Fleet backend, a thread per VM or one event loop (default: thread)')
+    parser.add_argument("--json", action='store_true', help='Print the batch probe result as json (implies --batch)')
+    args = parser.parse_args(argv)
+
+    timing.start()
+    main(args)
+
+if __name__ == "__main__":
+    cli()
@@ -1,61 +1,180 @@
 #!/usr/bin/env python3
+'''
+ Script that provisions customers on the local-stack Orchestrator:
+ create customer, import config, patch serials, set version, wait
+ for the sites to be online and stage and activate. Several
+ customers run their pipelines concurrently, at most -P at a time,
+ over one pooled HTTP session, and a per-customer summary is
+ printed at the end.
 
-from orchestrator_utils import OrchestratorAPIClient
+  +------+   https   +--------------+
+  | node |---------->| Orchestrator |
+  +------+           +--------------+
+
+  -h, --help  show this help message and exit
+  -c C        Customer name, several customers are provisioned concurrently
+  -j J        Json config file, one for all customers or one per -c
+  -f F        File with one "customer config.json" pair per line, - for stdin
+  -l L        Localstack Orchestrator IP
+  -v V        Target version for Staging
+  -t T        Seconds to wait for sites to be online and stable (default: 300)
+  -w W        Seconds all sites must stay online in a row (default: 70)
+  -i I        Seconds between site status checks (default: 10)
+  -P P        Customers provisioned at the same time (default: 8)
+
+ The API client comes from orchestrator_utils, or from the module
+ named by $ORCHESTRATOR_CLIENT, i.e. orchestrator_simulator for a
+ run against a local mock of the Orchestrator API.
+
+'''
+from concurrent.futures import ThreadPoolExecutor
+import os
 import json
 import sys
 import argparse
+import importlib
 import requests
 import time
+import orchestrator_http
+import timing
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 # Parse Arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("-c", "--customer_name", type=str, required=True, help="Customer name")
+parser = argparse.ArgumentParser(prog=os.path.basename(__file__))
+parser.add_argument("-c", "--customer_name", type=str, nargs='+', default=[], help="Customer name, several customers are provisioned concurrently")
 parser.add_argument("-l", "--localstack_ip", type=str, required=True, help="Localstack Orchestrator IP")
-parser.add_argument("-j", "--json_file", type=str, required=True, help="Json config file")
+parser.add_argument("-j", "--json_file", type=str, nargs='+', default=[], help="Json config file, one for all customers or one per -c")
+parser.add_argument("-f", "--customers_file", type=str, required=False, default=None, help='File with one "customer config.json" pair per line, - for stdin')
 parser.add_argument("-v", "--version", type=str, required=False, default="R11_2_2_14_888881", help="Target version for Staging")
-args = parser.parse_args()
+parser.add_argument("-t", "--online_timeout", type=int, required=False, default=300, help="Seconds to wait for sites to be online and stable (default: 300)")
+parser.add_argument("-w", "--stability_window", type=int, required=False, default=70, help="Seconds all sites must stay online in a row (default: 70)")
+parser.add_argument("-i", "--poll_interval", type=int, required=False, default=10, help="Seconds between site status checks (default: 10)")
+parser.add_argument("-P", "--parallel", type=int, required=False, default=8, help="Customers provisioned at the same time (default: 8)")
 
 environment = "localstack"
 brand_name = "sdwan-onprem-brand"
 msp_name = "sdwan-onprem-msp"
-customer_name = args.customer_name
-localstack_ip = args.localstack_ip
-config_file = args.json_file
-version = args.version
-s = requests.Session()
-with open(config_file) as json_file:
-    site_data=json.load(json_file)["sites"]
-mcn_serial = [site["serial"] for site in site_data if site["name"].endswith("mcn")][0]
-branch_serial = [site["serial"] for site in site_data if site["name"].endswith("branch")][0]
-
-my_api = OrchestratorAPIClient(environment, brand_name, msp_name, customer_name, localstack_ip)
+ORCHESTRATOR_CLIENT = os.getenv('ORCHESTRATOR_CLIENT') or 'orchestrator_utils'
 
-if __name__ == "__main__":
-    if not my_api.create_customer(customer_name):
-        sys.exit(1)
-    if not my_api.import_config(config_file):
-        sys.exit(1)
-    if not my_api.patch_serial("mcn", mcn_serial):
-        sys.exit(1)
-    if not my_api.patch_serial("branch", branch_serial):
-        sys.exit(1)
-    if not my_api.set_version(version):
-        sys.exit(1)
-    timer, counter = 0, 3
-    url = "{}/{}/policy/v1/customer/{}/status".format(my_api.api_endpoint, my_api.ccId, my_api.customer_id)
-    while timer < 300:
-        sites_status = requests.get(url, headers=my_api.headers, verify=my_api.verify).json()["cmSiteStatus"]
+def patch_serials(api, serials):
+    # Serial patches of different sites are independent of each other
+    with ThreadPoolExecutor(max_workers=len(serials)) as executor:
+        results = list(executor.map(lambda site: api.patch_serial(*site), serials))
+    return all(results)
+
+def wait_sites_online(api, session, timeout, stability_window, poll_interval, log=print):
+    url = "{}/{}/policy/v1/customer/{}/status".format(api.api_endpoint, api.ccId, api.customer_id)
+    start = time.monotonic()
+    online_since = None
+    while time.monotonic() - start < timeout:
+        sites_status = session.get(url, headers=api.headers, verify=api.verify).json()["cmSiteStatus"]
+        now = time.monotonic()
         if all(site["onlineStatus"] == "online" for site in sites_status):
-            counter += 1
+            online_since = online_since or now
+            if now - online_since >= stability_window:  # Sites are online and stable for the whole window
+                return True
         else:
-            print("Sites not yet online")
-            counter -= 1
-        if counter == 10:   # This is used to verify that sites are online and stable for some time
-            break
-        time.sleep(10)
-        timer += 10
-    outcome = my_api.stage_and_activate()
-    print("Stage and activate result: " + str(outcome))
+            log("Sites not yet online")
+            online_since = None
+        time.sleep(poll_interval)
+    log("Sites were not online for {}s within {}s".format(stability_window, timeout))
+    return False
+
+def read_customers(args):
+    if len(args.customer_name) != len(args.json_file) and len(args.json_file) != 1:
+        parser.error("-j takes one config file for all customers or one per -c")
+    configs = args.json_file * len(args.customer_name) if len(args.json_file) == 1 else args.json_file
+    customers = list(zip(args.customer_name, configs))
+    if args.customers_file:
+        with (sys.stdin if args.customers_file == '-' else open(args.customers_file)) as customers_file:
+            for number, line in enumerate(customers_file, 1):
+                words = line.split('#')[0].split()
+                if not words:
+                    continue
+                if len(words) != 2:
+                    parser.error(f"{args.customers_file}:{number}: expected \"customer config.json\"")
+                customers.append(tuple(words))
+    if not customers:
+        parser.error("-c with -j or -f is required")
+    names = [name for name, config in customers]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        parser.error(f"customers given more than once: {', '.join(duplicates)}")
+    return customers
+
+def provision(api_client, customer_name, config_file, args, session, log=print):
+    '''
+    Runs the provisioning pipeline of one customer and returns
+    (failed step or None, sites online, stage and activate outcome).
+    '''
+    with open(config_file) as json_file:
+        site_data=json.load(json_file)["sites"]
+    mcn_serial = [site["serial"] for site in site_data if site["name"].endswith("mcn")][0]
+    branch_serial = [site["serial"] for site in site_data if site["name"].endswith("branch")][0]
+
+    my_api = orchestrator_http.make_client(api_client, session, environment, brand_name, msp_name, customer_name,
+                                           args.localstack_ip)
+    with timing.phase("create_customer", customer=customer_name):
+        if not my_api.create_customer(customer_name):
+            return "create_customer", False, None
+    with timing.phase("import_config", customer=customer_name):
+        if not my_api.import_config(config_file):
+            return "import_config", False, None
+    with timing.phase("patch_serials", customer=customer_name):
+        if not patch_serials(my_api, [("mcn", mcn_serial), ("branch", branch_serial)]):
+            return "patch_serials", False, None
+    with timing.phase("set_version", customer=customer_name):
+        if not my_api.set_version(args.version):
+            return "set_version", False, None
+    with timing.phase("wait_sites_online", customer=customer_name):
+        online = wait_sites_online(my_api, session, args.online_timeout, args.stability_window, args.poll_interval, log)
+    with timing.phase("stage_and_activate", customer=customer_name):
+        outcome = my_api.stage_and_activate()
+    log("Stage and activate result: " + str(outcome))
+    return None, online, outcome
+
+def provision_customers(api_client, customers, args, session):
+    # Every customer has its own API client, they only share the HTTP pool and the workers
+    def run(customer):
+        customer_name, config_file = customer
+        log = lambda msg: print(f"[{customer_name}] {msg}", flush=True)
+        begin = time.monotonic()
+        try:
+            with timing.phase(customer_name, kind='customer'):
+                failed, online, outcome = provision(api_client, customer_name, config_file, args, session, log)
+        except Exception as e:
+            failed, online, outcome = str(e) or type(e).__name__, False, None
+        return customer_name, failed, online, outcome, time.monotonic() - begin
+
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        return list(executor.map(run, customers))
+
+def print_results(results):
+    print(f"\n{'customer':<24} {'result':<7} {'online':<6} {'seconds':>8}  failed step / activate outcome")
+    for customer_name, failed, online, outcome, duration in results:
+        print(f"{customer_name:<24} {'FAILED' if failed else 'OK':<7} {'yes' if online else 'no':<6} {duration:>8.1f}  "
+              f"{failed or outcome}")
+
+def cli(argv=None):
+    args = parser.parse_args(argv)
+    customers = read_customers(args)
+    timing.start()
+    api_client = importlib.import_module(ORCHESTRATOR_CLIENT).OrchestratorAPIClient
+    # The patches of a customer run two at a time, so two pooled connections per worker
+    s = orchestrator_http.make_session(max(orchestrator_http.DEFAULT_POOL_SIZE, 2 * args.parallel))
+
+    if len(customers) == 1:
+        customer_name, config_file = customers[0]
+        failed, online, outcome = provision(api_client, customer_name, config_file, args, s)
+        if failed:
+            sys.exit(1)
+        sys.exit(0)
+
+    results = provision_customers(api_client, customers, args, s)
+    print_results(results)
+    sys.exit(1 if any(failed for customer_name, failed, online, outcome, duration in results) else 0)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+'''
+ Pooled keep-alive HTTP layer for OrchestratorAPIClient calls.
+ Every call through one shared Session with a connection pool
+ sized for concurrent calls, instead of a new TCP connection and
+ TLS handshake per request. make_client() hands the session to an
+ API client whose constructor takes session=. A client without it,
+ like orchestrator_utils' that issues module level
+ requests.get/post/... calls, gets its module's requests bound to
+ the session. That patches the module global for the whole
+ process. When it is not possible bind() raises BindError, and
+ make_client() warns once and leaves that client's calls unpooled.
+
+ Usage:
+   session = orchestrator_http.make_session(pool_size=8)
+   my_api = orchestrator_http.make_client(OrchestratorAPIClient, session, environment, ...)
+   status = session.get(url, headers=my_api.headers, verify=my_api.verify)
+
+'''
+import sys
+import inspect
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 8
+
+_unbindable = set()     # modules make_client already warned about
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class SessionRequests:
+    '''
+    Stand-in for the requests module whose request functions go
+    through a shared Session; everything else (exceptions, codes,
+    packages) is looked up on the real module.
+    '''
+    def __init__(self, session):
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.session.get(url, params=params, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.session.options(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.session.post(url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.session.put(url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.session.patch(url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.session.delete(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+class BindError(RuntimeError):
+    pass
+
+
+def accepts_session(api_client):
+    return 'session' in inspect.signature(api_client).parameters
+
+
+def bind(session, module):
+    '''
+    Sends the module level requests calls of module through session.
+    '''
+    bound = getattr(module, 'requests', None)
+    if isinstance(bound, SessionRequests):
+        if bound.session is not session:
+            raise BindError(f"{module.__name__} is already bound to another session")
+        return session
+    if bound is not requests:
+        raise BindError(f"{module.__name__} does not call the requests module, its requests can not be pooled")
+    module.requests = SessionRequests(session)
+    return session
+
+
+def make_client(api_client, session, *args, **kwargs):
+    if accepts_session(api_client):
+        return api_client(*args, session=session, **kwargs)
+    module = sys.modules[api_client.__module__]
+    try:
+        bind(session, module)
+    except BindError as e:
+        # Pooling is an optimization, provisioning goes on with the client's own requests calls
+        if module.__name__ not in _unbindable:
+            _unbindable.add(module.__name__)
+            print(f"Warning: {e}, its calls are left as they are", file=sys.stderr, flush=True)
+    return api_client(*args, **kwargs)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+'''
+ Local stand-in for the Orchestrator API of a local-stack, used to
+ run network_config without a lab. An HTTP server keeps customers
+ in memory and answers the calls of a provisioning pipeline:
+ create customer, import config, patch serial, set version, site
+ status and stage and activate, each after a scripted latency. The
+ sites of a customer come online online_after seconds after its
+ version is set. Requests, distinct client connections and the
+ peak of requests in flight are counted.
+
+ OrchestratorAPIClient is a minimal client of this server with the
+ interface network_config uses from orchestrator_utils, plus a
+ session= argument: orchestrator_http.make_client() passes it the
+ pooled session, without one it uses the requests functions.
+
+  +----------------+   http   +------------------------+
+  | network_config |--------->| orchestrator_simulator |
+  +----------------+          +------------------------+
+
+  -h, --help  show this help message and exit
+  -s S        JSON file with scenario overrides
+  -t T        Seconds to keep serving (default: until interrupted)
+
+ Usage:
+   sim = orchestrator_simulator.OrchestratorSimulator({'online_after': 2}).start()
+   ... ORCHESTRATOR_CLIENT=orchestrator_simulator network_config.py -l 127.0.0.1:<sim.port> ...
+   sim.close()
+
+'''
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CC_ID = 'cc-sim'
+
+DEFAULT_SCENARIO = {
+    'latency': 0.05,            # seconds every request takes
+    'online_after': 1,          # seconds after set_version until the sites report online
+    'activate_time': 0.2,       # extra seconds of stage_and_activate
+    'fail': {},                 # customer name -> step answered with 500, i.e. {'cust3': 'set_version'}
+}
+
+
+class OrchestratorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    CUSTOMER = re.compile(rf'^/{CC_ID}/policy/v1/customer/([^/]+)/(config|site/([^/]+)/serial|version|status|stage_and_activate)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None):
+        payload = json.dumps(body if body is not None else {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def handle_request(self):
+        simulator = self.server.simulator
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        simulator.begin(self)
+        try:
+            time.sleep(simulator.scenario['latency'])
+            status, reply = simulator.route(self.command, self.path, body)
+        finally:
+            simulator.end()
+        self.reply(status, reply)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+
+
+class OrchestratorSimulator:
+    def __init__(self, scenario=None):
+        self.scenario = dict(DEFAULT_SCENARIO)
+        self.scenario.update(scenario or {})
+        self.lock = threading.Lock()
+        self.customers = {}         # id -> customer
+        self.requests = 0
+        self.clients = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.events = []
+        self.server = None
+        self.port = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), OrchestratorHandler)
+        self.server.daemon_threads = True
+        self.server.simulator = self
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def connections(self):
+        return len(self.clients)
+
+    def begin(self, handler):
+        with self.lock:
+            self.requests += 1
+            self.clients.add(handler.client_address)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def record(self, customer, step):
+        with self.lock:
+            self.events.append((time.monotonic(), customer['name'], step))
+
+    def failed(self, customer_name, step):
+        return self.scenario['fail'].get(customer_name) == step
+
+    def route(self, method, path, body):
+        if method == 'POST' and path == f"/{CC_ID}/customers":
+            return self.create_customer(body)
+        match = OrchestratorHandler.CUSTOMER.match(path)
+        if not match or match.group(1) not in self.customers:
+            return 404, {'error': f"no route for {method} {path}"}
+        customer = self.customers[match.group(1)]
+        action = 'serial' if match.group(3) else match.group(2)
+        handlers = {
+            ('POST', 'config'): self.import_config,
+            ('PUT', 'serial'): lambda customer, body: self.patch_serial(customer, match.group(3), body),
+            ('PUT', 'version'): self.set_version,
+            ('GET', 'status'): self.site_status,
+            ('POST', 'stage_and_activate'): self.stage_and_activate,
+        }
+        if (method, action) not in handlers:
+            return 405, {'error': f"{method} not allowed on {action}"}
+        return handlers[(method, action)](customer, body)
+
+    def create_customer(self, body):
+        if self.failed(body['name'], 'create_customer'):
+            return 500, {'error': 'create_customer failed'}
+        with self.lock:
+            customer = next((customer for customer in self.customers.values() if customer['name'] == body['name']), None)
+            if customer is None:
+                customer = {'id': f"cust-{len(self.customers) + 1}", 'name': body['name'], 'sites': [],
+                            'serials': {}, 'version': None, 'online_at': None, 'activated': False}
+                self.customers[customer['id']] = customer
+        self.record(customer, 'create_customer')
+        return 200, {'id': customer['id']}
+
+    def import_config(self, customer, body):
+        if self.failed(customer['name'], 'import_config'):
+            return 500, {'error': 'import_config failed'}
+        customer['sites'] = [site['name'] for site in body.get('sites', [])]
+        self.record(customer, 'import_config')
+        return 200, {'sites': len(customer['sites'])}
+
+    def patch_serial(self, customer, site, body):
+        if self.failed(customer['name'], 'patch_serial'):
+            return 500, {'error': 'patch_serial failed'}
+        customer['serials'][site] = body['serial']
+        self.record(customer, f"patch_serial {site}")
+        return 200, {}
+
+    def set_version(self, customer, body):
+        if self.failed(customer['name'], 'set_version'):
+            return 500, {'error': 'set_version failed'}
+        customer['version'] = body['version']
+        customer['online_at'] = time.monotonic() + self.scenario['online_after']
+        self.record(customer, 'set_version')
+        return 200, {}
+
+    def site_status(self, customer, body):
+        online = customer['online_at'] is not None and time.monotonic() >= customer['online_at']
+        return 200, {'cmSiteStatus': [{'name': site, 'onlineStatus': 'online' if online else 'offline'}
+                                      for site in customer['sites']]}
+
+    def stage_and_activate(self, customer, body):
+        time.sleep(self.scenario['activate_time'])
+        if self.failed(customer['name'], 'stage_and_activate'):
+            return 500, {'error': 'stage_and_activate failed'}
+        customer['activated'] = True
+        self.record(customer, 'stage_and_activate')
+        return 200, {'status': 'success'}
+
+
+class OrchestratorAPIClient:
+    '''
+    Client of OrchestratorSimulator with the constructor, attributes
+    and methods network_config uses from orchestrator_utils. Methods
+    return True on success like the real ones.
+    '''
+    def __init__(self, environment, brand_name, msp_name, customer_name, ip, session=None):
+        self.http = session or requests
+        self.environment = environment
+        self.customer_name = customer_name
+        self.api_endpoint = f"http://{ip}"
+        self.ccId = CC_ID
+        self.customer_id = None
+        self.headers = {'Content-Type': 'application/json'}
+        self.verify = False
+
+    def customer_url(self, path):
+        return f"{self.api_endpoint}/{self.ccId}/policy/v1/customer/{self.customer_id}/{path}"
+
+    def ok(self, response, step):
+        if response.status_code != 200:
+            print(f"{step} failed for {self.customer_name}: {response.status_code} {response.text}")
+            return False
+        return True
+
+    def create_customer(self, customer_name):
+        response = self.http.post(f"{self.api_endpoint}/{self.ccId}/customers", json={'name': customer_name},
+                                  headers=self.headers, verify=self.verify)
+        if not self.ok(response, 'create_customer'):
+            return False
+        self.customer_id = response.json()['id']
+        return True
+
+    def import_config(self, config_file):
+        with open(config_file) as json_file:
+            config = json.load(json_file)
+        return self.ok(self.http.post(self.customer_url('config'), json=config, headers=self.headers, verify=self.verify),
+                       'import_config')
+
+    def patch_serial(self, site, serial):
+        return self.ok(self.http.put(self.customer_url(f"site/{site}/serial"), json={'serial': serial},
+                                     headers=self.headers, verify=self.verify), 'patch_serial')
+
+    def set_version(self, version):
+        return self.ok(self.http.put(self.customer_url('version'), json={'version': version},
+                                     headers=self.headers, verify=self.verify), 'set_version')
+
+    def stage_and_activate(self):
+        return self.ok(self.http.post(self.customer_url('stage_and_activate'), headers=self.headers, verify=self.verify),
+                       'stage_and_activate')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve a simulated Orchestrator API on 127.0.0.1')
+    parser.add_argument('-s', help='JSON file with scenario overrides', default=None)
+    parser.add_argument('-t', type=float, help='Seconds to keep serving (default: until interrupted)', default=None)
+    script_namespace = parser.parse_args()
+
+    scenario = {}
+    if script_namespace.s:
+        with open(script_namespace.s) as scenario_file:
+            scenario = json.load(scenario_file)
+    sim = OrchestratorSimulator(scenario).start()
+    print(f"Simulated Orchestrator API listening on 127.0.0.1:{sim.port}, "
+          f"run network_config with ORCHESTRATOR_CLIENT=orchestrator_simulator -l 127.0.0.1:{sim.port}", flush=True)
+    try:
+        time.sleep(script_namespace.t) if script_namespace.t else threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    sim.close()
+    print(f"{sim.requests} requests over {sim.connections} connections, {len(sim.customers)} customers")
+    sys.exit(0)
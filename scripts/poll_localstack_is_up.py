@@ -2,7 +2,9 @@
 '''
  Script that polls status_file of local-stack until is UP
  and sdwan-ae-utm.zip for last line of sdwan_release file
- is published
+ is published and no longer being written. While status_file
+ is polled, local-stack-logs.out is streamed and the poll aborts
+ on the first line that matches a fatal pattern (see log_watcher.py)
 
   +-------+           +-------------+
   |       |    ssh    |             |
@@ -14,47 +16,50 @@
   -i I        VM ip where local-stack is running
   -u U        VM username
   -p P        VM password
+  -t T        Deadline in seconds for status_file to become UP
+  -z Z        Deadline in seconds for sdwan-ae-utm.zip to be published
+  -s S        Seconds sdwan-ae-utm.zip must be left unmodified
+  -f F        Fatal log pattern (regex), can be repeated
+  -g G        Progress log pattern (regex) to print, can be repeated
 
 '''
-import time
 import sys
 import re
 import pathlib
 import argparse
-import paramiko
+import timing
+import status_watcher
+import wait_for
+import log_watcher
 
 LS_BASEPATH = '/local-stack'
 UTM_BASEPATH = '/root/sdws/minio/download-firmware/auth/SDWAN/'
 
 def main(script_namespace):
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
     vm_ip = script_namespace.i
     vm_user = script_namespace.u
     vm_pass = script_namespace.p
+    deadline = script_namespace.t
 
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
+        client = ssh_pool.get_client(vm_ip, vm_user, vm_pass)
 
         print("Poll status_file")
-        cmd = f"cat {LS_BASEPATH}/status_file"
-        status_up = False
-        while status_up is False:
-            stdin, stdout, stderr = client.exec_command(cmd)
-            status = stdout.readlines()[0]
-            print(status)
-            if status == "UP\n":
-                status_up = True
-                break
-            elif status.upper() == "DOWN\n":
-                grep_cmd = f"grep 'DB migration failed' {LS_BASEPATH}/local-stack-logs.out"
-                stdin, stdout, stderr = client.exec_command(grep_cmd)
-                out = stdout.readlines()
-                if len(out) != 0:
-                    sys.exit("DB migration failure. Cannot bring-up localstack")
+        fatal = log_watcher.FATAL_PATTERNS + script_namespace.f
+        progress = log_watcher.PROGRESS_PATTERNS + script_namespace.g
+        with log_watcher.LogWatcher(client, fatal=fatal, progress=progress) as watcher:
+            status = watcher.run(status_watcher.wait_for_status, client,
+                                 lambda status: status.upper() in ('UP', 'DOWN'), deadline)
+            if status.upper() == "DOWN":
+                # The log may be written after status_file, search all of it
+                pattern, lines = watcher.search()
+                if pattern:
+                    print('\n'.join(lines))
+                    sys.exit(f"'{pattern}' in local-stack-logs.out. Cannot bring-up localstack")
                 sys.exit("Cannot bring-up localstack. Please investigate")
-            else:
-                time.sleep(60)
 
         print("Poll sdwan-ae-utm.zip of last line in sdwan_release")
         cmd = f"tail -n 1 {LS_BASEPATH}/sdwan_release"
@@ -63,19 +68,17 @@ def main(script_namespace):
         if not last_version:
             sys.exit('Could not get last version in sdwan_release file')
         formated_last_version = f"{last_version.split('_')[0]}.{last_version.split('_')[1]}"
-        cmd = f"ls {UTM_BASEPATH}/{formated_last_version}/sdwan-ae-utm.zip"
-        utm_zip_exists = False
-        while utm_zip_exists is False:
-            stdin, stdout, stderr = client.exec_command(cmd)
-            for line in stderr.readlines():
-                print(line)
-            if stdout.channel.recv_exit_status():
-                time.sleep(60)
-            else:
-                utm_zip_exists = True
-
+        utm_zip = f"{UTM_BASEPATH}/{formated_last_version}/sdwan-ae-utm.zip"
+        wait_for.wait(wait_for.remote_file(vm_ip, vm_user, vm_pass, utm_zip, script_namespace.s), script_namespace.z)
 
         client.close()
+    except log_watcher.FatalLogLine as e:
+        print('\n'.join(e.lines))
+        sys.exit(f"Cannot bring-up localstack, {e}")
+    except status_watcher.StatusTimeout as e:
+        sys.exit(f"Local-stack is not UP: {e}")
+    except wait_for.ProbeTimeout as e:
+        sys.exit(f"sdwan-ae-utm.zip is not published: {e}")
     except paramiko.AuthenticationException:
         sys.exit('Authentication failed')
     except paramiko.ssh_exception.BadHostKeyException:
@@ -83,18 +86,32 @@ def main(script_namespace):
     except paramiko.SSHException:
         sys.exit('Unable to establish SSH connection')
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Polls status_file of local-stack, until is UP')
     parser.add_argument('-i', help='VM ip where local-stack is running', required=True)
     parser.add_argument('-u', help='VM username', required=True)
     parser.add_argument('-p', help='VM password', required=True)
-    script_namespace = parser.parse_args()
+    parser.add_argument('-t', type=int, default=3600, help='Deadline in seconds for status_file to become UP (default: 3600)')
+    parser.add_argument('-z', type=int, default=3600, help='Deadline in seconds for sdwan-ae-utm.zip to be published (default: 3600)')
+    parser.add_argument('-s', type=int, default=30, help='Seconds sdwan-ae-utm.zip must be left unmodified (default: 30)')
+    parser.add_argument('-f', action='append', default=[], help="Fatal log pattern (regex), can be repeated (default: 'DB migration failed')")
+    parser.add_argument('-g', action='append', default=[], help="Progress log pattern (regex) to print, can be repeated (default: 'DB migration')")
+    script_namespace = parser.parse_args(argv)
 
     # Check IP validity
     pattern = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$")
     if not pattern.match(script_namespace.i):
         sys.exit('Invalid local-stack IP')
 
-    main(script_namespace)
+    # Check log patterns validity
+    for pattern in script_namespace.f + script_namespace.g:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            sys.exit(f"Invalid log pattern '{pattern}': {e}")
 
+    timing.start()
+    main(script_namespace)
 
+if __name__ == "__main__":
+    cli()
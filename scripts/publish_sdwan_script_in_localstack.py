@@ -4,6 +4,7 @@
  1. Copies sdwan script(utm_log_daemon)
     in a VM where local-stack runs
  2. Publishes sdwan script
+    (both skipped when the same script is already published)
 
   +-------+           +-------------+
   |       |    ssh    |             |
@@ -21,11 +22,16 @@
 import sys
 import pathlib
 import argparse
-import paramiko
+import timing
+import remote_exec
+import sftp_upload
 
 LOCALSTACK_BASEPATH = '/local-stack'
 
 def main(script_namespace):
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
     script_file = pathlib.Path(script_namespace.f)
     script_name = script_file.name
     vm_ip = script_namespace.i
@@ -37,12 +43,15 @@ def main(script_namespace):
         sys.exit('No file found')
 
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
-        sftp_client = client.open_sftp()
-        sftp_client.put(script_file, f"{LOCALSTACK_BASEPATH}/publish/scripts/{script_name}")
-        
+        client = ssh_pool.get_client(vm_ip, vm_user, vm_pass)
+        digest = sftp_upload.sha256(script_file)
+        remote_script = f"{LOCALSTACK_BASEPATH}/publish/scripts/{script_name}"
+        published_marker = f"/var/tmp/{script_name}.published"
+        if sftp_upload.is_published(client, published_marker, remote_script, digest):
+            print(f"{script_name} unchanged, skipping upload and publish")
+            sys.exit()
+        sftp_upload.upload(client, script_file, remote_script, digest)
+
         cmd = "ip -4 addr show dev docker0 | grep \"inet \" | awk \'{print $2}\' | cut -d/ -f1"
         stdin, stdout, stderr = client.exec_command(cmd)
         docker_bridge_ip = stdout.readlines()[0].rstrip()
@@ -50,11 +59,9 @@ def main(script_namespace):
             sys.exit('Could not get docker bridge ip')
 
         cmd = f"export INTERNAL_HOST_IP={docker_bridge_ip} && cd {LOCALSTACK_BASEPATH} && ./buildManager/publish-scripts.sh linux && ./publish/local-publish.sh"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        for line in stderr.readlines():
-            print(line)
-        if stdout.channel.recv_exit_status():
+        if remote_exec.run(client, cmd).exit_status:
             sys.exit('Could not publish script')
+        sftp_upload.mark_published(client, published_marker, digest)
         client.close()
     except paramiko.AuthenticationException:
         sys.exit('Authentication failed')
@@ -63,15 +70,18 @@ def main(script_namespace):
     except paramiko.SSHException:
         sys.exit('Unable to establish SSH connection')
     except IOError as e:
-        sys.exit('Could not copy script file' + e)
+        sys.exit('Could not copy script file: ' + str(e))
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Publish sdwan script in local-stack')
     parser.add_argument('-i', help='VM ip where local-stack is running', required=True)
     parser.add_argument('-u', help='VM username', required=True)
     parser.add_argument('-p', help='VM password', required=True)
     parser.add_argument('-f', help='script filepath', required=True)
-    script_namespace = parser.parse_args()
+    script_namespace = parser.parse_args(argv)
 
+    timing.start()
     main(script_namespace)
 
+if __name__ == "__main__":
+    cli()
@@ -4,6 +4,7 @@
  1. Copies utm-config-client binary
     in a VM where local-stack runs
  2. Publishes utm-config-client binary
+    (both skipped when the same binary is already published)
 
   +-------+           +-------------+
   |       |    ssh    |             |
@@ -22,11 +23,18 @@
 import sys
 import pathlib
 import argparse
-import paramiko
+import timing
+import remote_exec
+import sftp_upload
 
 LOCALSTACK_BASEPATH = '/local-stack'
+REMOTE_BINARY = '/var/tmp/utm-config-client'
+PUBLISHED_MARKER = f"{REMOTE_BINARY}.published"
 
 def main(script_namespace):
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
     binary_file = pathlib.Path(script_namespace.f)
     vm_ip = script_namespace.i
     vm_user = script_namespace.u
@@ -38,27 +46,23 @@ def main(script_namespace):
         sys.exit('No file found')
 
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(vm_ip, username=vm_user, password=vm_pass, allow_agent=False)
-        sftp_client = client.open_sftp()
-        sftp_client.put(binary_file, "/var/tmp/utm-config-client")
-        cmd = f"export MINIO_PRESENT=true; export MINIO_ENDPOINT=http://localhost:9000; export MINIO_ACCESS_KEY=minio; export MINIO_SECRET_KEY=minio123; export AWS_REGION=us1; {LOCALSTACK_BASEPATH}/buildManager/buildManager-linux -OPERATION upload -FILE /var/tmp/utm-config-client -PRODUCT=utm-config-client -BUILD=1 -MODEL=utm-config-client -AUTH_REQUIRED=true -UPLOAD_S3_BUCKET=download-firmware"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        for line in stderr.readlines():
-            print(line)
-        if stdout.channel.recv_exit_status():
-            sys.exit('Could not publish binary')
+        client = ssh_pool.get_client(vm_ip, vm_user, vm_pass)
+        digest = sftp_upload.sha256(binary_file)
+        if sftp_upload.is_published(client, PUBLISHED_MARKER, REMOTE_BINARY, digest):
+            print('utm-config-client unchanged, skipping upload and publish')
+        else:
+            sftp_upload.upload(client, binary_file, REMOTE_BINARY, digest)
+            cmd = f"export MINIO_PRESENT=true; export MINIO_ENDPOINT=http://localhost:9000; export MINIO_ACCESS_KEY=minio; export MINIO_SECRET_KEY=minio123; export AWS_REGION=us1; {LOCALSTACK_BASEPATH}/buildManager/buildManager-linux -OPERATION upload -FILE {REMOTE_BINARY} -PRODUCT=utm-config-client -BUILD=1 -MODEL=utm-config-client -AUTH_REQUIRED=true -UPLOAD_S3_BUCKET=download-firmware"
+            if remote_exec.run(client, cmd).exit_status:
+                sys.exit('Could not publish binary')
+            sftp_upload.mark_published(client, PUBLISHED_MARKER, digest)
 
         if sync_publish == 'false':
             print('No sync with publish.git repo selected')
             sys.exit()
 
         cmd = f"cd {LOCALSTACK_BASEPATH} && ./update_publish.sh"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        for line in stderr.readlines():
-            print(line)
-        if stdout.channel.recv_exit_status():
+        if remote_exec.run(client, cmd).exit_status:
             sys.exit('Could not clone publish.git repo')
         cmd = "ip -4 addr show dev docker0 | grep \"inet \" | awk \'{print $2}\' | cut -d/ -f1"
         stdin, stdout, stderr = client.exec_command(cmd)
@@ -66,10 +70,7 @@ def main(script_namespace):
         if not docker_bridge_ip:
             sys.exit('Could not get docker bridge ip')
         cmd = f"export INTERNAL_HOST_IP={docker_bridge_ip} && cd {LOCALSTACK_BASEPATH} && ./buildManager/publish-scripts.sh linux && ./publish/local-publish.sh"
-        stdin, stdout, stderr = client.exec_command(cmd)
-        for line in stderr.readlines():
-            print(line)
-        if stdout.channel.recv_exit_status():
+        if remote_exec.run(client, cmd).exit_status:
             sys.exit('Could not sync with publish.git repo')
 
         client.close()
@@ -82,13 +83,17 @@ def main(script_namespace):
     except IOError:
         sys.exit('Could not copy binary file')
 
-if __name__ == "__main__":
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Publish utm-config-client in local-stack')
     parser.add_argument('-i', help='VM ip where local-stack is running', required=True)
     parser.add_argument('-u', help='VM username', required=True)
     parser.add_argument('-p', help='VM password', required=True)
     parser.add_argument('-f', help='utm-config-client filepath', required=True)
     parser.add_argument('-s', help='[true|false] sync with publish.git repo', default='true')
-    script_namespace = parser.parse_args()
+    script_namespace = parser.parse_args(argv)
 
+    timing.start()
     main(script_namespace)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+ Docker registry HTTP API v2 manifest checks. Whether an image
+ exists is answered by a HEAD on /v2/<repository>/manifests/<tag>,
+ without pulling a single layer. Bearer tokens are fetched when
+ the registry asks for them and cached per repository, and all
+ requests go through one requests.Session so connections to the
+ registry are reused.
+
+ Usage:
+   checker = registry_v2.ManifestChecker(orchestrator_http.make_session())
+   found, detail = checker.exists('registry.local/orchestrator/svc1:1.0.0')
+
+'''
+import re
+import threading
+
+DOCKER_HUB = 'registry-1.docker.io'
+MANIFEST_TYPES = ', '.join([
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+])
+REQUEST_TIMEOUT = 30
+
+
+def parse_reference(image):
+    '''
+    Splits [registry[:port]/]repository[:tag|@digest] into
+    (registry, repository, tag or digest) the way docker does.
+    '''
+    name, _, digest = image.partition('@')
+    tag = None
+    if ':' in name.rsplit('/', 1)[-1]:
+        name, tag = name.rsplit(':', 1)
+    first, _, rest = name.partition('/')
+    if rest and ('.' in first or ':' in first or first == 'localhost'):
+        registry, repository = first, rest
+    else:
+        registry, repository = DOCKER_HUB, name if '/' in name else f"library/{name}"
+    return registry, repository, digest or tag or 'latest'
+
+
+def _challenge(header):
+    # WWW-Authenticate: Bearer realm="https://auth/token",service="registry",scope="repository:x:pull"
+    scheme, _, params = header.partition(' ')
+    return scheme.lower(), dict(re.findall(r'(\w+)="([^"]*)"', params))
+
+
+class ManifestChecker:
+    def __init__(self, session, endpoint=None, scheme='https', auth=None, timeout=REQUEST_TIMEOUT):
+        self.session = session
+        self.endpoint = endpoint.rstrip('/') if endpoint else None   # i.e. a mirror, replaces every registry
+        self.scheme = scheme
+        self.auth = auth
+        self.timeout = timeout
+        self.tokens = {}
+        self.lock = threading.Lock()
+
+    def manifest_url(self, registry, repository, reference):
+        base = self.endpoint or f"{self.scheme}://{registry}"
+        return f"{base}/v2/{repository}/manifests/{reference}"
+
+    def token(self, challenge, key):
+        with self.lock:
+            if key in self.tokens:
+                return self.tokens[key]
+        params = {name: challenge[name] for name in ('service', 'scope') if name in challenge}
+        response = self.session.get(challenge['realm'], params=params, auth=self.auth, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        token = body.get('token') or body.get('access_token')
+        with self.lock:
+            self.tokens[key] = token
+        return token
+
+    def head(self, url, key):
+        headers = {'Accept': MANIFEST_TYPES}
+        with self.lock:
+            token = self.tokens.get(key)
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        response = self.session.head(url, headers=headers, timeout=self.timeout, auth=None if token else self.auth)
+        if response.status_code == 401 and 'WWW-Authenticate' in response.headers:
+            scheme, challenge = _challenge(response.headers['WWW-Authenticate'])
+            if scheme == 'bearer' and 'realm' in challenge:
+                with self.lock:
+                    self.tokens.pop(key, None)
+                headers['Authorization'] = f"Bearer {self.token(challenge, key)}"
+                response = self.session.head(url, headers=headers, timeout=self.timeout)
+        return response
+
+    def digest(self, image):
+        '''
+        Returns the Docker-Content-Digest of the manifest, the digest
+        docker records in RepoDigests also for a multi-arch index, or
+        None when the registry does not have it. Raises
+        requests.RequestException when the registry cannot answer.
+        '''
+        registry, repository, reference = parse_reference(image)
+        response = self.head(self.manifest_url(registry, repository, reference), (registry, repository))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.headers.get('Docker-Content-Digest') or None
+
+    def exists(self, image):
+        '''
+        Returns (True, digest) when the registry has the manifest,
+        otherwise (False, reason).
+        '''
+        # Imported here, settings_env only needs parse_reference
+        import requests
+        registry, repository, reference = parse_reference(image)
+        try:
+            response = self.head(self.manifest_url(registry, repository, reference), (registry, repository))
+        except (requests.RequestException, ValueError) as e:
+            return False, f"{image}: {e}"
+        if response.status_code == 200:
+            return True, response.headers.get('Docker-Content-Digest', '')
+        if response.status_code == 404:
+            return False, f"{image}: manifest unknown"
+        return False, f"{image}: HTTP {response.status_code}"
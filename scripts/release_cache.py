@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+'''
+ Node-side cache of published sdwan builds, the
+ sdwan_releases/<build> directories that publish-sdwan.sh
+ downloads on every local-stack VM. A build is kept as a tar
+ archive named after the build id next to the sha256 of the
+ archive. add_sdwan_release_in_localstack streams a cached build
+ into tar on the VM and only runs publish-sdwan.sh on a miss,
+ archiving the published directory back into the cache. An
+ archive whose checksum does not match is dropped and counts as
+ a miss. Size cap and LRU eviction are those of image_cache.
+
+  +-------+   tar -c / tar -x    +-------------+
+  |       |<====================>|             |
+  | cache |   ssh exec channel   | local-stack |
+  |       |                      |             |
+  +-------+                      +-------------+
+
+  -h, --help  show this help message and exit
+  -d D        Cache directory (default: $RELEASE_CACHE_DIR or ~/.cache/sdwan-releases)
+  -s S        Size cap in GiB, evicts down to it (default: 50)
+  action      stats (default), list, evict, clear or verify
+
+'''
+import os
+import sys
+import time
+import hashlib
+import argparse
+import image_cache
+
+DEFAULT_CACHE_DIR = os.getenv('RELEASE_CACHE_DIR') or os.path.expanduser('~/.cache/sdwan-releases')
+CHECKSUM_SUFFIX = '.sha256'
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class ReleaseCache(image_cache.ImageCache):
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=image_cache.DEFAULT_MAX_GIB * image_cache.GIB):
+        super().__init__(path, max_bytes)
+
+    def checksum_path(self, build):
+        return self.archive_path(build) + CHECKSUM_SUFFIX
+
+    def checksum(self, build):
+        try:
+            with open(self.checksum_path(build)) as checksum_file:
+                return checksum_file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def get(self, build):
+        '''
+        Returns (path, sha256) of the cached archive, or None on a
+        miss. An archive whose checksum is not recorded yet is a miss.
+        '''
+        path = super().get(build)
+        checksum = self.checksum(build)
+        if path is None or checksum is None:
+            return None
+        return path, checksum
+
+    def put(self, build, chunks):
+        digest = hashlib.sha256()
+
+        def hashed():
+            for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        size = super().put(build, hashed())
+        checksum_path = self.checksum_path(build)
+        tmp_path = f"{checksum_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as checksum_file:
+            checksum_file.write(digest.hexdigest() + '\n')
+        os.replace(tmp_path, checksum_path)
+        self.drop_orphans()
+        return size
+
+    def read(self, build, archive_path, checksum):
+        '''
+        Yields the archive in chunks and raises ChecksumMismatch
+        after the last one when it does not match checksum; the
+        archive is then removed from the cache.
+        '''
+        digest = hashlib.sha256()
+        with open(archive_path, 'rb') as archive:
+            for chunk in iter(lambda: archive.read(image_cache.CHUNK_SIZE), b''):
+                digest.update(chunk)
+                yield chunk
+        if digest.hexdigest() != checksum:
+            self.discard(build)
+            raise ChecksumMismatch(f"{build}: sha256 {digest.hexdigest()} instead of {checksum}")
+        self.count('bytes_loaded', os.path.getsize(archive_path))
+
+    def discard(self, build):
+        for path in (self.archive_path(build), self.checksum_path(build)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def drop_orphans(self):
+        # Checksums of archives that were evicted
+        with self.lock:
+            for name in os.listdir(self.path):
+                if name.endswith('.tar' + CHECKSUM_SUFFIX) and not os.path.exists(
+                        os.path.join(self.path, name[:-len(CHECKSUM_SUFFIX)])):
+                    os.remove(os.path.join(self.path, name))
+
+    def evict(self, max_bytes=None):
+        evicted = super().evict(max_bytes)
+        self.drop_orphans()
+        return evicted
+
+    def verify(self):
+        '''
+        Returns the builds whose archive did not match its checksum,
+        they are removed from the cache.
+        '''
+        corrupt = []
+        for mtime, size, name in self.entries():
+            build = name[:-len('.tar')]
+            checksum = self.checksum(build)
+            digest = hashlib.sha256()
+            with open(os.path.join(self.path, name), 'rb') as archive:
+                for chunk in iter(lambda: archive.read(image_cache.CHUNK_SIZE), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != checksum:
+                self.discard(build)
+                corrupt.append(build)
+        return corrupt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Inspect or trim the node-side sdwan build cache')
+    parser.add_argument('-d', help='Cache directory (default: $RELEASE_CACHE_DIR or ~/.cache/sdwan-releases)', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('-s', type=float, help='Size cap in GiB, evicts down to it (default: 50)', default=image_cache.DEFAULT_MAX_GIB)
+    parser.add_argument('action', nargs='?', choices=['stats', 'list', 'evict', 'clear', 'verify'], default='stats')
+    script_namespace = parser.parse_args()
+
+    cache = ReleaseCache(script_namespace.d, int(script_namespace.s * image_cache.GIB))
+    if script_namespace.action == 'list':
+        for mtime, size, name in reversed(cache.entries()):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))}  {size / image_cache.GIB:>7.2f} GiB  "
+                  f"{name[:-len('.tar')]}  {cache.checksum(name[:-len('.tar')])}")
+    elif script_namespace.action in ('evict', 'clear'):
+        evicted = cache.evict(0 if script_namespace.action == 'clear' else None)
+        cache.save_stats()
+        print(f"Evicted {len(evicted)} builds")
+    elif script_namespace.action == 'verify':
+        corrupt = cache.verify()
+        for build in corrupt:
+            print(f"Removed {build}, checksum mismatch")
+        print(f"{len(corrupt)} corrupt builds")
+    print(f"{len(cache.entries())} builds, {cache.size() / image_cache.GIB:.2f} GiB of {script_namespace.s:g} GiB")
+    print("Since created:", image_cache.format_stats(image_cache.load_stats(script_namespace.d)))
+    sys.exit(0)
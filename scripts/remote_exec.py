@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+'''
+ Remote command execution helper for long running commands.
+ The channel is waited on with select() instead of spinning on
+ exit_status_ready(), stdout and stderr are streamed together
+ line by line with timestamps, and the exit status is returned
+ once the remote side closes.
+
+ Usage:
+   result = remote_exec.run(client, "cd /local-stack && ./local-stack.sh down")
+   if result.exit_status:
+       sys.exit('local-stack.sh down failed')
+
+'''
+import time
+import select
+from datetime import datetime
+from collections import namedtuple
+
+Result = namedtuple('Result', ['exit_status', 'stdout', 'stderr'])
+
+
+class RemoteTimeout(Exception):
+    pass
+
+
+def print_line(stream, line):
+    prefix = 'stderr: ' if stream == 'stderr' else ''
+    print(f"[{datetime.now():%H:%M:%S}] {prefix}{line}", flush=True)
+
+
+class _LineBuffer:
+    def __init__(self, stream, on_line, collect):
+        self.stream = stream
+        self.on_line = on_line
+        self.lines = [] if collect else None
+        self.pending = b''
+
+    def feed(self, data):
+        self.pending += data
+        while b'\n' in self.pending:
+            line, self.pending = self.pending.split(b'\n', 1)
+            self.emit(line)
+
+    def flush(self):
+        if self.pending:
+            self.emit(self.pending)
+            self.pending = b''
+
+    def emit(self, line):
+        line = line.decode(errors='replace').rstrip('\r')
+        if self.lines is not None:
+            self.lines.append(line)
+        if self.on_line:
+            self.on_line(self.stream, line)
+
+
+def wait(channel, timeout=None, on_line=print_line, collect=True):
+    '''
+    Streams the output of an already started channel until it exits.
+    on_line(stream, line) is called for every line, stream being
+    'stdout' or 'stderr'; pass None to stay quiet.
+    '''
+    end = None if timeout is None else time.monotonic() + timeout
+    out = _LineBuffer('stdout', on_line, collect)
+    err = _LineBuffer('stderr', on_line, collect)
+    while True:
+        done = channel.eof_received or channel.closed
+        while channel.recv_ready():
+            out.feed(channel.recv(32768))
+        while channel.recv_stderr_ready():
+            err.feed(channel.recv_stderr(32768))
+        if done:
+            break
+        remaining = _remaining(end, timeout, channel)
+        # The channel's pipe becomes readable on new data, EOF or close
+        select.select([channel], [], [], remaining)
+    out.flush()
+    err.flush()
+    # The exit status may trail the EOF by a packet
+    if not channel.status_event.wait(_remaining(end, timeout, channel)):
+        raise RemoteTimeout(f"Remote command did not report an exit status within {timeout}s")
+    return Result(channel.recv_exit_status(), out.lines, err.lines)
+
+
+def _remaining(end, timeout, channel):
+    if end is None:
+        return None
+    remaining = end - time.monotonic()
+    if remaining <= 0:
+        channel.close()
+        raise RemoteTimeout(f"Remote command did not finish within {timeout}s")
+    return remaining
+
+
+def run(client, command, timeout=None, on_line=print_line, collect=True, get_pty=False):
+    stdin, stdout, stderr = client.exec_command(command, get_pty=get_pty)
+    stdin.close()
+    return wait(stdout.channel, timeout, on_line, collect)
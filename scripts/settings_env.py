@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''
+ Parser for the orchestrator service images of local-stack's
+ settings.env, whose lines look like
+
+   SVC1_IMAGE=sdwan-services-development:svc1:registry.local:5000/orchestrator/svc1:1.0.0 \
+
+ i.e. <variable>=<label>:<service>:<image reference>, where the
+ reference may carry a registry port. A fingerprint of the parsed
+ references and the set of references already processed on a VM
+ let repeat runs skip the images that did not change.
+
+ Usage:
+   images = settings_env.parse(text, 'development')
+   changed = settings_env.changed(images, settings_env.load_state(state_text))
+
+'''
+import json
+import hashlib
+from collections import namedtuple
+import registry_v2
+
+LABEL_PREFIX = 'sdwan-services-'
+
+ImageRef = namedtuple('ImageRef', ['variable', 'service', 'registry', 'repository', 'tag', 'ref'])
+
+
+def parse_line(line):
+    '''
+    Returns (label, ImageRef) for an image line, None for anything else.
+    '''
+    line = line.strip()
+    if line.endswith('\\'):
+        line = line[:-1].rstrip()
+    if not line or line.startswith('#') or '=' not in line:
+        return None
+    variable, _, value = line.partition('=')
+    value = value.strip().strip('"\'')
+    parts = value.split(':', 2)
+    if len(parts) != 3 or not parts[0].startswith(LABEL_PREFIX) or not parts[2]:
+        return None
+    label, service, ref = parts
+    registry, repository, tag = registry_v2.parse_reference(ref)
+    return label, ImageRef(variable.strip(), service, registry, repository, tag, ref)
+
+
+def parse(text, services_registry):
+    '''
+    Returns the ImageRefs of the services_registry label in file order.
+    '''
+    label = LABEL_PREFIX + services_registry
+    images = []
+    for line in text.splitlines():
+        parsed = parse_line(line)
+        if parsed and parsed[0] == label:
+            images.append(parsed[1])
+    return images
+
+
+def fingerprint(images):
+    digest = hashlib.sha256()
+    for image in sorted(image.ref for image in images):
+        digest.update(image.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def load_state(text):
+    try:
+        state = json.loads(text)
+        return {'fingerprint': state['fingerprint'], 'refs': set(state['refs'])}
+    except (ValueError, KeyError, TypeError):
+        return {'fingerprint': None, 'refs': set()}
+
+
+def dump_state(images, done):
+    '''
+    done is the set of references processed so far; the fingerprint
+    is only recorded once every image of the file is done.
+    '''
+    refs = sorted(image.ref for image in images if image.ref in done)
+    complete = len(refs) == len(images)
+    return json.dumps({'fingerprint': fingerprint(images) if complete else None, 'refs': refs})
+
+
+def changed(images, state):
+    '''
+    Returns the images whose reference was not processed last time.
+    '''
+    if state['fingerprint'] == fingerprint(images):
+        return []
+    return [image for image in images if image.ref not in state['refs']]
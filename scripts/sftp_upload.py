@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''
+ Content-addressed SFTP upload for the publish scripts.
+ The local sha256 is compared with a remote sha256sum and the
+ transfer is skipped when they match. Uploads go to a .part file
+ which is resumed from the last verified chunk after an
+ interruption and renamed into place once its checksum matches.
+
+ Usage:
+   digest = sftp_upload.sha256(local_path)
+   if sftp_upload.upload(client, local_path, remote_path, digest):
+       print('transferred')
+   if not sftp_upload.is_published(client, marker_path, remote_path, digest):
+       ...publish...
+       sftp_upload.mark_published(client, marker_path, digest)
+
+'''
+import os
+import time
+import hashlib
+import timing
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def sha256(path, length=None):
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, 'rb') as local_file:
+        while remaining is None or remaining > 0:
+            size = CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining)
+            chunk = local_file.read(size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _remote_output(client, cmd):
+    stdin, stdout, stderr = client.exec_command(cmd)
+    out = stdout.read().decode().strip()
+    if stdout.channel.recv_exit_status():
+        return None
+    return out
+
+
+def remote_sha256(client, remote_path, length=None):
+    if length is None:
+        out = _remote_output(client, f"sha256sum '{remote_path}'")
+    else:
+        out = _remote_output(client, f"head -c {length} '{remote_path}' | sha256sum")
+    return out.split()[0] if out else None
+
+
+def _resume_offset(client, sftp, local_path, part_path):
+    try:
+        remote_size = sftp.stat(part_path).st_size
+    except IOError:
+        return 0
+    offset = min(remote_size, os.path.getsize(local_path)) // CHUNK_SIZE * CHUNK_SIZE
+    # Only trust the partial file if its prefix matches ours
+    if offset and remote_sha256(client, part_path, offset) == sha256(local_path, offset):
+        return offset
+    return 0
+
+
+def upload(client, local_path, remote_path, digest=None):
+    '''
+    Returns True when bytes were transferred, False when the remote
+    file already had the same content. Raises IOError when the
+    uploaded file does not match the local checksum.
+    '''
+    local_path = str(local_path)
+    digest = digest or sha256(local_path)
+    if remote_sha256(client, remote_path) == digest:
+        return False
+
+    part_path = f"{remote_path}.part"
+    sftp = client.open_sftp()
+    try:
+        offset = _resume_offset(client, sftp, local_path, part_path)
+        if offset:
+            print(f"Resuming upload of {local_path} at {offset} bytes")
+        begin = time.monotonic()
+        with open(local_path, 'rb') as local_file, sftp.open(part_path, 'r+' if offset else 'w') as remote_file:
+            remote_file.set_pipelined(True)
+            local_file.seek(offset)
+            remote_file.seek(offset)
+            remote_file.truncate(offset)
+            for chunk in iter(lambda: local_file.read(CHUNK_SIZE), b''):
+                remote_file.write(chunk)
+        timing.add('transfer', remote_path, begin, bytes=os.path.getsize(local_path) - offset)
+        if remote_sha256(client, part_path) != digest:
+            sftp.remove(part_path)
+            raise IOError(f"Checksum mismatch after uploading {local_path}")
+        sftp.posix_rename(part_path, remote_path)
+    finally:
+        sftp.close()
+    return True
+
+
+def is_published(client, marker_path, remote_path, digest):
+    '''
+    The marker records what was last published, it is only trusted
+    while remote_path still has that content.
+    '''
+    if _remote_output(client, f"cat '{marker_path}'") != digest:
+        return False
+    return remote_sha256(client, remote_path) == digest
+
+
+def mark_published(client, marker_path, digest):
+    stdin, stdout, stderr = client.exec_command(f"echo {digest} > '{marker_path}'")
+    return stdout.channel.recv_exit_status() == 0
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+'''
+ Shared SSH connection pool for the local-stack scripts.
+ Authenticated transports are kept alive per (host, port, user)
+ and every command runs as a new channel on the same transport,
+ so a VM pays for a single key exchange and password auth per run.
+
+  +-------+                         +-------------+
+  |       |  1 transport, N chans   |             |
+  | node  |========================>| local-stack |
+  |       |                         |             |
+  +-------+                         +-------------+
+
+ Usage:
+   import ssh_pool
+   client = ssh_pool.get_client(vm_ip, vm_user, vm_pass)
+   stdin, stdout, stderr = client.exec_command(cmd)
+
+'''
+import os
+import atexit
+import socket
+import threading
+import paramiko
+import timing
+
+KEEPALIVE_INTERVAL = 30
+DEFAULT_PORT = 22
+# Lets the benchmarks and tests point the scripts at the local-stack simulator,
+# it only applies to loopback hosts so a leftover value never redirects a real VM
+SIM_PORT_ENV = 'LS_SIM_SSH_PORT'
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+RECONNECT_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+# Counters used by the benchmark and the timing records
+stats = {'handshakes': 0, 'reuses': 0, 'reconnects': 0, 'channels': 0}
+
+_pool = {}
+_pool_lock = threading.Lock()
+_held = False
+
+
+def resolve_port(host, port=None):
+    '''
+    Port to reach host on: the given one, else $LS_SIM_SSH_PORT for a
+    loopback host, else DEFAULT_PORT. Read on every call, the benchmarks
+    set it after the module is imported.
+    '''
+    if port:
+        return int(port)
+    sim_port = os.getenv(SIM_PORT_ENV)
+    if sim_port and host in LOOPBACK_HOSTS:
+        return int(sim_port)
+    return DEFAULT_PORT
+
+
+class PooledClient:
+    '''
+    Thin wrapper around paramiko.SSHClient exposing the subset of its
+    interface used by the scripts. Dead transports are re-established
+    transparently before running a command.
+    '''
+    def __init__(self, host, username, password, port=None, **connect_kwargs):
+        self.host = host
+        self.port = resolve_port(host, port)
+        self.username = username
+        self.password = password
+        self.connect_kwargs = {'allow_agent': False}
+        self.connect_kwargs.update(connect_kwargs)
+        self._client = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with timing.phase(self.host, kind='connect'):
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(self.host, port=self.port, username=self.username,
+                           password=self.password, **self.connect_kwargs)
+        transport = client.get_transport()
+        transport.set_keepalive(KEEPALIVE_INTERVAL)
+        # Channel requests are tiny packets, don't let Nagle hold them back
+        transport.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stats['handshakes'] += 1
+        self._client = client
+        return client
+
+    def is_active(self):
+        transport = self._client.get_transport() if self._client else None
+        return transport is not None and transport.is_active()
+
+    def reconnect(self, stale=None):
+        with self._lock:
+            if stale is not None and self._client is not stale and self.is_active():
+                # Another thread already replaced the dead transport
+                return self._client
+            if self._client:
+                self._client.close()
+                stats['reconnects'] += 1
+            return self.connect()
+
+    def ensure_connected(self):
+        with self._lock:
+            if self.is_active():
+                return self._client
+            if self._client:
+                self._client.close()
+                stats['reconnects'] += 1
+            return self.connect()
+
+    def get_transport(self):
+        return self.ensure_connected().get_transport()
+
+    def exec_command(self, command, **kwargs):
+        client = self.ensure_connected()
+        stats['channels'] += 1
+        try:
+            return timing.wrap_exec(command, client.exec_command(command, **kwargs))
+        except paramiko.AuthenticationException:
+            raise
+        except RECONNECT_ERRORS:
+            # Only a dead transport is worth a new handshake, a rejected
+            # channel on a live one is the caller's problem
+            if client.get_transport() is not None and client.get_transport().is_active():
+                raise
+            return timing.wrap_exec(command, self.reconnect(client).exec_command(command, **kwargs))
+
+    def open_sftp(self):
+        client = self.ensure_connected()
+        try:
+            return client.open_sftp()
+        except RECONNECT_ERRORS:
+            if client.get_transport() is not None and client.get_transport().is_active():
+                raise
+            return self.reconnect(client).open_sftp()
+
+    def connect_through(self, host, username, password, port=22, **connect_kwargs):
+        '''
+        Returns a new paramiko.SSHClient connected to host:port over a
+        direct-tcpip channel of this transport, no local port is bound.
+        The caller closes it.
+        '''
+        transport = self.get_transport()
+        channel = transport.open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0))
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            with timing.phase(f"{self.host} -> {host}", kind='connect'):
+                client.connect(host, port=port, username=username, password=password, sock=channel,
+                               allow_agent=False, look_for_keys=False, **connect_kwargs)
+        except Exception:
+            client.close()
+            channel.close()
+            raise
+        stats['handshakes'] += 1
+        return client
+
+    def close(self):
+        # Held connections outlive the script that closes them, see hold()
+        if not _held:
+            self.discard()
+
+    def discard(self):
+        key = (self.host, self.port, self.username)
+        with _pool_lock:
+            if _pool.get(key) is self:
+                del _pool[key]
+        with self._lock:
+            if self._client:
+                self._client.close()
+                self._client = None
+
+
+def get_client(host, username, password, port=None, **connect_kwargs):
+    port = resolve_port(host, port)
+    key = (host, port, username)
+    stale = None
+    with _pool_lock:
+        pooled = _pool.get(key)
+        if pooled is None or pooled.password != password:
+            stale = pooled
+            pooled = PooledClient(host, username, password, port, **connect_kwargs)
+            _pool[key] = pooled
+        else:
+            stats['reuses'] += 1
+    if stale:
+        stale.discard()
+    pooled.ensure_connected()
+    return pooled
+
+
+def run(host, username, password, command, port=None, timeout=None, **connect_kwargs):
+    client = get_client(host, username, password, port, **connect_kwargs)
+    stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+    out = stdout.read().decode()
+    err = stderr.read().decode()
+    return stdout.channel.recv_exit_status(), out, err
+
+
+def hold():
+    '''
+    Keeps pooled connections open when a script closes its client,
+    until close_all(). stages.py runs several scripts in one process
+    and the next script reuses them.
+    '''
+    global _held
+    _held = True
+
+
+def close_all():
+    with _pool_lock:
+        clients = list(_pool.values())
+    for pooled in clients:
+        pooled.discard()
+
+
+atexit.register(close_all)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+'''
+ Single entry point for the stage scripts. A stage runs as a call
+ to its script's cli(argv) in this interpreter instead of a new
+ python process, and a script (with paramiko, requests or yaml
+ behind it) is only imported when one of its stages runs. The
+ stages of a batch run one after the other in one interpreter and
+ reuse the ssh_pool connections of the stages before them.
+
+  +---------------------------+           +-------------+
+  | stages.py                 |    ssh    |             |
+  |  poll_up -> check_images  |==========>| local-stack |
+  |  -> ls_state ...          |  1 conn   |             |
+  +---------------------------+           +-------------+
+
+ Usage:
+   stages.py poll_up -i 10.0.0.1 -u user -p pass
+   stages.py -b batch.txt      one stage per line: <stage> <arguments>
+   stages.py -l
+
+  -h, --help  show this help message and exit
+  -b B        Batch file, - for stdin
+  -k          Run the rest of the batch after a failed stage
+  -l          List the stages and exit
+
+'''
+import os
+import sys
+import time
+import shlex
+import argparse
+import importlib
+import traceback
+import timing
+
+# Stage name -> script module, the module is imported on first use
+STAGES = {
+    'add_sdwan_release': 'add_sdwan_release_in_localstack',
+    'apply_license': 'workaround_utm_licenses',
+    'check_images': 'check_image_availability',
+    'device_ips': 'get_device_ip',
+    'ls_state': 'ls_state',
+    'network_config': 'network_config',
+    'poll_up': 'poll_localstack_is_up',
+    'publish_sdwan_script': 'publish_sdwan_script_in_localstack',
+    'publish_utm_config_client': 'publish_utm_config_client_in_localstack',
+    'testbed_yaml': 'generate_testbed_yaml',
+    'tf_output': 'tf_output',
+    'wait_for': 'wait_for',
+}
+
+
+def resolve(name):
+    # Script names work too, i.e. poll_localstack_is_up.py
+    name = name[:-3] if name.endswith('.py') else name
+    if name in STAGES:
+        return STAGES[name]
+    if name in STAGES.values():
+        return name
+    raise KeyError(name)
+
+
+def exit_status(exit):
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    # sys.exit('message') prints the message like the interpreter would
+    print(exit.code, file=sys.stderr, flush=True)
+    return 1
+
+
+def run(name, argv):
+    '''
+    Runs the stage and returns its exit status; a stage exits
+    through sys.exit() exactly like the standalone script.
+    '''
+    module = importlib.import_module(resolve(name))
+    if 'ssh_pool' in sys.modules:
+        sys.modules['ssh_pool'].hold()
+    cwd, saved_argv = os.getcwd(), sys.argv
+    # Usage and error messages name the script, not stages.py
+    sys.argv = [module.__name__ + '.py'] + list(argv)
+    begin = time.monotonic()
+    try:
+        module.cli(argv)
+        status = 0
+    except SystemExit as e:
+        status = exit_status(e)
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        # Some scripts chdir into the lab, the next stage starts where the batch did
+        os.chdir(cwd)
+        sys.argv = saved_argv
+        sys.stdout.flush()
+    timing.add('stage', name, begin, exit_status=status)
+    return status
+
+
+def read_batch(batch_file):
+    batch = []
+    with (sys.stdin if batch_file == '-' else open(batch_file)) as lines:
+        for number, line in enumerate(lines, 1):
+            words = shlex.split(line, comments=True)
+            if not words:
+                continue
+            try:
+                resolve(words[0])
+            except KeyError:
+                sys.exit(f"{batch_file}:{number}: unknown stage {words[0]}")
+            batch.append((words[0], words[1:]))
+    return batch
+
+
+def run_batch(batch, keep_going=False):
+    results = []
+    for name, argv in batch:
+        print(f"== {name}", flush=True)
+        begin = time.monotonic()
+        status = run(name, argv)
+        results.append((name, status, time.monotonic() - begin))
+        if status and not keep_going:
+            break
+    print(f"\n{'stage':<28} {'exit':>4} {'seconds':>8}")
+    for name, status, duration in results:
+        print(f"{name:<28} {status:>4} {duration:>8.2f}")
+    for name, argv in batch[len(results):]:
+        print(f"{name:<28} {'-':>4} {'-':>8}")
+    return next((status for name, status, duration in results if status), 0)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        # stages.py <stage> <arguments>, the arguments are the stage's own
+        try:
+            resolve(sys.argv[1])
+        except KeyError:
+            sys.exit(f"Unknown stage {sys.argv[1]}, stages.py -l lists them")
+        timing.start(resolve(sys.argv[1]))
+        sys.exit(run(sys.argv[1], sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description='Run stage scripts in this interpreter')
+    parser.add_argument('-b', help='Batch file, one stage per line: <stage> <arguments>, - for stdin', default=None)
+    parser.add_argument('-k', action='store_true', help='Run the rest of the batch after a failed stage')
+    parser.add_argument('-l', action='store_true', help='List the stages and exit')
+    script_namespace = parser.parse_args()
+
+    if script_namespace.l or not script_namespace.b:
+        for name, module in sorted(STAGES.items()):
+            print(f"{name:<28} {module}.py")
+        sys.exit(0)
+
+    batch = read_batch(script_namespace.b)
+    timing.start()
+    sys.exit(run_batch(batch, script_namespace.k))
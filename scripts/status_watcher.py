@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+'''
+ Event-driven watcher for the local-stack status_file.
+ A single long-lived exec channel runs one inotifywait -m on
+ the local-stack directory and emits the file contents whenever
+ it changes, so callers return as soon as the status moves.
+ When inotifywait is not installed on the VM the watcher
+ falls back to polling with an adaptive backoff.
+
+  +-------+   1 channel, pushed   +-------------+
+  |       |<----------------------|             |
+  | node  |     status changes    | local-stack |
+  |       |                       |             |
+  +-------+                       +-------------+
+
+ Usage:
+   status = status_watcher.wait_for_status(client, lambda s: s == 'UP', deadline=3600)
+
+'''
+import time
+import socket
+import timing
+
+LS_BASEPATH = '/local-stack'
+STATUS_FILE = f"{LS_BASEPATH}/status_file"
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 20
+BACKOFF_FACTOR = 1.5
+NO_INOTIFY = 127
+
+# One inotifywait for the whole watch. Its "Watches established." notice triggers the first
+# cat, so a change between that cat and the watch cannot be missed, and only events on
+# status_file itself are read, not the constant writes to the logs next to it
+WATCH_CMD = '''if ! command -v inotifywait >/dev/null 2>&1; then exit {no_inotify}; fi
+inotifywait -m -e close_write,moved_to --format %f {status_dir} 2>&1 | while read -r f; do
+  case "$f" in
+    'Watches established.'|{status_name}) echo "$(cat {status_file} 2>/dev/null)";;
+  esac
+done'''
+
+
+# inotifywait is missing on the VM or the watch died, watch_status falls back to polling
+class WatchUnavailable(RuntimeError):
+    pass
+
+
+class StatusTimeout(Exception):
+    def __init__(self, status, deadline):
+        super().__init__(f"status_file still '{status}' after {deadline}s")
+        self.status = status
+
+
+def _remaining(end):
+    if end is None:
+        return None
+    return max(end - time.monotonic(), 0)
+
+
+def _stream(client, status_file, end):
+    status_dir, status_name = status_file.rsplit('/', 1)
+    cmd = WATCH_CMD.format(no_inotify=NO_INOTIFY, status_file=status_file, status_dir=status_dir or '/',
+                           status_name=status_name)
+    # A pty makes sshd hang up the remote loop when the channel closes
+    stdin, stdout, stderr = client.exec_command(cmd, get_pty=True)
+    channel = stdout.channel
+    buffer = b''
+    try:
+        while True:
+            channel.settimeout(_remaining(end))
+            try:
+                data = channel.recv(4096)
+            except socket.timeout:
+                return
+            if not data:
+                # inotifywait missing (exit NO_INOTIFY) or the watch died early
+                raise WatchUnavailable(f"watch exited with {channel.recv_exit_status()}")
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                yield line.decode().strip()
+    finally:
+        channel.close()
+
+
+def _poll(client, status_file, end):
+    interval = MIN_POLL_INTERVAL
+    last = None
+    while True:
+        with timing.phase(status_file, kind='poll'):
+            stdin, stdout, stderr = client.exec_command(f"cat {status_file}")
+            status = stdout.read().decode().strip()
+        if status != last:
+            interval = MIN_POLL_INTERVAL
+            last = status
+        else:
+            interval = min(interval * BACKOFF_FACTOR, MAX_POLL_INTERVAL)
+        yield status
+        remaining = _remaining(end)
+        if remaining == 0:
+            return
+        with timing.phase(status_file, kind='sleep'):
+            time.sleep(interval if remaining is None else min(interval, remaining))
+
+
+def watch_status(client, status_file=STATUS_FILE, deadline=None):
+    '''
+    Yields the status_file contents every time it changes until the
+    deadline (seconds, None for no limit) expires.
+    '''
+    end = None if deadline is None else time.monotonic() + deadline
+    last = None
+    begin = time.monotonic()
+    try:
+        for status in _stream(client, status_file, end):
+            if status != last:
+                timing.add('watch', f"{status_file} -> {status}", begin)
+                last = status
+                yield status
+        return
+    except WatchUnavailable:
+        pass
+    for status in _poll(client, status_file, end):
+        if status != last:
+            last = status
+            yield status
+
+
+def wait_for_status(client, predicate, deadline=None, status_file=STATUS_FILE, on_change=print):
+    '''
+    Returns the first status for which predicate(status) is true, or
+    raises StatusTimeout when the deadline expires.
+    '''
+    status = None
+    for status in watch_status(client, status_file, deadline):
+        if on_change:
+            on_change(status)
+        if predicate(status):
+            return status
+    raise StatusTimeout(status, deadline)
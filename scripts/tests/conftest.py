@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts are flat modules next to this directory, imported the way stages.py does
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
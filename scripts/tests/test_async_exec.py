@@ -0,0 +1,77 @@
+import time
+import logging
+import pytest
+import ssh_pool
+import async_exec
+import remote_exec
+import ls_state
+import localstack_simulator
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    monkeypatch.setenv('TIMING_DIR', str(tmp_path / 'timing'))
+    simulator = localstack_simulator.Simulator().start()
+    yield simulator
+    simulator.close()
+
+
+@pytest.fixture
+def client(sim):
+    client = ssh_pool.PooledClient('127.0.0.1', localstack_simulator.USERNAME, localstack_simulator.PASSWORD, sim.port)
+    client.ensure_connected()
+    yield client
+    client.discard()
+
+
+def peak_concurrent(execs):
+    edges = sorted([(record['start'], 1) for record in execs] + [(record['end'], -1) for record in execs])
+    peak = running = 0
+    for at, step in edges:
+        running += step
+        peak = max(peak, running)
+    return peak
+
+
+@pytest.mark.parametrize('backend', async_exec.BACKENDS)
+def test_run_commands(client, backend):
+    jobs = [(client, f"sleep 0.3 && echo {i}") for i in range(20)]
+    start = time.monotonic()
+    results = async_exec.run_commands(jobs, backend, timeout=30, workers=10)
+    elapsed = time.monotonic() - start
+    assert [result.stdout for result in results] == [[str(i)] for i in range(20)]
+    assert all(result.exit_status == 0 for result in results)
+    # Ten at a time, two rounds of 0.3s rather than twenty
+    assert elapsed < 3
+
+
+def test_exit_status_and_stderr(client):
+    results = async_exec.run_commands([(client, 'no-such-command')], 'async', timeout=30)
+    assert results[0].exit_status == 127
+    assert results[0].stderr == ['simulator: unsupported command: no-such-command']
+
+
+def test_timeout(client):
+    results = async_exec.run_commands([(client, 'sleep 5 && echo late')], 'async', timeout=0.5)
+    assert isinstance(results[0], remote_exec.RemoteTimeout)
+
+
+def test_async_fleet_respects_workers(sim):
+    sim.scenario['git_fetch_time'] = 0.3
+    hosts = [f"127.0.0.1:{sim.port}"] * 6
+    results = ls_state.probe_fleet(hosts, localstack_simulator.USERNAME, localstack_simulator.PASSWORD, workers=2,
+                                   backend='async')
+    assert all(result.get('status') == 'UP' for result in results), results
+    assert peak_concurrent(sim.execs) == 2
+
+
+@pytest.mark.parametrize('backend', async_exec.BACKENDS)
+def test_fleet_host_deadline(sim, backend):
+    sim.scenario['hang'] = 5
+    start = time.monotonic()
+    results = ls_state.probe_fleet([f"127.0.0.1:{sim.port}"], localstack_simulator.USERNAME,
+                                   localstack_simulator.PASSWORD, host_timeout=1, backend=backend)
+    # Connection and probe share the one second of the host
+    assert time.monotonic() - start < 2.5
+    assert results[0]['error'] == 'timed out after 1s'
@@ -0,0 +1,95 @@
+import os
+import sys
+import subprocess
+import pytest
+import image_cache
+import registry_v2
+import check_image_availability
+import localstack_simulator
+from conftest import SCRIPTS_DIR
+
+
+@pytest.fixture
+def run(tmp_path):
+    sims = []
+
+    def run(scenario, *extra_args, check_only=True):
+        sim = localstack_simulator.Simulator(scenario).start()
+        sims.append(sim)
+        env = dict(os.environ, LS_SIM_SSH_PORT=str(sim.port), TIMING_DIR=str(tmp_path / 'timing'))
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, 'check_image_availability.py'), '-i', '127.0.0.1',
+                   '-u', localstack_simulator.USERNAME, '-p', localstack_simulator.PASSWORD, '-r', 'development',
+                   '-e', f"http://127.0.0.1:{sim.registry.port}"] + (['-c'] if check_only else []) + list(extra_args)
+        proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        return sim, proc.returncode, proc.stdout.decode()
+
+    yield run
+    for sim in sims:
+        sim.close()
+
+
+def pulls(sim):
+    return [record['command'] for record in sim.execs if 'docker pull' in record['command']]
+
+
+def test_all_images_available(run):
+    sim, status, out = run({}, '-w', '4')
+    assert status == 0, out
+    assert out.count('available') == len(sim.images())
+    assert sim.registry.requests == len(sim.images())
+    # One pooled session, far fewer connections than requests
+    assert sim.registry.connections <= 4
+    assert not pulls(sim)
+
+
+def test_missing_images_exit_1(run):
+    sim, status, out = run({'missing_images': ['svc3', 'svc7']})
+    assert status == 1
+    missing = out.split('The following images were not available in the registry:')[1].split()
+    assert sorted(missing) == sorted([sim.image_ref('svc3'), sim.image_ref('svc7')])
+    assert 'manifest unknown' in out
+    assert not pulls(sim)
+
+
+def test_bearer_auth(run):
+    sim, status, out = run({'registry_auth': True}, '--registry_user', 'ci', '--registry_password', 'secret')
+    assert status == 0, out
+    assert out.count('available') == len(sim.images())
+    assert not pulls(sim)
+
+
+@pytest.mark.parametrize('image, expected', [
+    ('registry.local/orchestrator/svc1:1.0.0', ('registry.local', 'orchestrator/svc1', '1.0.0')),
+    ('registry.local:5000/svc1', ('registry.local:5000', 'svc1', 'latest')),
+    ('localhost/svc1@sha256:abc', ('localhost', 'svc1', 'sha256:abc')),
+    ('ubuntu:22.04', (registry_v2.DOCKER_HUB, 'library/ubuntu', '22.04')),
+    ('team/tool', (registry_v2.DOCKER_HUB, 'team/tool', 'latest')),
+])
+def test_parse_reference(image, expected):
+    assert registry_v2.parse_reference(image) == expected
+
+
+def test_cache_save_then_load(run, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    sim, status, out = run({}, '--full', '-C', cache_dir, check_only=False)
+    assert status == 0, out
+    assert len(pulls(sim)) == len(sim.images())
+    stats = image_cache.load_stats(cache_dir)
+    assert (stats['misses'], stats['stored']) == (len(sim.images()), len(sim.images()))
+    assert stats['bytes_stored'] == len(sim.images()) * sim.scenario['image_size']
+
+    # A fresh VM gets every image streamed from the cache into docker load
+    sim, status, out = run({}, '--full', '-C', cache_dir, check_only=False)
+    assert status == 0, out
+    assert not pulls(sim)
+    assert sum(event.startswith('loaded ') for at, event in sim.events) == len(sim.images())
+    stats = image_cache.load_stats(cache_dir)
+    assert stats['hits'] == len(sim.images())
+    assert stats['bytes_loaded'] == len(sim.images()) * sim.scenario['image_size']
+
+
+def test_evicted_archive_is_a_miss(tmp_path, capsys):
+    # The archive went away between cache.get() and docker load, the image is pulled instead
+    assert not check_image_availability.load_image(None, 'registry.local/orchestrator/svc1:1.0.0',
+                                                   str(tmp_path / 'sha256_gone.tar'))
+    assert 'Could not load registry.local/orchestrator/svc1:1.0.0 from cache' in capsys.readouterr().out
@@ -0,0 +1,109 @@
+import yaml
+import pytest
+import generate_testbed_yaml
+
+TEMPLATE = '''
+ENV:
+  ORCHESTRATOR:
+    name: placeholder
+    ip: placeholder
+  CUSTOMER:
+    name: placeholder
+SITES:
+  BRANCH1:
+    basic_settings:
+      mode: client
+      model: cbvpx
+      site_name: BRANCH1_KVMVPX
+    vm_ip: placeholder
+    wan_links: 2
+  MCN:
+    basic_settings:
+      mode: primary_mcn
+      model: cbvpx
+      site_name: MCN_KVMVPX
+    vm_ip: placeholder
+  SPARE:
+    basic_settings:
+      mode: client
+      site_name: SPARE_KVMVPX
+    vm_ip: 10.9.9.9
+CLIENT:
+  ip: placeholder
+SERVER:
+  ip: placeholder
+'''
+
+OUTPUT = {
+    'mcn': {'value': {'name': 'MCN_LAB', 'mgmt_ip': '10.0.0.10'}},
+    'branch': {'value': {'name': 'BRANCH_LAB', 'mgmt_ip': '10.0.1.10'}},
+    'branch2': {'value': {'name': 'BRANCH2_LAB', 'mgmt_ip': '10.0.2.10'}},
+    'mcn-host1': {'value': {'name': 'mcn-host1', 'mgmt_ip': '10.0.0.20'}},
+    'branch-host1': {'value': {'name': 'branch-host1', 'mgmt_ip': '10.0.1.20'}},
+}
+
+
+def build():
+    template = yaml.safe_load(TEMPLATE)
+    return template, generate_testbed_yaml.build_testbed(
+        template, generate_testbed_yaml.discover_sites(OUTPUT), '10.1.1.1', 'lab1')
+
+
+def test_generated_values_merge_into_template_sites():
+    template, testbed = build()
+    assert testbed['SITES']['BRANCH1'] == {
+        'basic_settings': {'mode': 'client', 'model': 'cbvpx', 'site_name': 'BRANCH_LAB'},
+        'vm_ip': '10.0.1.10', 'wan_links': 2}
+    assert testbed['SITES']['MCN']['vm_ip'] == '10.0.0.10'
+    # The template itself is left untouched
+    assert template['SITES']['BRANCH1']['vm_ip'] == 'placeholder'
+
+
+def test_new_and_unknown_sites():
+    template, testbed = build()
+    assert testbed['SITES']['BRANCH2'] == {
+        'basic_settings': {'mode': 'client', 'model': 'cbvpx', 'site_name': 'BRANCH2_LAB'},
+        'vm_ip': '10.0.2.10', 'wan_links': 2}
+    assert testbed['SITES']['SPARE'] == template['SITES']['SPARE']
+    assert set(testbed['SITES']) == {'MCN', 'BRANCH1', 'BRANCH2', 'SPARE'}
+
+
+def test_hosts_only_fill_client_and_server():
+    template, testbed = build()
+    assert testbed['CLIENT']['ip'] == '10.0.0.20'
+    assert testbed['SERVER']['ip'] == '10.0.1.20'
+    assert not any('hosts' in site for site in testbed['SITES'].values())
+
+
+def test_inconsistent_output_raises():
+    duplicate = dict(OUTPUT, branch1={'value': {'name': 'BRANCH1_LAB', 'mgmt_ip': '10.0.3.10'}})
+    with pytest.raises(ValueError, match='branch and branch1 are both site BRANCH1'):
+        generate_testbed_yaml.discover_sites(duplicate)
+    no_branch = {output: entry for output, entry in OUTPUT.items() if not output.startswith('branch')}
+    with pytest.raises(ValueError, match='needs an mcn and at least one branch'):
+        generate_testbed_yaml.build_testbed(yaml.safe_load(TEMPLATE), generate_testbed_yaml.discover_sites(no_branch),
+                                            '10.1.1.1', 'lab1')
+
+
+def test_cli_summary_of_sparse_template_sites(tmp_path, monkeypatch, capsys):
+    template = yaml.safe_load(TEMPLATE)
+    template['SITES']['SPARE'] = {'vm_ip': None}
+    template['SITES']['EMPTY'] = None
+    template_path = tmp_path / 'testbed_template.yaml'
+    template_path.write_text(yaml.safe_dump(template))
+    (tmp_path / 'lab1').mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('agent_root_dir', str(tmp_path) + '/')
+    monkeypatch.setenv('labs_path', '')
+    monkeypatch.setenv('lab_name', 'lab1')
+    monkeypatch.setenv('TIMING_DIR', str(tmp_path / 'timing'))
+    monkeypatch.setattr(generate_testbed_yaml, 'load_terraform_output', lambda wd: OUTPUT)
+    with pytest.raises(SystemExit) as exit:
+        generate_testbed_yaml.cli(['-t', str(template_path), '10.1.1.1'])
+    assert exit.value.code == 0
+    out = capsys.readouterr().out
+    assert 'BRANCH2_LAB' in out
+    assert sorted(line.split() for line in out.splitlines() if line.split()[:1] in (['SPARE'], ['EMPTY'])) == [
+        ['EMPTY', '-', '-'], ['SPARE', '-', '-']]
+    testbed = yaml.safe_load((tmp_path / 'lab1' / 'edge_config.yaml').read_text())
+    assert testbed['SITES']['SPARE'] == {'vm_ip': None}
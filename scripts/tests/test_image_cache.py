@@ -0,0 +1,84 @@
+import os
+import pytest
+import image_cache
+
+KIB = 1024
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return image_cache.ImageCache(str(tmp_path / 'cache'), max_bytes=3 * KIB)
+
+
+def archive(size, fill=b'x'):
+    return [fill * (size // 2), fill * (size - size // 2)]
+
+
+def touch(cache, digest, mtime):
+    os.utime(cache.archive_path(digest), (mtime, mtime))
+
+
+def test_put_then_get(cache):
+    assert cache.put('sha256:a', archive(KIB)) == KIB
+    path = cache.get('sha256:a')
+    with open(path, 'rb') as stored:
+        assert stored.read() == b'x' * KIB
+    assert cache.get('sha256:b') is None
+    assert (cache.stats['hits'], cache.stats['misses']) == (1, 1)
+    assert (cache.stats['stored'], cache.stats['bytes_stored']) == (1, KIB)
+
+
+def test_failed_stream_keeps_nothing(cache):
+    def chunks():
+        yield b'x' * KIB
+        raise IOError('docker save failed')
+
+    with pytest.raises(IOError):
+        cache.put('sha256:a', chunks())
+    assert os.listdir(cache.path) == []
+    assert cache.stats['stored'] == 0
+
+
+def test_least_recently_used_evicted_first(cache):
+    for age, digest in enumerate(['sha256:a', 'sha256:b', 'sha256:c']):
+        cache.put(digest, archive(KIB))
+        touch(cache, digest, 1000 + age)
+    # A hit makes a the most recently used
+    assert cache.get('sha256:a')
+    cache.put('sha256:d', archive(KIB))
+    assert cache.get('sha256:b') is None
+    assert all(cache.get(digest) for digest in ['sha256:a', 'sha256:c', 'sha256:d'])
+    assert cache.stats['evicted'] == 1
+    assert cache.size() == 3 * KIB
+
+
+def test_evict_down_to_size(cache):
+    for age, digest in enumerate(['sha256:a', 'sha256:b', 'sha256:c']):
+        cache.put(digest, archive(KIB))
+        touch(cache, digest, 1000 + age)
+    assert cache.evict(KIB) == ['sha256_a.tar', 'sha256_b.tar']
+    assert cache.evict(0) == ['sha256_c.tar']
+    assert cache.entries() == []
+
+
+def test_archive_removed_after_get(cache):
+    cache.put('sha256:a', archive(KIB))
+    path = cache.get('sha256:a')
+    # Another run sharing the directory evicts it
+    os.remove(path)
+    assert cache.evict(0) == []
+    assert cache.get('sha256:a') is None
+
+
+def test_save_stats_accumulates(cache):
+    cache.put('sha256:a', archive(KIB))
+    cache.get('sha256:a')
+    cache.get('sha256:b')
+    assert cache.save_stats()['hits'] == 1
+
+    second = image_cache.ImageCache(cache.path, cache.max_bytes)
+    second.get('sha256:a')
+    totals = second.save_stats()
+    assert (totals['hits'], totals['misses'], totals['stored']) == (2, 1, 1)
+    assert image_cache.load_stats(cache.path) == totals
+    assert 'hit ratio 67%' in image_cache.format_stats(totals)
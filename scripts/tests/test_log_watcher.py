@@ -0,0 +1,34 @@
+import logging
+import pytest
+import ssh_pool
+import log_watcher
+import localstack_simulator
+
+LOG = ['starting services', 'DB migration started', 'worker exited with code 137', 'ERROR DB migration failed',
+       'worker exited with code 1']
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    monkeypatch.setenv('TIMING_DIR', str(tmp_path / 'timing'))
+    sim = localstack_simulator.Simulator().start()
+    for line in LOG:
+        sim.write_log(line)
+    client = ssh_pool.PooledClient('127.0.0.1', localstack_simulator.USERNAME, localstack_simulator.PASSWORD, sim.port)
+    client.ensure_connected()
+    yield client
+    client.discard()
+    sim.close()
+
+
+def test_search_uses_python_regexes(client):
+    # \d is a Python regex class that grep -E does not know
+    watcher = log_watcher.LogWatcher(client, fatal=[r'exited with code \d{3}', r'DB migration failed'])
+    assert watcher.search() == (r'exited with code \d{3}', ['worker exited with code 137'])
+
+
+def test_search_first_pattern_with_a_match(client):
+    watcher = log_watcher.LogWatcher(client, fatal=[r'(?i)panic', r'DB migration failed'])
+    assert watcher.search() == ('DB migration failed', ['ERROR DB migration failed'])
+    assert log_watcher.LogWatcher(client, fatal=[r'(?i)panic']).search() == (None, [])
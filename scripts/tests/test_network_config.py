@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+import orchestrator_simulator
+from conftest import SCRIPTS_DIR
+
+CONFIG = {'sites': [{'name': 'lab-mcn', 'serial': 'MCN-0001'}, {'name': 'lab-branch', 'serial': 'BR-0001'}]}
+
+
+@pytest.fixture
+def run(tmp_path):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(CONFIG))
+    sims = []
+
+    def run(scenario, customers, *extra_args):
+        sim = orchestrator_simulator.OrchestratorSimulator(dict({'latency': 0.05, 'online_after': 0.2}, **scenario)).start()
+        sims.append(sim)
+        env = dict(os.environ, ORCHESTRATOR_CLIENT='orchestrator_simulator', TIMING_DIR=str(tmp_path / 'timing'))
+        command = [sys.executable, os.path.join(SCRIPTS_DIR, 'network_config.py'), '-l', f"127.0.0.1:{sim.port}",
+                   '-j', str(config_file), '-t', '30', '-w', '0', '-i', '1'] + list(extra_args) + ['-c'] + customers
+        proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=120)
+        return sim, proc.returncode, proc.stdout.decode()
+
+    yield run
+    for sim in sims:
+        sim.close()
+
+
+def activated(sim):
+    return {customer['name'] for customer in sim.customers.values() if customer['activated']}
+
+
+def summary(out):
+    # customer -> (result, failed step / activate outcome)
+    lines = out.split('failed step / activate outcome\n')[1].splitlines()
+    return {line.split()[0]: (line.split()[1], line.split()[-1]) for line in lines if line.strip()}
+
+
+def test_customers_provisioned_concurrently(run):
+    customers = [f"customer{i}" for i in range(1, 7)]
+    sim, status, out = run({}, customers, '-P', '3')
+    assert status == 0, out
+    assert activated(sim) == set(customers)
+    assert {name: result for name, (result, detail) in summary(out).items()} == {name: 'OK' for name in customers}
+    # Three customers at a time, each patching its two serials at once
+    assert 1 < sim.peak_in_flight <= 6
+    # One pooled session, connections are reused across requests
+    assert sim.connections < sim.requests
+
+
+def test_parallel_bound(run):
+    sim, status, out = run({}, ['customer1', 'customer2', 'customer3'], '-P', '1')
+    assert status == 0, out
+    assert sim.peak_in_flight <= 2
+
+
+def test_failing_customer_exits_1(run):
+    customers = ['customer1', 'customer2', 'customer3']
+    sim, status, out = run({'fail': {'customer2': 'set_version'}}, customers, '-P', '3')
+    assert status == 1
+    results = summary(out)
+    assert results['customer2'] == ('FAILED', 'set_version')
+    assert results['customer1'][0] == results['customer3'][0] == 'OK'
+    assert activated(sim) == {'customer1', 'customer3'}
+
+
+def test_duplicate_customers_rejected(run):
+    sim, status, out = run({}, ['customer1', 'customer1'])
+    assert status == 2
+    assert 'customers given more than once: customer1' in out
+    assert sim.requests == 0
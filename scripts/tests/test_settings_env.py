@@ -0,0 +1,64 @@
+import settings_env
+
+SETTINGS = '''# orchestrator services
+SVC1_IMAGE=sdwan-services-development:svc1:registry.local:5000/orchestrator/svc1:1.0.0 \\
+SVC2_IMAGE="sdwan-services-development:svc2:registry.local:5000/orchestrator/svc2:2.1.0"
+SVC3_IMAGE=sdwan-services-staging:svc3:registry.local:5000/orchestrator/svc3:1.0.0
+SVC4_IMAGE=sdwan-services-development:svc4:registry.local/orchestrator/svc4
+LOG_LEVEL=debug
+'''
+
+
+def test_registry_with_port():
+    label, image = settings_env.parse_line(
+        'SVC1_IMAGE=sdwan-services-development:svc1:registry.local:5000/orchestrator/svc1:1.0.0')
+    assert label == 'sdwan-services-development'
+    assert image == settings_env.ImageRef('SVC1_IMAGE', 'svc1', 'registry.local:5000', 'orchestrator/svc1', '1.0.0',
+                                          'registry.local:5000/orchestrator/svc1:1.0.0')
+
+
+def test_continuation_backslash():
+    label, image = settings_env.parse_line(
+        '  SVC1_IMAGE=sdwan-services-development:svc1:registry.local:5000/orchestrator/svc1:1.0.0 \\\n')
+    assert image.ref == 'registry.local:5000/orchestrator/svc1:1.0.0'
+    assert image.tag == '1.0.0'
+
+
+def test_not_image_lines():
+    assert settings_env.parse_line('LOG_LEVEL=debug') is None
+    assert settings_env.parse_line('# SVC1_IMAGE=sdwan-services-development:svc1:registry.local/svc1:1.0.0') is None
+    assert settings_env.parse_line('SVC1_IMAGE=other-label:svc1:registry.local/svc1:1.0.0') is None
+    assert settings_env.parse_line('\\') is None
+
+
+def test_parse_keeps_the_label_of_the_registry():
+    images = settings_env.parse(SETTINGS, 'development')
+    assert [image.service for image in images] == ['svc1', 'svc2', 'svc4']
+    assert images[2].tag == 'latest'
+    assert [image.service for image in settings_env.parse(SETTINGS, 'staging')] == ['svc3']
+    assert settings_env.parse(SETTINGS, 'production') == []
+
+
+def test_unchanged_after_complete_run():
+    images = settings_env.parse(SETTINGS, 'development')
+    state = settings_env.load_state(settings_env.dump_state(images, {image.ref for image in images}))
+    assert settings_env.changed(images, state) == []
+
+
+def test_incremental_run_after_partial_failure():
+    images = settings_env.parse(SETTINGS, 'development')
+    # svc2 failed to pull, the fingerprint is not recorded and only svc2 is left
+    done = {images[0].ref, images[2].ref}
+    state = settings_env.load_state(settings_env.dump_state(images, done))
+    assert state['fingerprint'] is None
+    assert settings_env.changed(images, state) == [images[1]]
+
+    # A new tag of svc1 on top of it
+    updated = settings_env.parse(SETTINGS.replace('svc1:1.0.0', 'svc1:1.1.0'), 'development')
+    assert [image.service for image in settings_env.changed(updated, state)] == ['svc1', 'svc2']
+
+
+def test_unreadable_state_processes_everything():
+    images = settings_env.parse(SETTINGS, 'development')
+    for text in ('', 'not json', '{"refs": []}', '[]'):
+        assert settings_env.changed(images, settings_env.load_state(text)) == images
@@ -0,0 +1,94 @@
+import os
+import logging
+import pytest
+import paramiko
+import ssh_pool
+import sftp_upload
+import localstack_simulator
+
+CHUNK_SIZE = 64 * 1024
+REMOTE_PATH = '/home/sim/releases/build.tar'
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    monkeypatch.setenv('TIMING_DIR', str(tmp_path / 'timing'))
+    # Small chunks so a few hundred kB span several resumable chunks
+    monkeypatch.setattr(sftp_upload, 'CHUNK_SIZE', CHUNK_SIZE)
+    simulator = localstack_simulator.Simulator().start()
+    os.makedirs(os.path.dirname(simulator.local_path(REMOTE_PATH)))
+    yield simulator
+    simulator.close()
+
+
+@pytest.fixture
+def client(sim):
+    client = ssh_pool.PooledClient('127.0.0.1', localstack_simulator.USERNAME, localstack_simulator.PASSWORD, sim.port)
+    client.ensure_connected()
+    yield client
+    client.discard()
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / 'build.tar'
+    path.write_bytes(os.urandom(5 * CHUNK_SIZE + 1234))
+    return path
+
+
+def remote_bytes(sim, path=REMOTE_PATH):
+    with open(sim.local_path(path), 'rb') as remote_file:
+        return remote_file.read()
+
+
+def test_upload_then_dedup(sim, client, local_file):
+    assert sftp_upload.upload(client, local_file, REMOTE_PATH)
+    assert remote_bytes(sim) == local_file.read_bytes()
+    assert not os.path.exists(sim.local_path(f"{REMOTE_PATH}.part"))
+
+    written = sim.sftp_written
+    assert not sftp_upload.upload(client, local_file, REMOTE_PATH)
+    assert sim.sftp_written == written
+
+
+def test_interrupted_upload_resumes(sim, client, local_file, capsys):
+    size = local_file.stat().st_size
+    sim.scenario['sftp_fail_after'] = 3 * CHUNK_SIZE + 100
+    with pytest.raises((IOError, EOFError, paramiko.SSHException)):
+        sftp_upload.upload(client, local_file, REMOTE_PATH)
+    part = remote_bytes(sim, f"{REMOTE_PATH}.part")
+    assert 3 * CHUNK_SIZE <= len(part) < size
+    assert not os.path.exists(sim.local_path(REMOTE_PATH))
+
+    sim.sftp_written = 0
+    client.ensure_connected()
+    assert sftp_upload.upload(client, local_file, REMOTE_PATH)
+    assert f"Resuming upload of {local_file} at {3 * CHUNK_SIZE} bytes" in capsys.readouterr().out
+    assert sim.sftp_written == size - 3 * CHUNK_SIZE
+    assert remote_bytes(sim) == local_file.read_bytes()
+    assert not os.path.exists(sim.local_path(f"{REMOTE_PATH}.part"))
+
+
+def test_corrupted_part_restarts(sim, client, local_file, capsys):
+    with open(sim.local_path(f"{REMOTE_PATH}.part"), 'wb') as part_file:
+        part_file.write(os.urandom(2 * CHUNK_SIZE))
+    assert sftp_upload.upload(client, local_file, REMOTE_PATH)
+    assert 'Resuming' not in capsys.readouterr().out
+    assert sim.sftp_written == local_file.stat().st_size
+    assert remote_bytes(sim) == local_file.read_bytes()
+
+
+def test_published_marker_is_checked_against_the_file(sim, client, local_file):
+    marker = '/var/tmp/build.tar.published'
+    digest = sftp_upload.sha256(local_file)
+    sftp_upload.upload(client, local_file, REMOTE_PATH, digest)
+    assert sftp_upload.mark_published(client, marker, digest)
+    assert sftp_upload.is_published(client, marker, REMOTE_PATH, digest)
+
+    # The file changed or went away behind the marker's back
+    with open(sim.local_path(REMOTE_PATH), 'ab') as remote_file:
+        remote_file.write(b'changed')
+    assert not sftp_upload.is_published(client, marker, REMOTE_PATH, digest)
+    os.remove(sim.local_path(REMOTE_PATH))
+    assert not sftp_upload.is_published(client, marker, REMOTE_PATH, digest)
@@ -0,0 +1,11 @@
+import ssh_pool
+
+
+def test_simulator_port_only_for_loopback(monkeypatch):
+    monkeypatch.delenv(ssh_pool.SIM_PORT_ENV, raising=False)
+    assert ssh_pool.resolve_port('127.0.0.1') == ssh_pool.DEFAULT_PORT
+    # Set after the import, read on every call
+    monkeypatch.setenv(ssh_pool.SIM_PORT_ENV, '2222')
+    assert ssh_pool.resolve_port('127.0.0.1') == 2222
+    assert ssh_pool.resolve_port('10.0.0.5') == ssh_pool.DEFAULT_PORT
+    assert ssh_pool.resolve_port('127.0.0.1', '2200') == ssh_pool.resolve_port('10.0.0.5', 2200) == 2200
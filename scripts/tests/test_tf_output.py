@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import hashlib
+import subprocess
+import pytest
+import tf_output
+from conftest import SCRIPTS_DIR
+
+OUTPUT = {
+    'mcn': {'value': {'name': 'MCN_KVMVPX', 'mgmt_ip': '10.0.0.10'}},
+    'branch': {'value': {'name': 'BRANCH_KVMVPX', 'mgmt_ip': '10.0.1.10'}},
+}
+
+STUB = '''#!{python}
+import os
+import sys
+with open(os.environ['FAKE_TERRAFORM_CALLS'], 'a') as calls:
+    calls.write(' '.join(sys.argv[1:]) + '\\n')
+with open(os.environ['FAKE_TERRAFORM_OUTPUT']) as output:
+    sys.stdout.write(output.read())
+'''
+
+
+class FakeTerraform:
+    def __init__(self, root):
+        self.calls_path = root / 'calls'
+        self.output_path = root / 'output.json'
+        self.calls_path.write_text('')
+        self.set_output(OUTPUT)
+
+    def set_output(self, output):
+        self.output_path.write_text(json.dumps(output))
+
+    def calls(self):
+        return self.calls_path.read_text().splitlines()
+
+
+@pytest.fixture
+def terraform(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    stub = bin_dir / 'terraform'
+    stub.write_text(STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    fake = FakeTerraform(tmp_path)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_TERRAFORM_CALLS', str(fake.calls_path))
+    monkeypatch.setenv('FAKE_TERRAFORM_OUTPUT', str(fake.output_path))
+    monkeypatch.setenv('TIMING_DIR', str(tmp_path / 'timing'))
+    return fake
+
+
+@pytest.fixture
+def lab(tmp_path, monkeypatch):
+    # $agent_root_dir$labs_path$lab_name like on the Jenkins node
+    wd = tmp_path / 'labs' / 'lab1'
+    wd.mkdir(parents=True)
+    (wd / tf_output.STATE_FILE).write_text('{"serial": 1}\n')
+    monkeypatch.setenv('agent_root_dir', str(tmp_path))
+    monkeypatch.setenv('labs_path', '/labs/')
+    monkeypatch.setenv('lab_name', 'lab1')
+    return wd
+
+
+def run_script(script, *args):
+    return subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, script)] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_one_terraform_call_per_state(terraform, lab):
+    assert tf_output.load(str(lab)) == OUTPUT
+    assert tf_output.resolve(['mcn', 'branch'], wd=str(lab)) == ['10.0.0.10', '10.0.1.10']
+    assert tf_output.load(str(lab)) == OUTPUT
+    assert terraform.calls() == ['output -json']
+
+
+def test_scripts_share_the_cached_output(terraform, lab):
+    first = run_script('tf_output.py', 'mcn', 'branch')
+    second = run_script('get_device_ip.py', '10.0.0.1', 'branch', 'mcn')
+    assert first.returncode == 0 and first.stdout.split() == ['10.0.0.10', '10.0.1.10']
+    assert second.returncode == 0 and second.stdout.split() == ['10.0.1.10', '10.0.0.10']
+    assert len(terraform.calls()) == 1
+
+
+def test_cache_is_keyed_by_state_sha256(terraform, lab):
+    tf_output.load(str(lab))
+    with open(lab / tf_output.CACHE_FILE) as cache_file:
+        cache = json.load(cache_file)
+    assert cache['key'] == hashlib.sha256((lab / tf_output.STATE_FILE).read_bytes()).hexdigest()
+
+    # A new state means a new terraform call, the same state again does not
+    changed = dict(OUTPUT, branch={'value': {'name': 'BRANCH_KVMVPX', 'mgmt_ip': '10.0.2.10'}})
+    terraform.set_output(changed)
+    (lab / tf_output.STATE_FILE).write_text('{"serial": 2}\n')
+    assert tf_output.load(str(lab)) == changed
+    assert tf_output.load(str(lab)) == changed
+    assert len(terraform.calls()) == 2
+
+
+def test_stale_cache_without_state_file_is_not_used(terraform, lab):
+    tf_output.load(str(lab))
+    (lab / tf_output.STATE_FILE).unlink()
+    tf_output.load(str(lab))
+    assert len(terraform.calls()) == 2
+
+
+def test_missing_key_exits_1(terraform, lab):
+    result = run_script('tf_output.py', 'mcn', 'branch7')
+    assert result.returncode == 1
+    assert "No terraform output 'branch7'" in result.stderr
+    result = run_script('get_device_ip.py', '10.0.0.1', 'branch7')
+    assert result.returncode == 1
+    assert "No terraform output 'branch7'" in result.stderr
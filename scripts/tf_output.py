@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''
+ Cached resolver for `terraform output -json` of a lab.
+ terraform is run at most once per state change: the parsed
+ output is stored next to the state file, keyed by the state
+ file's sha256, and reused by every later caller.
+
+  -h, --help  show this help message and exit
+  -d D        Lab directory (default: $agent_root_dir$labs_path$lab_name)
+  -f F        Field to print for every key (default: mgmt_ip)
+  --json      Print the full values of the requested keys as json
+  keys        Terraform outputs to resolve i.e. branch mcn mcn-host1
+
+'''
+import os
+import sys
+import json
+import hashlib
+import argparse
+import subprocess
+import timing
+
+STATE_FILE = 'terraform.tfstate'
+CACHE_FILE = '.tf_output_cache.json'
+
+
+def lab_dir():
+    return os.getenv('agent_root_dir') + os.getenv('labs_path') + os.getenv('lab_name')
+
+
+def state_key(wd):
+    state_path = os.path.join(wd, STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    digest = hashlib.sha256()
+    with open(state_path, 'rb') as state_file:
+        for chunk in iter(lambda: state_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load(wd=None):
+    wd = wd or lab_dir()
+    key = state_key(wd)
+    cache_path = os.path.join(wd, CACHE_FILE)
+    if key and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+            if cache.get('key') == key:
+                return cache['output']
+        except (ValueError, KeyError):
+            pass
+
+    with timing.phase(wd, kind='terraform'):
+        output = json.loads(subprocess.check_output(['terraform', 'output', '-json'], cwd=wd))
+    if key:
+        # Write then rename so a concurrent reader never sees a partial cache
+        tmp_path = f"{cache_path}.{os.getpid()}"
+        with open(tmp_path, 'w') as cache_file:
+            json.dump({'key': key, 'output': output}, cache_file)
+        os.replace(tmp_path, cache_path)
+    return output
+
+
+def resolve(keys, field='mgmt_ip', wd=None):
+    tf_output = load(wd)
+    return [tf_output[key]['value'][field] for key in keys]
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='Resolve terraform outputs of a lab with a single terraform call')
+    parser.add_argument('-d', help='Lab directory (default: $agent_root_dir$labs_path$lab_name)', default=None)
+    parser.add_argument('-f', help='Field to print for every key (default: mgmt_ip)', default='mgmt_ip')
+    parser.add_argument('--json', action='store_true', help='Print the full values of the requested keys as json')
+    parser.add_argument('keys', nargs='+', help='Terraform outputs to resolve i.e. branch mcn mcn-host1')
+    script_namespace = parser.parse_args(argv)
+    timing.start()
+
+    try:
+        if script_namespace.json:
+            tf_output = load(script_namespace.d)
+            print(json.dumps({key: tf_output[key]['value'] for key in script_namespace.keys}))
+        else:
+            print(*resolve(script_namespace.keys, script_namespace.f, script_namespace.d), sep='\n')
+    except KeyError as e:
+        sys.exit(f"No terraform output {e}")
+
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    cli()
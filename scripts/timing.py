@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+'''
+ Per-step timing instrumentation shared by the scripts.
+ A script calls timing.start() once; from then on ssh_pool,
+ remote_exec, status_watcher and sftp_upload record every
+ connect, remote command, poll iteration and transfer, and the
+ script can time its own phases with timing.phase(). At exit
+ a JSON record is written to $TIMING_DIR (default: current
+ directory) and, when $TIMING_TEXTFILE_DIR is set, a Prometheus
+ textfile for the node-exporter textfile collector.
+
+ Usage:
+   timing.start('poll_localstack_is_up')
+   with timing.phase('wait_up'):
+       ...
+
+ Aggregating records of many runs:
+   timing.py summarize timings/*.json
+
+'''
+import os
+import sys
+import json
+import glob
+import time
+import atexit
+import argparse
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'localstack_script'
+
+
+class Recorder:
+    def __init__(self, script):
+        self.script = script
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.monotonic()
+        self.steps = []
+        self.lock = threading.Lock()
+        # Some scripts chdir into the lab, keep the records where they were started
+        self.cwd = os.getcwd()
+
+    def add(self, kind, name, start, end, **details):
+        step = {'kind': kind, 'name': name, 'offset': round(start - self.start, 4),
+                'duration': round(end - start, 4)}
+        step.update(details)
+        with self.lock:
+            self.steps.append(step)
+
+    def totals(self):
+        totals = {}
+        for step in self.steps:
+            total = totals.setdefault(step['kind'], {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] = round(total['seconds'] + step['duration'], 4)
+        return totals
+
+    def record(self):
+        return {
+            'script': self.script,
+            'started': self.started_at.isoformat(),
+            'wall': round(time.monotonic() - self.start, 4),
+            'totals': self.totals(),
+            'steps': self.steps,
+        }
+
+    def write(self, timing_dir=None, textfile_dir=None):
+        record = self.record()
+        timing_dir = timing_dir or os.getenv('TIMING_DIR') or self.cwd
+        os.makedirs(timing_dir, exist_ok=True)
+        stamp = self.started_at.strftime('%Y%m%dT%H%M%S')
+        _atomic_write(os.path.join(timing_dir, f"{self.script}-{stamp}-{os.getpid()}.json"), json.dumps(record, indent=2))
+        textfile_dir = textfile_dir or os.getenv('TIMING_TEXTFILE_DIR')
+        if textfile_dir:
+            os.makedirs(textfile_dir, exist_ok=True)
+            _atomic_write(os.path.join(textfile_dir, f"{self.script}.prom"), prometheus_text(record))
+        return record
+
+
+def _atomic_write(path, text):
+    # Readers (node-exporter, the Jenkins archiver) never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as tmp_file:
+        tmp_file.write(text)
+    os.replace(tmp_path, path)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+def prometheus_text(record):
+    script = _label(record['script'])
+    lines = [
+        f"# HELP {METRIC_PREFIX}_duration_seconds Wall-clock duration of the last run",
+        f"# TYPE {METRIC_PREFIX}_duration_seconds gauge",
+        f'{METRIC_PREFIX}_duration_seconds{{script="{script}"}} {record["wall"]}',
+        f"# HELP {METRIC_PREFIX}_step_seconds Total seconds spent per step kind in the last run",
+        f"# TYPE {METRIC_PREFIX}_step_seconds gauge",
+    ]
+    for kind, total in sorted(record['totals'].items()):
+        lines.append(f'{METRIC_PREFIX}_step_seconds{{script="{script}",kind="{_label(kind)}"}} {total["seconds"]}')
+    lines += [
+        f"# HELP {METRIC_PREFIX}_step_count Number of steps per step kind in the last run",
+        f"# TYPE {METRIC_PREFIX}_step_count gauge",
+    ]
+    for kind, total in sorted(record['totals'].items()):
+        lines.append(f'{METRIC_PREFIX}_step_count{{script="{script}",kind="{_label(kind)}"}} {total["count"]}')
+    phases = [step for step in record['steps'] if step['kind'] == 'phase']
+    if phases:
+        lines += [
+            f"# HELP {METRIC_PREFIX}_phase_seconds Duration of each named phase in the last run",
+            f"# TYPE {METRIC_PREFIX}_phase_seconds gauge",
+        ]
+        for step in phases:
+            lines.append(f'{METRIC_PREFIX}_phase_seconds{{script="{script}",phase="{_label(step["name"])}"}} {step["duration"]}')
+    return '\n'.join(lines) + '\n'
+
+
+recorder = None
+
+
+def start(script=None):
+    global recorder
+    if recorder is None:
+        script = script or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        recorder = Recorder(script)
+        atexit.register(finish)
+    return recorder
+
+
+def finish():
+    global recorder
+    if recorder is None:
+        return None
+    current, recorder = recorder, None
+    try:
+        return current.write()
+    except OSError as e:
+        print(f"Could not write timing record: {e}", file=sys.stderr)
+
+
+def add(kind, name, start, end=None, **details):
+    if recorder is not None:
+        recorder.add(kind, name, start, time.monotonic() if end is None else end, **details)
+
+
+@contextmanager
+def phase(name, kind='phase', **details):
+    begin = time.monotonic()
+    try:
+        yield
+    finally:
+        add(kind, name, begin, **details)
+
+
+class _TimedChannel:
+    '''
+    Proxy of a paramiko Channel that records the command as finished
+    the first time its exit status is collected.
+    '''
+    def __init__(self, channel, finished):
+        self._channel = channel
+        self._finished = finished
+
+    def recv_exit_status(self):
+        status = self._channel.recv_exit_status()
+        self._finished()
+        return status
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class _TimedFile:
+    def __init__(self, channel_file, channel):
+        self._file = channel_file
+        self.channel = channel
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        if not args:
+            self.channel._finished()
+        return data
+
+    def readlines(self, *args):
+        lines = self._file.readlines(*args)
+        self.channel._finished()
+        return lines
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def wrap_exec(command, streams):
+    '''
+    Returns exec_command()'s (stdin, stdout, stderr) wrapped so the
+    command is recorded once its output or exit status is consumed.
+    '''
+    if recorder is None:
+        return streams
+    stdin, stdout, stderr = streams
+    begin = time.monotonic()
+    done = []
+
+    def finished():
+        if not done:
+            done.append(True)
+            add('remote', command.split('\n', 1)[0][:200], begin)
+
+    channel = _TimedChannel(stdout.channel, finished)
+    return stdin, _TimedFile(stdout, channel), _TimedFile(stderr, channel)
+
+
+def summarize(paths):
+    per_kind = {}
+    for path in paths:
+        with open(path) as record_file:
+            record = json.load(record_file)
+        key = (record['script'], 'wall')
+        per_kind.setdefault(key, []).append(record['wall'])
+        for kind, total in record['totals'].items():
+            per_kind.setdefault((record['script'], kind), []).append(total['seconds'])
+    print(f"{'script':<34} {'step':<10} {'runs':>5} {'mean':>9} {'p95':>9} {'max':>9}")
+    for (script, kind), values in sorted(per_kind.items()):
+        values.sort()
+        p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+        print(f"{script:<34} {kind:<10} {len(values):>5} {sum(values) / len(values):>9.2f} {p95:>9.2f} {values[-1]:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Aggregate timing records of several runs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summarize_parser = subparsers.add_parser('summarize', help='Per script and step mean/p95/max over runs')
+    summarize_parser.add_argument('records', nargs='+', help='Timing json files or directories')
+    script_namespace = parser.parse_args()
+
+    paths = []
+    for record in script_namespace.records:
+        paths += sorted(glob.glob(os.path.join(record, '*.json'))) if os.path.isdir(record) else [record]
+    summarize(paths)
+    sys.exit(0)
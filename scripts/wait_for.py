@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+'''
+ Readiness probes that replace the fixed sleeps of the bring-up.
+ A probe is a callable returning (ready, detail); wait() calls it
+ until it is ready or the deadline expires. The interval starts
+ short, grows while nothing changes, goes back to the minimum as
+ soon as the detail changes, and is jittered so that several
+ waiters do not probe in lockstep.
+
+ Probes:
+   tcp(host, port)                          port accepts connections
+   http(url, status=200)                    url answers with status
+   ssh(host, user, password, command)       command exits with 0
+   remote_file(host, user, password, path)  path exists on the host
+   json_field(url, field, value)            field of the json document equals value
+   all_of(*probes)                          every probe is ready
+
+ Usage:
+   wait_for.wait(wait_for.tcp(localstack_ip, 22), deadline=600)
+
+ CLI, exits with 1 when the deadline expires:
+   wait_for.py -t 600 tcp 10.0.0.1 22
+   NITRO_LOGIN='{...}' wait_for.py -t 900 http https://10.0.0.2/sdwan/nitro/v1/config/login --data_env NITRO_LOGIN
+   wait_for.py -t 600 file -H 10.0.0.1 -u user -p pass /local-stack/status_file --min_age 30
+
+  -h, --help  show this help message and exit
+  -t T        Deadline in seconds (default: 600)
+  -i I        First interval between probes in seconds (default: 1)
+  -m M        Longest interval between probes in seconds (default: 20)
+  -j J        Relative jitter of the interval (default: 0.1)
+
+'''
+import os
+import ssl
+import sys
+import json
+import time
+import socket
+import random
+import argparse
+import urllib.error
+import urllib.request
+import timing
+
+MIN_INTERVAL = 1
+MAX_INTERVAL = 20
+BACKOFF_FACTOR = 1.5
+JITTER = 0.1
+PROBE_TIMEOUT = 10
+
+
+class ProbeTimeout(Exception):
+    def __init__(self, name, detail, deadline):
+        super().__init__(f"{name} not ready after {deadline}s: {detail}")
+        self.detail = detail
+
+
+def wait(probe, deadline, interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, jitter=JITTER, on_change=print):
+    '''
+    Returns the detail of the first ready result of probe(), or
+    raises ProbeTimeout when the deadline (seconds) expires.
+    '''
+    name = getattr(probe, 'name', 'probe')
+    end = time.monotonic() + deadline
+    current = interval
+    last = None
+    while True:
+        with timing.phase(name, kind='probe'):
+            ready, detail = probe()
+        if detail != last:
+            if on_change:
+                on_change(f"{name}: {detail}")
+            last = detail
+            current = interval
+        else:
+            current = min(current * BACKOFF_FACTOR, max_interval)
+        if ready:
+            return detail
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            raise ProbeTimeout(name, detail, deadline)
+        with timing.phase(name, kind='sleep'):
+            time.sleep(min(current * random.uniform(1 - jitter, 1 + jitter), remaining))
+
+
+def _named(name, probe):
+    probe.name = name
+    return probe
+
+
+def tcp(host, port, timeout=PROBE_TIMEOUT):
+    def probe():
+        try:
+            with socket.create_connection((host, port), timeout=timeout):
+                return True, 'open'
+        except OSError as e:
+            return False, str(e)
+    return _named(f"tcp {host}:{port}", probe)
+
+
+def _fetch(url, data=None, timeout=PROBE_TIMEOUT):
+    # The lab devices and local-stack use self-signed certificates
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    request = urllib.request.Request(url, data=data.encode() if data else None,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout, context=context) as response:
+            return response.status, response.read().decode(errors='replace')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode(errors='replace')
+
+
+def http(url, status=200, data=None, contains=None, timeout=PROBE_TIMEOUT):
+    def probe():
+        try:
+            code, body = _fetch(url, data, timeout)
+        except (OSError, ValueError) as e:
+            return False, str(getattr(e, 'reason', e))
+        if code != status:
+            return False, f"HTTP {code}"
+        if contains is not None and contains not in body:
+            return False, f"HTTP {code} without '{contains}'"
+        return True, f"HTTP {code}"
+    return _named(f"http {url}", probe)
+
+
+def json_field(url, field, value, data=None, timeout=PROBE_TIMEOUT):
+    '''
+    field is a dotted path into the document, list items are
+    addressed by their index i.e. sites.0.status
+    '''
+    def probe():
+        try:
+            code, body = _fetch(url, data, timeout)
+            document = json.loads(body)
+            for key in field.split('.'):
+                document = document[int(key)] if isinstance(document, list) else document[key]
+        except (OSError, ValueError) as e:
+            return False, str(getattr(e, 'reason', e))
+        except (KeyError, IndexError, TypeError):
+            return False, f"no {field}"
+        return str(document) == str(value), f"{field}={document}"
+    return _named(f"json {url} {field}", probe)
+
+
+def ssh(host, username, password, command, timeout=PROBE_TIMEOUT, **connect_kwargs):
+    # paramiko is only imported by the ssh probes, tcp and http start faster without it
+    import paramiko
+    import ssh_pool
+
+    def probe():
+        try:
+            client = ssh_pool.get_client(host, username, password, **connect_kwargs)
+            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+            out = stdout.read().decode(errors='replace').strip()
+            exit_status = stdout.channel.recv_exit_status()
+        except paramiko.AuthenticationException:
+            raise
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            return False, str(e) or type(e).__name__
+        detail = out.splitlines()[-1] if out else f"exit {exit_status}"
+        return exit_status == 0, detail
+    return _named(f"ssh {host} {command.splitlines()[0]}", probe)
+
+
+def remote_file(host, username, password, path, min_age=0, **connect_kwargs):
+    '''
+    With min_age the file must also be left unmodified for min_age
+    seconds, i.e. whoever publishes it is done writing.
+    '''
+    command = f"test -e '{path}'"
+    if min_age:
+        command += f" && test $(( $(date +%s) - $(stat -c %Y '{path}') )) -ge {min_age}"
+    probe = ssh(host, username, password, f"if {command}; then echo present; else echo missing; exit 1; fi", **connect_kwargs)
+    return _named(f"file {host}:{path}", probe)
+
+
+def all_of(*probes):
+    def probe():
+        details = []
+        for each in probes:
+            ready, detail = each()
+            details.append(f"{each.name}: {detail}")
+            if not ready:
+                return False, '; '.join(details)
+        return True, '; '.join(details)
+    return _named(' & '.join(each.name for each in probes), probe)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='Wait until a readiness probe succeeds')
+    parser.add_argument('-t', type=float, help='Deadline in seconds (default: 600)', default=600)
+    parser.add_argument('-i', type=float, help='First interval between probes in seconds (default: 1)', default=MIN_INTERVAL)
+    parser.add_argument('-m', type=float, help='Longest interval between probes in seconds (default: 20)', default=MAX_INTERVAL)
+    parser.add_argument('-j', type=float, help='Relative jitter of the interval (default: 0.1)', default=JITTER)
+    subparsers = parser.add_subparsers(dest='probe', required=True)
+
+    tcp_parser = subparsers.add_parser('tcp', help='Port accepts connections')
+    tcp_parser.add_argument('host')
+    tcp_parser.add_argument('port', type=int)
+
+    http_parser = subparsers.add_parser('http', help='Url answers with the expected status')
+    http_parser.add_argument('url')
+    http_parser.add_argument('--status', type=int, default=200, help='Expected status (default: 200)')
+    http_parser.add_argument('--data', default=None, help='Json body, the request becomes a POST')
+    http_parser.add_argument('--data_env', default=None, help='Environment variable holding the json body, for bodies with secrets')
+    http_parser.add_argument('--contains', default=None, help='Text the response body must contain')
+
+    json_parser = subparsers.add_parser('json', help='Field of a json document equals a value')
+    json_parser.add_argument('url')
+    json_parser.add_argument('field', help='Dotted path i.e. sites.0.status')
+    json_parser.add_argument('value')
+    json_parser.add_argument('--data', default=None, help='Json body, the request becomes a POST')
+    json_parser.add_argument('--data_env', default=None, help='Environment variable holding the json body, for bodies with secrets')
+
+    for name, help_text, positional in (('ssh', 'Remote command exits with 0', 'command'),
+                                        ('file', 'Remote file exists', 'path')):
+        ssh_parser = subparsers.add_parser(name, help=help_text)
+        ssh_parser.add_argument('-H', help='Remote host', required=True)
+        ssh_parser.add_argument('-u', help='Remote username', required=True)
+        ssh_parser.add_argument('-p', help='Remote password', required=True)
+        ssh_parser.add_argument(positional)
+    ssh_parser.add_argument('--min_age', type=int, default=0, help='Seconds the file must be left unmodified')
+    script_namespace = parser.parse_args(argv)
+
+    # A body on the command line shows in the process list, one with a password is passed in the environment
+    if getattr(script_namespace, 'data_env', None):
+        if script_namespace.data_env not in os.environ:
+            sys.exit(f"${script_namespace.data_env} is not set")
+        script_namespace.data = os.environ[script_namespace.data_env]
+
+    if script_namespace.probe == 'tcp':
+        probe = tcp(script_namespace.host, script_namespace.port)
+    elif script_namespace.probe == 'http':
+        probe = http(script_namespace.url, script_namespace.status, script_namespace.data, script_namespace.contains)
+    elif script_namespace.probe == 'json':
+        probe = json_field(script_namespace.url, script_namespace.field, script_namespace.value, script_namespace.data)
+    elif script_namespace.probe == 'ssh':
+        probe = ssh(script_namespace.H, script_namespace.u, script_namespace.p, script_namespace.command)
+    else:
+        probe = remote_file(script_namespace.H, script_namespace.u, script_namespace.p, script_namespace.path,
+                            script_namespace.min_age)
+
+    timing.start()
+    try:
+        wait(probe, script_namespace.t, script_namespace.i, script_namespace.m, script_namespace.j)
+    except ProbeTimeout as e:
+        sys.exit(str(e))
+    except Exception as e:
+        sys.exit(f"{probe.name} failed: {e}")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    cli()
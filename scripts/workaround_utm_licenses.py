@@ -8,171 +8,244 @@
 
 
   +------+           +-------------+         +-----+
-  |      |           |             |         |     |
+  |      |    ssh    |             | direct- |     |
   | node |---------->| Branch appl |-------->| UVM |
-  |      |           |             |         |     |
+  |      |           |             |  tcpip  |     |
   +------+           +-------------+         +-----+
 
+ The UVM session runs over a channel of the branch connection,
+ so no local port is bound and parallel runs don't collide.
+
   -h, --help  show this help message and exit
-  -i I        sd-wan branch ip
+  -i I        sd-wan branch ip, several ips are licensed concurrently
+  -k [K ...]  Terraform outputs of the lab to read branch ips from
+              i.e. branch branch2, every branch of the lab when none
+              is given (uses $agent_root_dir$labs_path$lab_name)
+  -w W        Branches licensed at the same time (default: 8)
   -u U        sd-wan branch username
   -p P        sd-wan branch password
   -f F        licenses filepath
 
 '''
-import re
 import sys
-from time import sleep
+import time
 import pathlib
 import argparse
-import paramiko
-import sshtunnel
+import timing
+import wait_for
+import tf_output
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-def main(script_namespace):
-    licenses_file = pathlib.Path(script_namespace.f) 
-    licenses_filename = licenses_file.name
-    sdwan_branch_ip = script_namespace.i
-    sdwan_branch_user = script_namespace.u
-    sdwan_branch_pass = script_namespace.p
+UTM_DEADLINE = 600
+UVM_IP = '169.254.100.2'
+UVM_RETRIES = 20
+SSHD_RETRIES = 10
+RETRY_INTERVAL = 5
+MAX_RETRY_INTERVAL = 30
+BACKOFF_FACTOR = 1.5
+MAX_WORKERS = 8
 
-    if not licenses_file.exists ():
-        sys.exit('No licenses file found')
-    
+class LicenseError(Exception):
+    pass
+
+def read_uid(licenses_file):
     with open(licenses_file, 'r') as json_file:
         json_data = json.load(json_file)
-        uid = json_data['licenses']['list'][0]['UID']
+        return json_data['licenses']['list'][0]['UID']
+
+def apply_licenses(branch_ip, username, password, licenses_file, uid, log=print):
+    # paramiko is only loaded once the arguments are parsed, --help does not pay for it
+    import paramiko
+    import ssh_pool
 
+    licenses_filename = licenses_file.name
 
     try:
-        c = paramiko.SSHClient()
-        c.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        c.connect(sdwan_branch_ip, username=sdwan_branch_user, password=sdwan_branch_pass)
+        c = ssh_pool.get_client(branch_ip, username, password, allow_agent=True)
         cmd = "/etc/platform/bin/vnf_security_mgr.sh --utm_uuid | cut -d= -f2 |  cut -c 5-23 | sha1sum -t | awk '{print $1}' | cut -c 1-12"
         stdin, stdout, stderr = c.exec_command(cmd)
-        uvm_passwd = stdout.readlines()[0].rstrip()
+        out = stdout.readlines()
+        uvm_passwd = out[0].rstrip() if out else ''
         if not uvm_passwd:
-            sys.exit('Could not get UVM password')
+            raise LicenseError('Could not get UVM password')
 
-        print("Allowing tcp forwarding and tunnel in sshd_conf...")
+        log("Allowing tcp forwarding and tunnel in sshd_conf...")
         cmd = "sudo sed -i -r 's/^(AllowTcpForwarding\s+).*/AllowTcpForwarding yes/' /etc/ssh/sshd_config"
         stdin, stdout, stderr = c.exec_command(cmd)
         if stdout.channel.recv_exit_status():
-            sys.exit('Could not allow tcp forwarding')
+            raise LicenseError('Could not allow tcp forwarding')
 
         cmd = "sudo sed -i -r 's/^(PermitTunnel\s+).*/PermitTunnel yes/' /etc/ssh/sshd_config"
         stdin, stdout, stderr = c.exec_command(cmd)
         if stdout.channel.recv_exit_status():
-            sys.exit('Could not permit tunnel')
+            raise LicenseError('Could not permit tunnel')
         
-        print("Restarting sshd...")
+        log("Restarting sshd...")
         cmd = "sudo /etc/init.d/S50sshd restart"
         stdin, stdout, stderr = c.exec_command(cmd)
-        c.close()
+        # Keep the pooled transport: established sessions survive the sshd restart
     except paramiko.AuthenticationException:
-        sys.exit('Authentication failed')
+        raise LicenseError('Authentication failed')
     except paramiko.ssh_exception.BadHostKeyException:
-        sys.exit('Host key could not be verified')
-    except paramiko.SSHException:
-        sys.exit('Unable to establish SSH connection')
-
+        raise LicenseError('Host key could not be verified')
+    except (paramiko.SSHException, EOFError, OSError):
+        raise LicenseError('Unable to establish SSH connection')
 
-    print("Sleeping for 10sec...")
-    sleep(10)
 
-
-    print("Checking UTM status...")
-    for i in range(20):
+    log("Checking UTM status...")
+    cmd = 'utm_status=$(/etc/platform/bin/vnf_security_mgr.sh --utm_status | head -n 1); echo "$utm_status"; [ "$utm_status" = Up ]'
+    try:
+        wait_for.wait(wait_for.ssh(branch_ip, username, password, cmd, allow_agent=True),
+                      UTM_DEADLINE, max_interval=30, on_change=log)
+    except wait_for.ProbeTimeout as e:
+        raise LicenseError('UTM status: ' + e.detail)
+    except paramiko.AuthenticationException:
+        raise LicenseError('Authentication failed')
+    except paramiko.ssh_exception.BadHostKeyException:
+        raise LicenseError('Host key could not be verified')
+
+    log("Connecting to UVM through the branch...")
+    branch = ssh_pool.get_client(branch_ip, username, password, allow_agent=True)
+    # sshd applies AllowTcpForwarding only to connections made after its restart. The restart
+    # is not waited for and the UTM check above ran on the old transport, so sshd may still be
+    # coming up: retry the new connection until it accepts it
+    for i in range(SSHD_RETRIES):
         try:
-            c = paramiko.SSHClient()
-            c.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            c.connect(sdwan_branch_ip, username=sdwan_branch_user, password=sdwan_branch_pass)
-            cmd = "/etc/platform/bin/vnf_security_mgr.sh --utm_status"
-            stdin, stdout, stderr = c.exec_command(cmd)
-            utm_status = stdout.readlines()[0].rstrip()
-            if utm_status == 'Up':
-                print(utm_status)
-                c.close()
-                break
-            else:
-                print(utm_status)
-                c.close()
-                sleep(30)
-            if i == 20:
-                sys.exit('UTM status: ' + utm_status)
+            branch.reconnect()
+            break
         except paramiko.AuthenticationException:
-            sys.exit('Authentication failed')
+            raise LicenseError('Authentication failed')
         except paramiko.ssh_exception.BadHostKeyException:
-            sys.exit('Host key could not be verified')
-        except paramiko.SSHException:
-            print('Unable to establish SSH connection')
-            c.close()
-            sleep(30)
-        except EOFError:
-            print('Could not establish connection to remote side of the tunnel')
-            c.close()
-            sleep(30)
-
-    print('Before ssh_tunnel')
-    for i in range(20):
+            raise LicenseError('Host key could not be verified')
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            log(f"sshd not accepting connections yet: {str(e) or type(e).__name__}")
+        time.sleep(min(RETRY_INTERVAL * BACKOFF_FACTOR ** i, MAX_RETRY_INTERVAL))
+    else:
+        raise LicenseError(f'sshd did not accept a new connection after {SSHD_RETRIES} retries')
+
+    for i in range(UVM_RETRIES):
+        client = None
         try:
-            with sshtunnel.open_tunnel(
-                    (sdwan_branch_ip, 22),
-                    ssh_username = sdwan_branch_user,
-                    ssh_password = sdwan_branch_pass,
-                    remote_bind_address = ("169.254.100.2", 22),
-                    local_bind_address = ('0.0.0.0', 20022)
-                    ) as tunnel:
-                client = paramiko.SSHClient()
-                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                client.connect('127.0.0.1', 20022, username="root", password=uvm_passwd)
-                print("Copying and linking utm licenses...")
-                cmd = f"echo {uid} > /usr/share/untangle/conf/uid"
-                stdin, stdout, stderr = client.exec_command(cmd)
-                if stdout.channel.recv_exit_status():
-                    sys.exit('Could not edit uid file')
-                
-                sftp_client = client.open_sftp()
-                sftp_client.put(licenses_file, f"/usr/share/untangle/conf/licenses/{licenses_filename}")
-            
-                cmd = f"cd /usr/share/untangle/conf/licenses && ln -sf {licenses_filename} licenses.js"
-                stdin, stdout, stderr = client.exec_command(cmd)
-                if stdout.channel.recv_exit_status():
-                    sys.exit('Could not create symlink')
-                
-                print("Restarting untangle-vm.service...")
-                cmd = 'systemctl restart untangle-vm.service'
-                stdin, stdout, stderr = client.exec_command(cmd)
-                if stdout.channel.recv_exit_status():
-                    sys.exit('Could not restart untangle-vm.service')
-                break
-                client.close()
+            client = branch.connect_through(UVM_IP, "root", uvm_passwd)
+            log("Copying and linking utm licenses...")
+            cmd = f"echo {uid} > /usr/share/untangle/conf/uid"
+            stdin, stdout, stderr = client.exec_command(cmd)
+            if stdout.channel.recv_exit_status():
+                raise LicenseError('Could not edit uid file')
+
+            sftp_client = client.open_sftp()
+            sftp_client.put(licenses_file, f"/usr/share/untangle/conf/licenses/{licenses_filename}")
+
+            cmd = f"cd /usr/share/untangle/conf/licenses && ln -sf {licenses_filename} licenses.js"
+            stdin, stdout, stderr = client.exec_command(cmd)
+            if stdout.channel.recv_exit_status():
+                raise LicenseError('Could not create symlink')
+
+            log("Restarting untangle-vm.service...")
+            cmd = 'systemctl restart untangle-vm.service'
+            stdin, stdout, stderr = client.exec_command(cmd)
+            if stdout.channel.recv_exit_status():
+                raise LicenseError('Could not restart untangle-vm.service')
+            break
         except paramiko.AuthenticationException:
-            sys.exit('Authentication failed')
+            raise LicenseError('Authentication failed')
         except paramiko.ssh_exception.BadHostKeyException:
-            sys.exit('Host key could not be verified')
+            raise LicenseError('Host key could not be verified')
+        except paramiko.ChannelException:
+            log('Could not open a channel to UVM through the branch')
         except paramiko.SSHException:
-            print('Unable to establish SSH connection')
-            client.close()
-            sleep(30)
+            log('Unable to establish SSH connection')
         except IOError:
-            print('Could not copy license file')
-            client.close()
-            sleep(30)
+            log('Could not copy license file')
         except EOFError:
-            print('Could not establish connection to remote side of the tunnel')
-            client.close()
-            sleep(30)
-        if i == 20:
-            sys.exit('Reached 20 sshtunnel retries')
+            log('Could not establish connection to remote side of the tunnel')
+        finally:
+            # Also when a LicenseError ends the retries
+            if client:
+                client.close()
+        time.sleep(min(RETRY_INTERVAL * BACKOFF_FACTOR ** i, MAX_RETRY_INTERVAL))
+    else:
+        raise LicenseError(f'Reached {UVM_RETRIES} UVM connection retries')
 
 
-if __name__ == "__main__":
+def apply_licenses_to_branches(branch_ips, username, password, licenses_file, uid, workers=MAX_WORKERS):
+    # Every branch has its own connection, so branches only wait on each other for a worker
+    def apply(branch_ip):
+        begin = time.monotonic()
+        log = lambda msg: print(f"[{branch_ip}] {msg}", flush=True)
+        try:
+            with timing.phase(branch_ip, kind='branch'):
+                apply_licenses(branch_ip, username, password, licenses_file, uid, log)
+            return branch_ip, None, time.monotonic() - begin
+        except Exception as e:
+            # Any error only fails its own branch, unexpected ones keep their type in the summary
+            error = str(e) if isinstance(e, LicenseError) else f"{type(e).__name__}: {e}"
+            log(f"FAILED: {error}")
+            return branch_ip, error, time.monotonic() - begin
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(apply, branch_ips))
+
+def lab_branch_ips(outputs):
+    if outputs:
+        return tf_output.resolve(outputs, 'mgmt_ip')
+    # Same naming rules as the testbed descriptor: branch, branch2, branch3 ...
+    from generate_testbed_yaml import discover_sites
+    branches = [site for site in discover_sites(tf_output.load()).values() if site['role'] == 'branch']
+    return [site['mgmt_ip'] for site in sorted(branches, key=lambda site: site['index'])]
+
+def print_summary(results):
+    print(f"\n{'branch':<16} {'result':<7} {'seconds':>8}  error")
+    for branch_ip, error, duration in results:
+        print(f"{branch_ip:<16} {'FAILED' if error else 'OK':<7} {duration:>8.1f}  {error or ''}")
+
+def main(script_namespace):
+    licenses_file = pathlib.Path(script_namespace.f)
+    branch_ips = list(script_namespace.i)
+    if script_namespace.k is not None:
+        try:
+            branch_ips += lab_branch_ips(script_namespace.k)
+        except KeyError as e:
+            sys.exit(f"No terraform output {e}")
+        except ValueError as e:
+            sys.exit(str(e))
+    if not branch_ips:
+        sys.exit('No branch ip given')
+
+    if not licenses_file.exists ():
+        sys.exit('No licenses file found')
+    uid = read_uid(licenses_file)
+
+    if len(branch_ips) == 1:
+        try:
+            apply_licenses(branch_ips[0], script_namespace.u, script_namespace.p, licenses_file, uid)
+        except LicenseError as e:
+            sys.exit(str(e))
+        return
+
+    results = apply_licenses_to_branches(branch_ips, script_namespace.u, script_namespace.p, licenses_file, uid,
+                                         script_namespace.w)
+    print_summary(results)
+    failed = [branch_ip for branch_ip, error, duration in results if error]
+    if failed:
+        sys.exit('License application failed on ' + ', '.join(failed))
+
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='Copy UTM licenses in UVM')
-    parser.add_argument('-i', help='sd-wan branch ip', required=True)
+    parser.add_argument('-i', nargs='+', default=[], help='sd-wan branch ip, several ips are licensed concurrently')
+    parser.add_argument('-k', nargs='*', default=None, help='Terraform outputs of the lab to read branch ips from i.e. branch branch2, '
+                                                            'every branch of the lab when none is given')
+    parser.add_argument('-w', type=int, default=MAX_WORKERS, help='Branches licensed at the same time (default: 8)')
     parser.add_argument('-u', help='sd-wan branch username', required=True)
     parser.add_argument('-p', help='sd-wan branch password', required=True)
     parser.add_argument('-f', help='licenses filepath', required=True)
-    script_namespace = parser.parse_args()
+    script_namespace = parser.parse_args(argv)
 
+    timing.start()
     main(script_namespace)
+
+
+if __name__ == "__main__":
+    cli()